@@ -246,11 +246,18 @@ export async function getWalletBalances() {
 }
 
 // AI Chatbot API
-export async function sendChatMessage(message: string, history: any[] = []) {
+// The server keeps the conversation; we only echo back its id.
+let chatConversationId: string | undefined;
+
+export async function sendChatMessage(message: string) {
   const response = await fetch(`${API_BASE_URL}/api/chat`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ message, history }),
+    body: JSON.stringify({ message, conversation_id: chatConversationId }),
   });
-  return response.json();
+  const data = await response.json();
+  if (data.conversation_id) {
+    chatConversationId = data.conversation_id;
+  }
+  return data;
 }
@@ -1,21 +1,110 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+from sqlalchemy import func, select, tuple_, update
 from sqlalchemy.orm import sessionmaker
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+import csv
+import io
+import json
+import re
 import requests
 import os
+import threading
+import time
 import uuid
-from models import Profile, Wallet, engine, Dashboard
+import zlib
+from balances import credit, credit_many, current_balance, debit, debit_many, open_wallet, total_balance
+from bulk_import import BulkImporter, job_active, job_paths, job_status, prune_jobs, run_job, spool_upload, update_job
+from cache import cache
+from chatbot.chatbot import get_ai_reply, get_cache_stats as get_ai_cache_stats
+from circle_client import backoff_delay, get_circle_client
+from idempotency import IDEMPOTENCY_HEADER, IdempotencyStore, idempotent, mark_upstream_call, upstream_key
+import metrics
+import payment_stats
+import profiling
+from payment_worker import payment_workers
+from reconciler import BalanceReconciler, token_balance
+from models import Profile, Wallet, engine, Dashboard, LedgerEntry, TRANSACTION_TYPES
 
 app = Flask(__name__)
 
 # Database session configuration
 Session = sessionmaker(bind=engine)
 
-# Circle API configuration
-CIRCLE_API_KEY = os.getenv('CircleAPI_KEY')  # Set in environment variables
-CIRCLE_API_URL = "https://api.circle.com/v1"
+# Responses replayed for retried requests that send an Idempotency-Key header
+idempotency_store = IdempotencyStore(Session)
+
+# Request, SQL and upstream metrics at GET /metrics
+metrics.init_app(app, engine)
+metrics.register_callback(
+    'paymind_cache_events_total', 'Profile/wallet cache lookups and invalidations',
+    ('event',),
+    lambda: {(event,): cache.stats()[event] for event in ('hits', 'misses', 'invalidations', 'errors')},
+    kind='counter'
+)
+
+
+def collect_ai_cache_events():
+    """AI reply cache and coalescing counters for the metrics endpoint"""
+    stats = get_ai_cache_stats()
+    return {
+        ('hits',): stats['hits'] + stats['disk_hits'],
+        ('misses',): stats['misses'],
+        ('coalesced',): stats['coalescing']['coalesced'],
+        ('upstream_calls',): stats['coalescing']['upstream_calls']
+    }
+
+
+metrics.register_callback(
+    'paymind_ai_cache_events_total', 'AI reply cache lookups and coalesced requests',
+    ('event',), collect_ai_cache_events, kind='counter'
+)
+
+# Opt-in per-request profiling (X-Profile header or PROFILE_SAMPLE_RATE)
+profiling.init_app(app, engine)
+
+# Long-polling limits for /payment/<payment_id>
+MAX_PAYMENT_WAIT = 30  # seconds
+PAYMENT_POLL_INTERVAL = 1  # seconds
+PAYMENT_OUTCOME_ATTEMPTS = 3  # tries to record a payment's outcome after the Circle call
+PAYMENT_STALE_AFTER = float(os.getenv('PAYMENT_STALE_AFTER', '300'))  # seconds before an unfinished payment is recovered
+
+# Batch payment limits
+MAX_BATCH_SIZE = 500
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '16'))  # parallel Circle transfers per batch
+
+# Pagination limits for list endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Dashboard recent transactions
+DEFAULT_RECENT_TRANSACTIONS = 10
+MAX_RECENT_TRANSACTIONS = 50
+
+# Rows fetched from the database and written to the client per chunk by /transactions/export
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '1000'))
+
+# /import/profiles jobs: uploads, resume checkpoints and job status are kept in IMPORT_CHECKPOINT_DIR
+IMPORT_CHECKPOINT_DIR = os.getenv('IMPORT_CHECKPOINT_DIR', 'import_checkpoints')
+IMPORT_MAX_UPLOAD_BYTES = int(os.getenv('IMPORT_MAX_UPLOAD_BYTES', str(50 * 1024 * 1024)))  # larger files: use the CLI
+IMPORT_JOBS = int(os.getenv('IMPORT_JOBS', '2'))  # imports running at once per process
+IMPORT_MAX_QUEUED_JOBS = int(os.getenv('IMPORT_MAX_QUEUED_JOBS', '10'))  # queued or running per process, then 503
+IMPORT_JOB_STALE_AFTER = float(os.getenv('IMPORT_JOB_STALE_AFTER', '600'))  # seconds without progress before a job may be restarted
+IMPORT_JOB_RETENTION = float(os.getenv('IMPORT_JOB_RETENTION', '604800'))  # seconds finished jobs stay queryable
+
+# Largest request body accepted on any route; leaves room for a full import upload and its multipart framing
+MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', str(IMPORT_MAX_UPLOAD_BYTES + 1024 * 1024)))
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+
+# Live Circle balances for /list_wallets_with_balances
+LIST_BALANCE_CONCURRENCY = int(os.getenv('LIST_BALANCE_CONCURRENCY', '16'))  # parallel Circle lookups
+LIST_BALANCE_CACHE_TTL = float(os.getenv('LIST_BALANCE_CACHE_TTL', '10'))  # seconds
+LIST_BALANCE_TIMEOUT = float(os.getenv('LIST_BALANCE_TIMEOUT', '2'))  # seconds before answering with what is ready
+LIST_BALANCE_MAX_PENDING = int(os.getenv('LIST_BALANCE_MAX_PENDING', '200'))  # queued or running lookups before new ones are skipped
 
 
 @app.route('/sign_up', methods=['POST'])
+@idempotent(idempotency_store)
 def sign_up():
     """
     User registration endpoint with Circle API integration
@@ -65,6 +154,7 @@ def sign_up():
                 return jsonify({"error": "This email address is already registered"}), 409
 
             # Register with Circle API
+            mark_upstream_call()
             circle_response = register_circle_wallet(
                 email=data['email_address'],
                 wallet_address=data['wallet_address']
@@ -114,6 +204,78 @@ def sign_up():
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 
+# --- Circle API payloads ---
+# Shared by the blocking helpers below and the async handlers in asgi.py.
+
+def register_wallet_payload(email, wallet_address):
+    """Body for POST /businessAccount/wallets/addresses/deposit"""
+    return {
+        "idempotencyKey": f"{email}_{wallet_address}",
+        "accountType": "individual",
+        "metadata": {
+            "email": email,
+            "walletAddress": wallet_address
+        }
+    }
+
+
+def create_wallet_payload(user_email, blockchains, idempotency_key=None):
+    """Body for POST /w3s/user/wallets; a fresh idempotency key unless one is given"""
+    return {
+        "idempotencyKey": idempotency_key or str(uuid.uuid4()),
+        "blockchains": blockchains,
+        "metadata": {
+            "email": user_email
+        }
+    }
+
+
+def transfer_payload(sender_wallet, recipient_address, amount, transaction_type, idempotency_key=None):
+    """Body for POST /transfers; a fresh idempotency key unless one is given"""
+    return {
+        "idempotencyKey": idempotency_key or str(uuid.uuid4()),
+        "source": {
+            "type": "wallet",
+            "id": sender_wallet
+        },
+        "destination": {
+            "type": "blockchain",
+            "address": recipient_address
+        },
+        "amount": {
+            "amount": str(amount),
+            "currency": "USD"
+        },
+        "metadata": {
+            "transactionType": transaction_type
+        }
+    }
+
+
+def circle_result(response, unwrap_data=False):
+    """
+    Convert a Circle API response into the helpers' result dict
+
+    Args:
+        response: requests or httpx response
+        unwrap_data (bool): Return the body's "data" object instead of the whole body
+
+    Returns:
+        dict: {"success": True, "data": ...} or {"success": False, "error": ..., "details": ...}
+    """
+    if response.status_code in [200, 201]:
+        body = response.json()
+        return {
+            "success": True,
+            "data": body.get('data', {}) if unwrap_data else body
+        }
+    return {
+        "success": False,
+        "error": f"Circle API error: {response.status_code}",
+        "details": response.text
+    }
+
+
 def register_circle_wallet(email, wallet_address):
     """
     Register wallet with Circle API
@@ -125,46 +287,20 @@ def register_circle_wallet(email, wallet_address):
     Returns:
         dict: Response from Circle API
     """
-    if not CIRCLE_API_KEY:
+    client = get_circle_client()
+    if not client:
         return {
             "success": False,
             "error": "Circle API Key not configured"
         }
 
-    headers = {
-        "Authorization": f"Bearer {os.getenv('CircleAPI_KEY')}",
-        "Content-Type": "application/json"
-    }
-
-    payload = {
-        "idempotencyKey": f"{email}_{wallet_address}",
-        "accountType": "individual",
-        "metadata": {
-            "email": email,
-            "walletAddress": wallet_address
-        }
-    }
-
     try:
         # Call Circle API to create account
-        response = requests.post(
-            f"{CIRCLE_API_URL}/businessAccount/wallets/addresses/deposit",
-            headers=headers,
-            json=payload,
-            timeout=10
+        response = client.post(
+            "/businessAccount/wallets/addresses/deposit",
+            register_wallet_payload(email, wallet_address), idempotent=True
         )
-
-        if response.status_code in [200, 201]:
-            return {
-                "success": True,
-                "data": response.json()
-            }
-        else:
-            return {
-                "success": False,
-                "error": f"Circle API error: {response.status_code}",
-                "details": response.text
-            }
+        return circle_result(response)
 
     except requests.exceptions.RequestException as e:
         return {
@@ -174,6 +310,7 @@ def register_circle_wallet(email, wallet_address):
 
 
 @app.route('/create_wallet', methods=['POST'])
+@idempotent(idempotency_store)
 def create_wallet():
     """
     Create wallet for user with Circle API integration
@@ -235,9 +372,11 @@ def create_wallet():
                 }), 409
 
             # Create wallet via Circle API
+            mark_upstream_call()
             circle_response = create_circle_wallet(
                 user_email=user.email_address,
-                blockchains=blockchains
+                blockchains=blockchains,
+                idempotency_key=upstream_key('create_wallet', request.headers.get(IDEMPOTENCY_HEADER))
             )
 
             if not circle_response.get('success'):
@@ -265,7 +404,9 @@ def create_wallet():
 
             # Add to database
             session.add(new_wallet)
+            open_wallet(session, new_wallet.wallet_id, new_wallet.balance)
             session.commit()
+            invalidate_wallet(new_wallet.wallet_id, new_wallet.user_email)
 
             response_data = {
                 "success": True,
@@ -293,59 +434,61 @@ def create_wallet():
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 
-def create_circle_wallet(user_email, blockchains):
+def create_circle_wallet(user_email, blockchains, idempotency_key=None):
     """
     Create wallet via Circle API
 
     Args:
         user_email (str): User's email address
         blockchains (list): List of blockchain networks
+        idempotency_key (str): Reuse a key so a retried call cannot create a second wallet
 
     Returns:
         dict: Response from Circle API
     """
-    if not CIRCLE_API_KEY:
+    client = get_circle_client()
+    if not client:
         return {
             "success": False,
             "error": "Circle API Key not configured"
         }
 
-    headers = {
-        "Authorization": f"Bearer {os.getenv('CircleAPI_KEY')}",
-        "Content-Type": "application/json"
-    }
+    try:
+        # Call Circle API to create wallet
+        response = client.post(
+            "/w3s/user/wallets", create_wallet_payload(user_email, blockchains, idempotency_key), idempotent=True
+        )
+        return circle_result(response, unwrap_data=True)
+
+    except requests.exceptions.RequestException as e:
+        return {
+            "success": False,
+            "error": f"Circle API connection error: {str(e)}"
+        }
 
-    # Generate unique idempotency key
-    idempotency_key = str(uuid.uuid4())
 
-    payload = {
-        "idempotencyKey": idempotency_key,
-        "blockchains": blockchains,
-        "metadata": {
-            "email": user_email
+def fetch_circle_balance(wallet_id):
+    """
+    Get a wallet's token balances from Circle API
+
+    Args:
+        wallet_id (str): Circle wallet id
+
+    Returns:
+        dict: Response from Circle API, its "data" holding "tokenBalances"
+    """
+    client = get_circle_client()
+    if not client:
+        return {
+            "success": False,
+            "error": "Circle API Key not configured"
         }
-    }
 
     try:
-        # Call Circle API to create wallet
-        response = requests.post(
-            f"{CIRCLE_API_URL}/w3s/user/wallets",
-            headers=headers,
-            json=payload,
-            timeout=10
+        response = client.request(
+            'GET', f"/w3s/wallets/{wallet_id}/balances", idempotent=True, endpoint='/w3s/wallets/{id}/balances'
         )
-
-        if response.status_code in [200, 201]:
-            return {
-                "success": True,
-                "data": response.json().get('data', {})
-            }
-        else:
-            return {
-                "success": False,
-                "error": f"Circle API error: {response.status_code}",
-                "details": response.text
-            }
+        return circle_result(response, unwrap_data=True)
 
     except requests.exceptions.RequestException as e:
         return {
@@ -354,151 +497,1136 @@ def create_circle_wallet(user_email, blockchains):
         }
 
 
-@app.route('/wallet/<wallet_id>', methods=['GET'])
-def get_wallet(wallet_id):
-    """Get wallet information"""
-    session = Session()
+# Imports run here rather than in the request, and never on the payment workers
+import_executor = ThreadPoolExecutor(max_workers=IMPORT_JOBS, thread_name_prefix='import-job')
+import_slots = threading.BoundedSemaphore(IMPORT_MAX_QUEUED_JOBS)
+# Job ids accepted by this process and not finished; a queued job's files do not change while it waits
+import_jobs = set()
+import_jobs_lock = threading.Lock()
+
+
+def release_import_job(job_id):
+    with import_jobs_lock:
+        import_jobs.discard(job_id)
+    import_slots.release()
+
+
+def run_import_job(importer, job_id, fmt, create_wallets):
     try:
-        wallet = session.query(Wallet).filter_by(wallet_id=wallet_id).first()
-        if wallet:
-            return jsonify({
-                "wallet_id": wallet.wallet_id,
-                "user_email": wallet.user_email,
-                "wallet_address": wallet.wallet_address,
-                "balance": wallet.balance,
-                "blockchains": wallet.blockchains,
-                "transaction_types": wallet.transaction_types,
-                "status": wallet.status
-            }), 200
-        else:
-            return jsonify({"error": "Wallet not found"}), 404
+        run_job(importer, IMPORT_CHECKPOINT_DIR, job_id, fmt, create_wallets)
     finally:
-        session.close()
+        release_import_job(job_id)
 
 
-@app.route('/send_payment', methods=['POST'])
-def send_payment():
+@app.route('/import/profiles', methods=['POST'])
+def import_profiles():
     """
-    Send payment endpoint
+    Bulk-create profiles, and Circle wallets for them, from CSV or JSONL
 
-    Expected JSON data:
-    {
-        "sender_email": "john@example.com",
-        "recipient_address": "0xabcd...",
-        "amount": 100,
-        "note": "Rent payment for January",
-        "type": "rent"
-    }
+    Send the file as multipart field "file", or as the raw body with
+    Content-Type text/csv or application/x-ndjson. CSV needs a header row with
+    full_name, email_address and wallet_address; notifications, language and
+    blockchains are optional ";"-separated lists. Uploads are limited to
+    IMPORT_MAX_UPLOAD_BYTES; for larger files use the CLI:
+    python bulk_import.py users.csv
+
+    The import runs in the background. The response is 202 with the job's
+    status_url; GET it for progress and, once completed, the summary.
+
+    Query parameters:
+    - format: csv or jsonl (default: from the file name or content type)
+    - create_wallets: Set to false to only create profiles
+    - checkpoint: Job name (default: a new id); send the same file with the
+      same name again to resume a failed import
     """
     try:
-        # Get data from request
-        data = request.get_json()
+        too_large = {"error": f"Upload exceeds {IMPORT_MAX_UPLOAD_BYTES} bytes; import it with python bulk_import.py instead"}
+        if request.content_length and request.content_length > IMPORT_MAX_UPLOAD_BYTES:
+            return jsonify(too_large), 413
 
-        if not data:
-            return jsonify({"error": "No data provided in request"}), 400
+        upload = request.files.get('file')
+        if upload:
+            raw_stream, name, content_type = upload.stream, upload.filename or '', upload.mimetype
+        else:
+            raw_stream, name, content_type = request.stream, '', request.mimetype
+
+        fmt = request.args.get('format')
+        if not fmt:
+            fmt = 'csv' if name.endswith('.csv') or content_type == 'text/csv' else 'jsonl'
+        if fmt not in ('csv', 'jsonl'):
+            return jsonify({"error": "format must be csv or jsonl"}), 400
+
+        job_id = request.args.get('checkpoint') or uuid.uuid4().hex
+        if not re.fullmatch(r'[\w-]{1,64}', job_id):
+            return jsonify({"error": "checkpoint may only contain letters, digits, '_' and '-'"}), 400
+        status_url = f"/import/profiles/{job_id}"
+
+        os.makedirs(IMPORT_CHECKPOINT_DIR, exist_ok=True)
+        prune_jobs(IMPORT_CHECKPOINT_DIR, IMPORT_JOB_RETENTION)
+        if not import_slots.acquire(blocking=False):
+            response = jsonify({"error": "Too many imports in progress, try again later"})
+            response.headers['Retry-After'] = '60'
+            return response, 503
+
+        # Reserve the job id, so its files are not replaced while this process still has it queued or running
+        with import_jobs_lock:
+            active = job_id in import_jobs or job_active(IMPORT_CHECKPOINT_DIR, job_id, IMPORT_JOB_STALE_AFTER)
+            if not active:
+                import_jobs.add(job_id)
+        if active:
+            import_slots.release()
+            return jsonify({"error": f"Import {job_id} is still running", "status_url": status_url}), 409
 
-        # Validate required fields
-        required_fields = ['sender_email', 'recipient_address', 'amount']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"error": f"Missing field: {field}"}), 400
+        try:
+            upload_path, _, status_path = job_paths(IMPORT_CHECKPOINT_DIR, job_id)
+            if not spool_upload(raw_stream, upload_path, IMPORT_MAX_UPLOAD_BYTES):
+                release_import_job(job_id)
+                return jsonify(too_large), 413
+
+            create_wallets = request.args.get('create_wallets', 'true').lower() != 'false'
+            status = update_job(
+                status_path, job_id=job_id, state='queued', format=fmt, create_wallets=create_wallets,
+                queued_at=datetime.utcnow().isoformat(), error=None, summary=None
+            )
+            importer = BulkImporter(Session, register_circle_wallet, create_circle_wallet)
+            import_executor.submit(run_import_job, importer, job_id, fmt, create_wallets)
+        except Exception:
+            release_import_job(job_id)
+            raise
 
-        # Create database session
+        response = jsonify({"success": True, "message": "Import accepted", **status, "status_url": status_url})
+        response.headers['Location'] = status_url
+        return response, 202
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+@app.route('/import/profiles/<job_id>', methods=['GET'])
+def get_import_job(job_id):
+    """
+    Status of an import started with POST /import/profiles
+
+    state is queued, running (with progress from the checkpoint), completed
+    (with the import summary) or failed (with the error).
+    """
+    if not re.fullmatch(r'[\w-]{1,64}', job_id):
+        return jsonify({"error": "Import not found"}), 404
+    try:
+        status = job_status(IMPORT_CHECKPOINT_DIR, job_id)
+        if status is None:
+            return jsonify({"error": "Import not found"}), 404
+        return jsonify({"success": True, **status}), 200
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+# --- Cached profile and wallet lookups ---
+# Reads go through the cache; every handler that changes a profile or wallet
+# must call the matching invalidate_* helper after committing.
+
+def load_profile(identifier):
+    """Profile fields for an email address or full name, or None"""
+    def loader():
         session = Session()
+        try:
+            # Try to find by email first, then by full name
+            user = session.query(Profile).filter_by(email_address=identifier).first()
+            if not user:
+                user = session.query(Profile).filter_by(full_name=identifier).first()
+            if not user:
+                return None
+            return {
+                "full_name": user.full_name,
+                "email_address": user.email_address,
+                "wallet_address": user.wallet_address,
+                "notifications": list(user.notifications or []),
+                "language": list(user.language or []),
+                "disconnect": list(user.disconnect or [])
+            }
+        finally:
+            session.close()
 
+    return cache.get_or_load(f"profile:{identifier}", loader)
+
+
+def load_user(full_name):
+    """Public user fields for a full name, or None"""
+    def loader():
+        session = Session()
         try:
-            # Find sender's wallet
-            wallet = session.query(Wallet).filter_by(
-                user_email=data['sender_email']
-            ).first()
+            user = session.query(Profile).filter_by(full_name=full_name).first()
+            if not user:
+                return None
+            return {
+                "full_name": user.full_name,
+                "email_address": user.email_address,
+                "wallet_address": user.wallet_address,
+                "notifications": list(user.notifications or []),
+                "language": list(user.language or [])
+            }
+        finally:
+            session.close()
+
+    return cache.get_or_load(f"user:{full_name}", loader)
+
 
+def load_wallet(wallet_id=None, user_email=None):
+    """Wallet fields by wallet_id or owner email, or None"""
+    def loader():
+        session = Session()
+        try:
+            if wallet_id:
+                wallet = session.query(Wallet).filter_by(wallet_id=wallet_id).first()
+            else:
+                wallet = session.query(Wallet).filter_by(user_email=user_email).first()
             if not wallet:
-                session.close()
-                return jsonify({"error": "Sender wallet not found"}), 404
+                return None
+            return {
+                "wallet_id": wallet.wallet_id,
+                "user_email": wallet.user_email,
+                "wallet_address": wallet.wallet_address,
+                "balance": wallet.balance,
+                "blockchains": list(wallet.blockchains or []),
+                "transaction_types": list(wallet.transaction_types or []),
+                "status": wallet.status,
+                "balance_checked_at": wallet.balance_checked_at.isoformat() if wallet.balance_checked_at else None
+            }
+        finally:
+            session.close()
 
-            # Check if sufficient balance
-            if wallet.balance < data['amount']:
-                session.close()
-                return jsonify({
-                    "error": "Insufficient balance",
-                    "current_balance": wallet.balance,
-                    "required": data['amount']
-                }), 400
+    key = f"wallet:{wallet_id}" if wallet_id else f"wallet_user:{user_email}"
+    return cache.get_or_load(key, loader)
 
-            # Validate transaction type
-            valid_types = ['rent', 'purchase', 'deposit', 'insurance', 'transfer']
-            transaction_type = data.get('type', 'transfer')
-            if transaction_type not in valid_types:
-                session.close()
-                return jsonify({
-                    "error": f"Invalid transaction type. Must be one of: {', '.join(valid_types)}"
-                }), 400
 
-            # Check if payment already exists (prevent duplicates)
-            existing_payment = session.query(Dashboard).filter_by(
-                recipient_address=data['recipient_address']
-            ).first()
+def invalidate_profile(*identifiers):
+    """Drop cached profile/user entries for the given emails and full names"""
+    cache.invalidate(
+        *[f"profile:{identifier}" for identifier in identifiers if identifier],
+        *[f"user:{identifier}" for identifier in identifiers if identifier]
+    )
 
-            if existing_payment:
-                session.close()
-                return jsonify({
-                    "error": "Payment to this recipient already exists",
-                    "payment_id": existing_payment.recipient_address
-                }), 409
 
-            # Create new payment record
-            new_payment = Dashboard(
-                recipient_address=data['recipient_address'],
-                amount=data['amount'],
-                note=data.get('note', ''),
-                status=['pending'],
-                transactions=['pending'],
-                type=[transaction_type]
-            )
+def invalidate_wallet(wallet_id=None, user_email=None):
+    """Drop cached wallet entries after a balance or wallet change"""
+    cache.invalidate(
+        f"wallet:{wallet_id}" if wallet_id else None,
+        f"wallet_user:{user_email}" if user_email else None
+    )
 
-            # Send payment via Circle API
-            circle_response = send_circle_payment(
-                sender_wallet=wallet.wallet_address,
-                recipient_address=data['recipient_address'],
-                amount=data['amount'],
-                transaction_type=transaction_type
-            )
 
-            if circle_response.get('success'):
-                # Update payment status
-                new_payment.status = ['completed']
-                new_payment.transactions = ['completed']
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Get hit/miss counters of the profile/wallet cache and the AI reply cache"""
+    return jsonify({"success": True, "cache": cache.stats(), "ai": get_ai_cache_stats()}), 200
 
-                # Update wallet balance
-                wallet.balance -= data['amount']
-            else:
-                # Payment failed
-                new_payment.status = ['failed']
-                new_payment.transactions = ['failed']
 
-            # Add to database
-            session.add(new_payment)
-            session.commit()
+@app.route('/wallet/<wallet_id>', methods=['GET'])
+def get_wallet(wallet_id):
+    """Get wallet information"""
+    wallet = load_wallet(wallet_id=wallet_id)
+    if wallet:
+        return jsonify(wallet), 200
+    else:
+        return jsonify({"error": "Wallet not found"}), 404
+
+
+# Keeps Wallet.balance in line with Circle; started by python reconciler.py or the dev server
+balance_reconciler = BalanceReconciler(Session, fetch_circle_balance, on_change=invalidate_wallet)
+metrics.register_callback(
+    'paymind_balance_reconcile_total', 'Wallet balances checked against Circle by outcome',
+    ('outcome',),
+    lambda: {(outcome,): balance_reconciler.totals[outcome] for outcome in ('checked', 'adjusted', 'skipped', 'failed')},
+    kind='counter'
+)
+
+
+@app.route('/wallets/balance_freshness', methods=['GET'])
+def get_balance_freshness():
+    """Get how recently wallet balances were compared with Circle, and reconciler counters"""
+    try:
+        return jsonify({"success": True, "freshness": balance_reconciler.freshness()}), 200
+    except Exception as e:
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+
+
+@app.route('/wallet/<wallet_id>/ledger', methods=['GET'])
+def get_wallet_ledger(wallet_id):
+    """
+    Get the wallet's ledger entries, newest first
+
+    Query parameters:
+    - since / until: ISO timestamps bounding created_at
+    - limit: Page size (default 50, max 500)
+    - after: Cursor returned as next_cursor by the previous page
+    """
+    try:
+        try:
+            since, until = parse_time_range(request.args)
+            limit = min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        except ValueError:
+            return jsonify({"error": "Invalid since, until or limit"}), 400
+
+        if limit < 1:
+            return jsonify({"error": "limit must be positive"}), 400
+
+        session = Session()
+
+        try:
+            # Served by ix_ledger_entries_wallet_created
+            query = session.query(LedgerEntry).filter(LedgerEntry.wallet_id == wallet_id)
+            if since:
+                query = query.filter(LedgerEntry.created_at >= since)
+            if until:
+                query = query.filter(LedgerEntry.created_at < until)
+
+            after = request.args.get('after')
+            if after:
+                created_at, _, entry_id = after.partition('|')
+                try:
+                    cursor = (datetime.fromisoformat(created_at), int(entry_id))
+                except ValueError:
+                    session.close()
+                    return jsonify({"error": "Invalid cursor"}), 400
+                query = query.filter(tuple_(LedgerEntry.created_at, LedgerEntry.id) < cursor)
+
+            entries = query.order_by(
+                LedgerEntry.created_at.desc(), LedgerEntry.id.desc()
+            ).limit(limit + 1).all()
+
+            has_more = len(entries) > limit
+            entries = entries[:limit]
+
+            response_data = {
+                "success": True,
+                "wallet_id": wallet_id,
+                "count": len(entries),
+                "next_cursor": f"{entries[-1].created_at.isoformat()}|{entries[-1].id}" if has_more else None,
+                "entries": [
+                    {
+                        "id": entry.id,
+                        "payment_id": entry.payment_id,
+                        "entry_type": entry.entry_type,
+                        "amount": entry.amount,
+                        "balance_after": entry.balance_after,
+                        "created_at": entry.created_at.isoformat()
+                    }
+                    for entry in entries
+                ]
+            }
+
+            session.close()
+            return jsonify(response_data), 200
+
+        except Exception as e:
+            session.close()
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+@app.route('/wallet/<wallet_id>/ledger/summary', methods=['GET'])
+def get_wallet_ledger_summary(wallet_id):
+    """
+    Get debit/credit totals for a wallet over a time range
+
+    Query parameters:
+    - since / until: ISO timestamps bounding created_at (default: all history)
+
+    Only the ledger rows inside the range are aggregated, via the
+    (wallet_id, created_at) index.
+    """
+    try:
+        try:
+            since, until = parse_time_range(request.args)
+        except ValueError:
+            return jsonify({"error": "Invalid since or until"}), 400
+
+        session = Session()
+
+        try:
+            query = session.query(
+                LedgerEntry.entry_type,
+                func.count(LedgerEntry.id),
+                func.sum(LedgerEntry.amount)
+            ).filter(LedgerEntry.wallet_id == wallet_id)
+            if since:
+                query = query.filter(LedgerEntry.created_at >= since)
+            if until:
+                query = query.filter(LedgerEntry.created_at < until)
+
+            totals = {
+                entry_type: {"count": count, "amount": amount}
+                for entry_type, count, amount in query.group_by(LedgerEntry.entry_type).all()
+            }
+
+            response_data = {
+                "success": True,
+                "wallet_id": wallet_id,
+                "since": since.isoformat() if since else None,
+                "until": until.isoformat() if until else None,
+                "totals": totals,
+                "net_change": sum(total["amount"] or 0 for total in totals.values()),
+                "balance": current_balance(session, wallet_id)
+            }
+
+            session.close()
+            return jsonify(response_data), 200
+
+        except Exception as e:
+            session.close()
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+def parse_time_range(args):
+    """
+    Read optional since/until ISO timestamps from query parameters
+
+    Raises:
+        ValueError: If a timestamp is malformed
+    """
+    since = args.get('since')
+    until = args.get('until')
+    return (
+        datetime.fromisoformat(since) if since else None,
+        datetime.fromisoformat(until) if until else None
+    )
+
+
+@app.route('/send_payment', methods=['POST'])
+@idempotent(idempotency_store)
+def send_payment():
+    """
+    Send payment endpoint
+
+    Expected JSON data:
+    {
+        "sender_email": "john@example.com",
+        "recipient_address": "0xabcd...",
+        "amount": 100,
+        "note": "Rent payment for January",
+        "type": "rent",
+        "async": false  // optional, or send header "Prefer: respond-async"
+    }
+
+    In async mode the payment is stored as pending and 202 is returned with
+    a payment_id; poll GET /payment/<payment_id> for the outcome.
+    """
+    try:
+        # Get data from request
+        data = request.get_json()
+
+        if not data:
+            return jsonify({"error": "No data provided in request"}), 400
+
+        # Validate required fields
+        required_fields = ['sender_email', 'recipient_address', 'amount']
+        for field in required_fields:
+            if field not in data:
+                return jsonify({"error": f"Missing field: {field}"}), 400
+
+        # Create database session
+        session = Session()
+
+        try:
+            # A retry that runs again finds the payment its first attempt stored
+            payment_id = payment_id_for(request.headers.get(IDEMPOTENCY_HEADER))
+            existing_payment = session.get(Dashboard, payment_id)
+            if existing_payment:
+                session.close()
+                return existing_payment_result(existing_payment, data)
+
+            # Find sender's wallet
+            wallet = session.query(Wallet).filter_by(
+                user_email=data['sender_email']
+            ).first()
+
+            if not wallet:
+                session.close()
+                return jsonify({"error": "Sender wallet not found"}), 404
+
+            # Check if sufficient balance
+            if wallet.balance < data['amount']:
+                session.close()
+                return jsonify({
+                    "error": "Insufficient balance",
+                    "current_balance": wallet.balance,
+                    "required": data['amount']
+                }), 400
+
+            # Validate transaction type
+            transaction_type = data.get('type', 'transfer')
+            if transaction_type not in TRANSACTION_TYPES:
+                session.close()
+                return jsonify({
+                    "error": f"Invalid transaction type. Must be one of: {', '.join(TRANSACTION_TYPES)}"
+                }), 400
+
+            # Persist the payment as pending before talking to Circle
+            new_payment = Dashboard(
+                payment_id=payment_id,
+                recipient_address=data['recipient_address'],
+                sender_email=data['sender_email'],
+                sender_wallet_id=wallet.wallet_id,
+                amount=data['amount'],
+                note=data.get('note', ''),
+                status='pending',
+                transaction_status='pending',
+                type=transaction_type
+            )
+            session.add(new_payment)
+            session.flush()
+            payment_stats.record(session, [payment_stats.change(new_payment, None, 'pending')])
+            session.commit()
+            mark_upstream_call()
+            payment_info = {
+                "payment_id": payment_id,
+                "recipient_address": new_payment.recipient_address,
+                "amount": new_payment.amount,
+                "note": new_payment.note,
+                "type": new_payment.type
+            }
+            session.close()
+
+            # Async mode: hand the transfer to the worker pool and return immediately
+            if data.get('async') or request.headers.get('Prefer') == 'respond-async':
+                payment_workers.submit(payment_id, process_payment, payment_id)
+                payment_info["status"] = 'pending'
+                response = jsonify({
+                    "success": True,
+                    "message": "Payment accepted for processing",
+                    "payment": payment_info,
+                    "status_url": f"/payment/{payment_id}"
+                })
+                response.headers['Location'] = f"/payment/{payment_id}"
+                return response, 202
+
+            # Send payment via Circle API (no database session held meanwhile)
+            circle_response, new_balance = process_payment(payment_id)
+            payment_info["status"] = 'completed' if circle_response.get('success') else 'failed'
+
+            response_data = {
+                "success": circle_response.get('success', False),
+                "message": "Payment processed",
+                "error": circle_response.get('error'),
+                "payment": payment_info,
+                "new_balance": new_balance,
+                "circle_data": circle_response.get('data')
+            }
+
+            return jsonify(response_data), 201
+
+        except Exception as e:
+            session.rollback()
+            session.close()
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+def payment_id_for(idempotency_key):
+    """
+    Payment id for a /send_payment request
+
+    With an Idempotency-Key it is derived from the key, and the payment id is
+    also the Circle transfer's idempotency key. A retry that runs the request
+    again (e.g. after a failure left the claim to expire) therefore finds
+    the stored payment, and can never reach Circle as a new transfer.
+    """
+    return upstream_key('send_payment', idempotency_key) or str(uuid.uuid4())
+
+
+def existing_payment_result(payment, data):
+    """
+    (body, status, headers) for a /send_payment retry whose payment already exists
+
+    Args:
+        payment: Dashboard row with the derived payment_id
+        data (dict): The retry's JSON body
+    """
+    if (payment.sender_email, payment.recipient_address, payment.amount) != (
+            data['sender_email'], data['recipient_address'], data['amount']):
+        return {"error": "Idempotency-Key was already used for a different payment"}, 422, {}
+
+    payment_info = {
+        "payment_id": payment.payment_id,
+        "recipient_address": payment.recipient_address,
+        "amount": payment.amount,
+        "note": payment.note,
+        "type": payment.type,
+        "status": payment.status
+    }
+    if payment.status in ('pending', 'processing'):
+        return {
+            "success": True,
+            "message": "Payment accepted for processing",
+            "payment": payment_info,
+            "status_url": f"/payment/{payment.payment_id}"
+        }, 202, {"Location": f"/payment/{payment.payment_id}"}
+    return {
+        "success": payment.status == 'completed',
+        "message": "Payment already processed",
+        "payment": payment_info
+    }, 200, {}
+
+
+def process_payment(payment_id):
+    """
+    Submit a pending payment to Circle and record the outcome
+
+    The payment is claimed by moving it from pending to processing, and the
+    amount is reserved with an atomic conditional debit in the same
+    transaction. A failed transfer releases the reservation again. The payment
+    is submitted at most once, cannot be cancelled while Circle handles it,
+    and no database session is held during the Circle call.
+
+    Args:
+        payment_id (str): Payment to submit
+
+    Returns:
+        tuple: (Circle response dict, sender's new balance)
+    """
+    session = Session()
+    try:
+        claimed = session.query(Dashboard).filter_by(
+            payment_id=payment_id, status='pending'
+        ).update({"status": 'processing', "transaction_status": 'processing'})
+
+        if not claimed:
+            session.rollback()
+            return {"success": False, "error": "Payment is no longer pending"}, None
+
+        payment = session.query(Dashboard).filter_by(payment_id=payment_id).first()
+        wallet = session.query(Wallet).filter_by(user_email=payment.sender_email).first()
+
+        if not wallet or not debit(session, wallet.wallet_id, payment.amount, payment_id):
+            payment.status = 'failed'
+            payment.transaction_status = 'failed'
+            payment_stats.record(session, [payment_stats.change(payment, 'pending', 'failed')])
+            session.commit()
+            error = "Insufficient balance" if wallet else "Sender wallet not found"
+            return {"success": False, "error": error}, current_balance(session, wallet.wallet_id) if wallet else None
+
+        payment_stats.record(session, [payment_stats.change(payment, 'pending', 'processing')])
+        session.commit()
+        wallet_id, user_email = wallet.wallet_id, wallet.user_email
+        transfer = {
+            "sender_wallet": wallet.wallet_address,
+            "recipient_address": payment.recipient_address,
+            "amount": payment.amount,
+            "transaction_type": payment.type
+        }
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+    invalidate_wallet(wallet_id, user_email)
+    # Keyed by payment, so Circle executes each payment's transfer at most once
+    circle_response = send_circle_payment(**transfer, idempotency_key=payment_id)
+    return circle_response, record_payment_outcome(payment_id, wallet_id, user_email, circle_response)
+
+
+def record_payment_outcome(payment_id, wallet_id, user_email, circle_response):
+    """
+    Move a processing payment to completed or failed, releasing the reservation on failure
+
+    The write is retried; if it keeps failing the payment stays processing and
+    recover_stale_payments finishes it later, so the error never leaves the
+    funds reserved for good.
+
+    Returns:
+        float: Sender's new balance, or None if the outcome could not be recorded
+    """
+    for attempt in range(PAYMENT_OUTCOME_ATTEMPTS):
+        session = Session()
+        try:
+            payment = session.query(Dashboard).filter_by(payment_id=payment_id, status='processing').first()
+            if payment is None:
+                # Already recorded, e.g. by the recovery sweep
+                return current_balance(session, wallet_id)
+
+            if circle_response.get('success'):
+                payment.status = 'completed'
+                payment.transaction_status = 'completed'
+            else:
+                payment.status = 'failed'
+                payment.transaction_status = 'failed'
+
+                # Release the reserved amount
+                credit(session, wallet_id, payment.amount, payment_id)
+
+            payment_stats.record(session, [payment_stats.change(payment, 'processing', payment.status)])
+            session.commit()
+            invalidate_wallet(wallet_id, user_email)
+            return current_balance(session, wallet_id)
+
+        except Exception as e:
+            session.rollback()
+            print(f"[Payments] Recording the outcome of payment {payment_id} failed (attempt {attempt + 1}): {e}")
+        finally:
+            session.close()
+        if attempt < PAYMENT_OUTCOME_ATTEMPTS - 1:
+            time.sleep(backoff_delay(attempt))
+
+    return None
+
+
+def resume_payment(payment_id):
+    """
+    Finish a payment left in processing, e.g. by a crash after the Circle call
+
+    The transfer is sent again with the payment_id as idempotency key, so
+    Circle answers with the original transfer if there was one instead of
+    moving the money twice. Only a definite answer from Circle is recorded;
+    when Circle cannot be reached the payment waits for the next sweep.
+
+    Returns:
+        bool: True if the payment's outcome was recorded
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=PAYMENT_STALE_AFTER)
+    session = Session()
+    try:
+        # Take the payment over, so only one sweeper resumes it
+        taken = session.query(Dashboard).filter(
+            Dashboard.payment_id == payment_id,
+            Dashboard.status == 'processing',
+            Dashboard.updated_at < cutoff
+        ).update({"updated_at": datetime.utcnow()}, synchronize_session=False)
+        if not taken:
+            session.rollback()
+            return False
+        session.commit()
+
+        payment = session.query(Dashboard).filter_by(payment_id=payment_id).first()
+        wallet = session.query(Wallet).filter_by(wallet_id=payment.sender_wallet_id).first()
+        if not wallet:
+            print(f"[Payments] Cannot resume payment {payment_id}: sender wallet not found")
+            return False
+        wallet_id, user_email = wallet.wallet_id, wallet.user_email
+        transfer = {
+            "sender_wallet": wallet.wallet_address,
+            "recipient_address": payment.recipient_address,
+            "amount": payment.amount,
+            "transaction_type": payment.type
+        }
+    finally:
+        session.close()
+
+    circle_response = send_circle_payment(**transfer, idempotency_key=payment_id)
+    # Connection errors carry no Circle response; the transfer may or may not exist
+    if not circle_response.get('success') and 'details' not in circle_response:
+        print(f"[Payments] Circle unreachable while resuming payment {payment_id}: {circle_response.get('error')}")
+        return False
+    return record_payment_outcome(payment_id, wallet_id, user_email, circle_response) is not None
+
+
+def recover_stale_payments(limit=100):
+    """
+    Pick up payments that nobody is working on any more
+
+    Async payments live only in the in-memory worker pool, so a restart
+    leaves them pending, and an error after the reservation can leave a
+    payment processing. Both are handed back to the worker pool once they
+    have not changed for PAYMENT_STALE_AFTER seconds.
+
+    Returns:
+        int: Number of payments handed to the worker pool
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=PAYMENT_STALE_AFTER)
+    session = Session()
+    try:
+        stale = session.execute(
+            select(Dashboard.payment_id, Dashboard.status)
+            .where(Dashboard.status.in_(('pending', 'processing')), Dashboard.updated_at < cutoff)
+            .order_by(Dashboard.updated_at)
+            .limit(limit)
+        ).all()
+    finally:
+        session.close()
+
+    submitted = 0
+    for payment_id, status in stale:
+        if payment_workers.submit(payment_id, process_payment if status == 'pending' else resume_payment, payment_id):
+            submitted += 1
+    if submitted:
+        print(f"[Payments] Recovering {submitted} stale payment(s)")
+    return submitted
+
+
+@app.before_request
+def limit_request_size():
+    # Refuse declared oversized bodies up front; handlers would report Flask's 413 as a server error
+    if request.content_length and request.content_length > MAX_CONTENT_LENGTH:
+        return jsonify({"error": f"Request body exceeds {MAX_CONTENT_LENGTH} bytes"}), 413
+
+
+@app.before_request
+def start_payment_recovery():
+    # No-op after the first request; CLI tools that import the app never start it
+    payment_workers.start_recovery(recover_stale_payments)
+
+
+@app.route('/payment/<payment_id>', methods=['GET'])
+def get_payment(payment_id):
+    """
+    Get payment status, optionally long-polling until it is final
+
+    Query parameters:
+    - wait: Seconds to wait while the payment is pending or processing (max 30)
+    """
+    try:
+        try:
+            wait = min(float(request.args.get('wait', 0)), MAX_PAYMENT_WAIT)
+        except ValueError:
+            return jsonify({"error": "wait must be a number"}), 400
+
+        deadline = time.monotonic() + wait
+
+        while True:
+            session = Session()
+            try:
+                payment = session.query(Dashboard).filter_by(payment_id=payment_id).first()
+                if not payment:
+                    return jsonify({"error": "Payment not found"}), 404
+
+                remaining = deadline - time.monotonic()
+                if payment.status in ('pending', 'processing') and remaining > 0:
+                    poll = min(remaining, PAYMENT_POLL_INTERVAL)
+                else:
+                    return jsonify({
+                        "success": True,
+                        "payment": {
+                            "payment_id": payment.payment_id,
+                            "recipient_address": payment.recipient_address,
+                            "sender_email": payment.sender_email,
+                            "amount": payment.amount,
+                            "note": payment.note,
+                            "status": payment.status,
+                            "type": payment.type,
+                            "created_at": payment.created_at.isoformat(),
+                            "updated_at": payment.updated_at.isoformat()
+                        }
+                    }), 200
+            finally:
+                session.close()
+
+            payment_workers.wait(payment_id, poll)
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+@app.route('/send_payments/batch', methods=['POST'])
+def send_payments_batch():
+    """
+    Send many payments from one wallet in a single request
+
+    Expected JSON data:
+    {
+        "sender_email": "john@example.com",
+        "payments": [
+            {"recipient_address": "0xabcd...", "amount": 100, "note": "Rent", "type": "rent"},
+            {"recipient_address": "0xef01...", "amount": 50, "type": "transfer"}
+        ]
+    }
+
+    The batch is validated as a whole (one wallet lookup and one balance
+    check for the total) and stored in one transaction. Transfers
+    are then submitted to Circle concurrently and per-item results returned.
+    The batch total is reserved up front; failed transfers are credited back.
+    """
+    try:
+        data = request.get_json()
+
+        if not data:
+            return jsonify({"error": "No data provided in request"}), 400
+
+        sender_email = data.get('sender_email')
+        items = data.get('payments')
+
+        if not sender_email:
+            return jsonify({"error": "Missing field: sender_email"}), 400
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "payments must be a non-empty list"}), 400
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"A batch may contain at most {MAX_BATCH_SIZE} payments"}), 400
+
+        # Validate every item before touching the database
+        errors = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or 'recipient_address' not in item or 'amount' not in item:
+                errors.append({"index": index, "error": "recipient_address and amount are required"})
+            elif not isinstance(item['recipient_address'], str) or not item['recipient_address'].strip():
+                errors.append({"index": index, "error": "recipient_address must be a non-empty string"})
+            # bool is an int subclass, so True would otherwise pass as 1
+            elif isinstance(item['amount'], bool) or not isinstance(item['amount'], (int, float)) or item['amount'] <= 0:
+                errors.append({"index": index, "error": "amount must be a positive number"})
+            elif item.get('type', 'transfer') not in TRANSACTION_TYPES:
+                errors.append({"index": index, "error": f"Invalid transaction type. Must be one of: {', '.join(TRANSACTION_TYPES)}"})
+
+        if errors:
+            return jsonify({"error": "Invalid batch", "details": errors}), 400
+
+        total_amount = sum(item['amount'] for item in items)
+
+        session = Session()
+
+        try:
+            wallet = session.query(Wallet).filter_by(user_email=sender_email).first()
+
+            if not wallet:
+                session.close()
+                return jsonify({"error": "Sender wallet not found"}), 404
+
+            if wallet.balance < total_amount:
+                session.close()
+                return jsonify({
+                    "error": "Insufficient balance",
+                    "current_balance": wallet.balance,
+                    "required": total_amount
+                }), 400
+
+            # Persist the whole batch in one transaction, already claimed for processing
+            payments = [
+                Dashboard(
+                    payment_id=str(uuid.uuid4()),
+                    recipient_address=item['recipient_address'],
+                    sender_email=sender_email,
+                    sender_wallet_id=wallet.wallet_id,
+                    amount=item['amount'],
+                    note=item.get('note', ''),
+                    status='processing',
+                    transaction_status='processing',
+                    type=item.get('type', 'transfer')
+                )
+                for item in items
+            ]
+            session.add_all(payments)
+            session.flush()
+            payment_stats.record(session, [payment_stats.change(payment, None, 'processing') for payment in payments])
+
+            # Reserve the whole batch amount atomically
+            reservations = [(payment.payment_id, payment.amount) for payment in payments]
+            if not debit_many(session, wallet.wallet_id, reservations):
+                session.rollback()
+                session.close()
+                return jsonify({"error": "Insufficient balance", "required": total_amount}), 400
+
+            session.commit()
+
+            wallet_id = wallet.wallet_id
+            sender_wallet = wallet.wallet_address
+            transfers = [
+                {
+                    "payment_id": payment.payment_id,
+                    "recipient_address": payment.recipient_address,
+                    "amount": payment.amount,
+                    "transaction_type": payment.type,
+                    "created_at": payment.created_at
+                }
+                for payment in payments
+            ]
+            session.close()
+
+            # Fan the transfers out to Circle with bounded parallelism
+            def submit(transfer):
+                return send_circle_payment(
+                    sender_wallet=sender_wallet,
+                    recipient_address=transfer['recipient_address'],
+                    amount=transfer['amount'],
+                    transaction_type=transfer['transaction_type'],
+                    idempotency_key=transfer['payment_id']
+                )
+
+            with ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(transfers))) as executor:
+                circle_responses = list(executor.map(submit, transfers))
+
+            # Record all outcomes and the balance change in one transaction
+            results = []
+            completed_amount = 0
+            for index, (transfer, circle_response) in enumerate(zip(transfers, circle_responses)):
+                status = 'completed' if circle_response.get('success') else 'failed'
+                if status == 'completed':
+                    completed_amount += transfer['amount']
+                results.append({
+                    "index": index,
+                    "payment_id": transfer['payment_id'],
+                    "recipient_address": transfer['recipient_address'],
+                    "amount": transfer['amount'],
+                    "status": status,
+                    "error": circle_response.get('error')
+                })
+
+            session = Session()
+            changes = []
+            refunds = []
+            for transfer, result in zip(transfers, results):
+                # Skip payments the recovery sweep already finished while Circle was called
+                recorded = session.execute(
+                    update(Dashboard)
+                    .where(Dashboard.payment_id == transfer['payment_id'], Dashboard.status == 'processing')
+                    .values(status=result['status'], transaction_status=result['status'])
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                if not recorded:
+                    continue
+                changes.append((wallet_id, transfer['transaction_type'], transfer['created_at'], transfer['amount'],
+                                'processing', result['status']))
+                if result['status'] == 'failed':
+                    refunds.append((transfer['payment_id'], transfer['amount']))
+            payment_stats.record(session, changes)
+            if refunds:
+                # Release the reservation for transfers Circle rejected
+                credit_many(session, wallet_id, refunds)
+            session.commit()
+            invalidate_wallet(wallet_id, sender_email)
+            new_balance = current_balance(session, wallet_id)
+            session.close()
+
+            completed = sum(1 for result in results if result['status'] == 'completed')
+            response_data = {
+                "success": completed == len(results),
+                "message": "Batch processed",
+                "summary": {
+                    "total": len(results),
+                    "completed": completed,
+                    "failed": len(results) - completed,
+                    "completed_amount": completed_amount
+                },
+                "results": results,
+                "new_balance": new_balance
+            }
+
+            return jsonify(response_data), 201
+
+        except Exception as e:
+            session.rollback()
+            session.close()
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+@app.route('/cancel_payment', methods=['POST'])
+@idempotent(idempotency_store)
+def cancel_payment():
+    """
+    Cancel payment endpoint
+
+    Expected JSON data:
+    {
+        "payment_id": "3f2c..."
+    }
+    OR
+    {
+        "recipient_address": "0xabcd..."  // cancels the latest payment to this recipient
+    }
+    """
+    try:
+        data = request.get_json()
+
+        if not data or ('payment_id' not in data and 'recipient_address' not in data):
+            return jsonify({"error": "payment_id or recipient_address is required"}), 400
+
+        session = Session()
+
+        try:
+            # Find payment
+            if 'payment_id' in data:
+                payment = session.query(Dashboard).filter_by(payment_id=data['payment_id']).first()
+            else:
+                payment = session.query(Dashboard).filter_by(
+                    recipient_address=data['recipient_address']
+                ).order_by(Dashboard.created_at.desc()).first()
+
+            if not payment:
+                session.close()
+                return jsonify({"error": "Payment not found"}), 404
+
+            # Check if payment can be cancelled
+            if payment.status == 'completed':
+                session.close()
+                return jsonify({"error": "Cannot cancel completed payment"}), 400
+            if payment.status == 'processing':
+                session.close()
+                return jsonify({"error": "Payment is being processed and cannot be cancelled"}), 409
+
+            # Update payment status, unless a worker claimed the payment meanwhile
+            previous_status = payment.status
+            cancelled = session.query(Dashboard).filter_by(
+                payment_id=payment.payment_id, status=previous_status
+            ).update({"status": 'cancelled', "transaction_status": 'cancelled'})
+            if not cancelled:
+                session.rollback()
+                session.close()
+                return jsonify({"error": "Payment is being processed and cannot be cancelled"}), 409
+            payment_stats.record(session, [payment_stats.change(payment, previous_status, 'cancelled')])
+            session.commit()
+
+            response_data = {
+                "success": True,
+                "message": "Payment cancelled successfully",
+                "payment": {
+                    "payment_id": payment.payment_id,
+                    "recipient_address": payment.recipient_address,
+                    "amount": payment.amount,
+                    "status": payment.status
+                }
+            }
+
+            session.close()
+            return jsonify(response_data), 200
+
+        except Exception as e:
+            session.rollback()
+            session.close()
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+@app.route('/api/dashboard/stats', methods=['GET'])
+def get_dashboard_stats():
+    """
+    Get the dashboard summary from the payment_stats rollups
+
+    Query parameters:
+    - user_email: Limit the figures to this user's wallet (default: all wallets)
+
+    activePayments counts pending and processing payments, monthlyVolume sums
+    the payments completed that were created this calendar month. Without
+    user_email, balance is the total of all active wallets from balance_totals.
+    """
+    try:
+        user_email = request.args.get('user_email')
+        session = Session()
 
-            response_data = {
-                "success": circle_response.get('success', False),
-                "message": "Payment processed",
-                "payment": {
-                    "recipient_address": new_payment.recipient_address,
-                    "amount": new_payment.amount,
-                    "note": new_payment.note,
-                    "status": new_payment.status[0],
-                    "type": new_payment.type[0]
-                },
-                "new_balance": wallet.balance,
-                "circle_data": circle_response.get('data')
-            }
+        try:
+            if user_email:
+                wallet = load_wallet(user_email=user_email)
+                if not wallet:
+                    session.close()
+                    return jsonify({"error": "Wallet not found for this user"}), 404
+                balance = wallet['balance']
+                stats = payment_stats.dashboard_stats(session, [wallet['wallet_id']])
+            else:
+                balance = total_balance(session)
+                stats = payment_stats.dashboard_stats(session)
 
             session.close()
-            return jsonify(response_data), 201
+            return jsonify({"success": True, "data": {"balance": balance, **stats}}), 200
 
         except Exception as e:
-            session.rollback()
             session.close()
             return jsonify({"error": f"Database error: {str(e)}"}), 500
 
@@ -506,59 +1634,57 @@ def send_payment():
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 
-@app.route('/cancel_payment', methods=['POST'])
-def cancel_payment():
+@app.route('/api/dashboard/transactions/recent', methods=['GET'])
+def get_recent_transactions():
     """
-    Cancel payment endpoint
+    Get the newest transactions for the dashboard
 
-    Expected JSON data:
-    {
-        "recipient_address": "0xabcd..."
-    }
+    Query parameters:
+    - limit: Number of transactions (default 10, max 50)
+    - user_email: Only this sender's transactions (default: all)
+
+    Reads the newest-first indexes on send_payments, so the cost depends on
+    limit, not on how many payments exist.
     """
     try:
-        data = request.get_json()
+        try:
+            limit = int(request.args.get('limit', DEFAULT_RECENT_TRANSACTIONS))
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
 
-        if not data or 'recipient_address' not in data:
-            return jsonify({"error": "recipient_address is required"}), 400
+        if limit < 1:
+            return jsonify({"error": "limit must be positive"}), 400
+        limit = min(limit, MAX_RECENT_TRANSACTIONS)
 
+        user_email = request.args.get('user_email')
         session = Session()
 
         try:
-            # Find payment
-            payment = session.query(Dashboard).filter_by(
-                recipient_address=data['recipient_address']
-            ).first()
-
-            if not payment:
-                session.close()
-                return jsonify({"error": "Payment not found"}), 404
-
-            # Check if payment can be cancelled
-            if payment.status[0] == 'completed':
-                session.close()
-                return jsonify({"error": "Cannot cancel completed payment"}), 400
-
-            # Update payment status
-            payment.status = ['cancelled']
-            payment.transactions = ['cancelled']
-            session.commit()
+            statement = select(
+                Dashboard.payment_id, Dashboard.type, Dashboard.amount, Dashboard.status,
+                Dashboard.created_at, Dashboard.recipient_address
+            )
+            if user_email:
+                statement = statement.where(Dashboard.sender_email == user_email)
+            rows = session.execute(
+                statement.order_by(Dashboard.created_at.desc(), Dashboard.payment_id.desc()).limit(limit)
+            ).all()
+            session.close()
 
-            response_data = {
+            # Field names and capitalized values as the dashboard renders them
+            return jsonify({
                 "success": True,
-                "message": "Payment cancelled successfully",
-                "payment": {
-                    "recipient_address": payment.recipient_address,
-                    "amount": payment.amount,
-                    "status": payment.status[0]
-                }
-            }
-
-            session.close()
-            return jsonify(response_data), 200
+                "data": [{
+                    "id": row.payment_id,
+                    "type": row.type.capitalize(),
+                    "amount": row.amount,
+                    "status": row.status.capitalize(),
+                    "date": row.created_at.date().isoformat(),
+                    "recipient": row.recipient_address
+                } for row in rows]
+            }), 200
 
         except Exception as e:
-            session.rollback()
             session.close()
             return jsonify({"error": f"Database error: {str(e)}"}), 500
 
@@ -569,59 +1695,75 @@ def cancel_payment():
 @app.route('/transactions', methods=['GET'])
 def get_transactions():
     """
-    Get transactions with optional filtering
+    Get transactions with optional filtering and keyset pagination
 
     Query parameters:
     - user_email: Filter by sender email
     - status: Filter by status (all, completed, pending, failed, cancelled)
     - type: Filter by type (rent, purchase, deposit, insurance, transfer)
+    - limit: Page size (default 50, max 500)
+    - after: Cursor returned as next_cursor by the previous page
+    - include_total: Set to false to skip counting all matching rows
+
+    Transactions are returned newest first.
     """
     try:
         user_email = request.args.get('user_email')
         status_filter = request.args.get('status', 'all')
         type_filter = request.args.get('type')
+        after = request.args.get('after')
+        include_total = request.args.get('include_total', 'true').lower() != 'false'
+
+        try:
+            limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+
+        if limit < 1:
+            return jsonify({"error": "limit must be positive"}), 400
+        limit = min(limit, MAX_PAGE_SIZE)
 
         session = Session()
 
         try:
-            # Get all payments
             query = session.query(Dashboard)
 
-            # Apply filters
+            # Apply filters in the database
+            if user_email:
+                query = query.filter(Dashboard.sender_email == user_email)
             if status_filter != 'all':
-                # Note: This is simplified - you might want to join with Wallet table
-                # to properly filter by user_email
-                payments = query.all()
-                filtered_payments = [
-                    p for p in payments
-                    if status_filter in p.transactions
-                ]
-            else:
-                filtered_payments = query.all()
-
-            # Filter by type if specified
+                query = query.filter(Dashboard.status == status_filter)
             if type_filter:
-                filtered_payments = [
-                    p for p in filtered_payments
-                    if type_filter in p.type
-                ]
+                query = query.filter(Dashboard.type == type_filter)
+
+            total = query.order_by(None).count() if include_total else None
+
+            # Keyset pagination on (created_at, payment_id)
+            if after:
+                cursor = decode_cursor(after)
+                if not cursor:
+                    session.close()
+                    return jsonify({"error": "Invalid cursor"}), 400
+                query = query.filter(
+                    tuple_(Dashboard.created_at, Dashboard.payment_id) < cursor
+                )
+            payments = query.order_by(
+                Dashboard.created_at.desc(), Dashboard.payment_id.desc()
+            ).limit(limit + 1).all()
+
+            has_more = len(payments) > limit
+            payments = payments[:limit]
 
             # Build response
-            transactions_list = []
-            for payment in filtered_payments:
-                transactions_list.append({
-                    "recipient_address": payment.recipient_address,
-                    "amount": payment.amount,
-                    "note": payment.note,
-                    "status": payment.status[0] if payment.status else 'unknown',
-                    "transaction_status": payment.transactions[0] if payment.transactions else 'unknown',
-                    "type": payment.type[0] if payment.type else 'unknown'
-                })
+            transactions_list = [transaction_to_dict(payment) for payment in payments]
 
             response_data = {
                 "success": True,
                 "count": len(transactions_list),
+                "total": total,
+                "next_cursor": encode_cursor(payments[-1]) if has_more else None,
                 "filters": {
+                    "user_email": user_email,
                     "status": status_filter,
                     "type": type_filter
                 },
@@ -639,6 +1781,162 @@ def get_transactions():
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 
+def transaction_to_dict(payment):
+    """Serialize a payment (ORM object or result row) as listed by /transactions"""
+    return {
+        "payment_id": payment.payment_id,
+        "recipient_address": payment.recipient_address,
+        "sender_email": payment.sender_email,
+        "amount": payment.amount,
+        "note": payment.note,
+        "status": payment.status,
+        "transaction_status": payment.transaction_status,
+        "type": payment.type,
+        "created_at": payment.created_at.isoformat()
+    }
+
+
+EXPORT_COLUMNS = [
+    'payment_id', 'recipient_address', 'sender_email', 'amount', 'note',
+    'status', 'transaction_status', 'type', 'created_at'
+]
+
+
+@app.route('/transactions/export', methods=['GET'])
+def export_transactions():
+    """
+    Stream every matching transaction, newest first
+
+    Rows are read EXPORT_CHUNK_SIZE at a time and written as they arrive, so
+    memory use does not grow with the number of payments.
+
+    Query parameters:
+    - user_email: Filter by sender email
+    - status: Filter by status (all, completed, pending, failed, cancelled)
+    - type: Filter by type (rent, purchase, deposit, insurance, transfer)
+    - since / until: ISO timestamps bounding created_at
+    - format: ndjson (default) or csv
+
+    Send "Accept-Encoding: gzip" for a gzip-compressed stream.
+    """
+    try:
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in ('ndjson', 'csv'):
+            return jsonify({"error": "format must be ndjson or csv"}), 400
+
+        try:
+            since, until = parse_time_range(request.args)
+        except ValueError:
+            return jsonify({"error": "Invalid since or until"}), 400
+
+        statement = select(*(getattr(Dashboard, column) for column in EXPORT_COLUMNS))
+        user_email = request.args.get('user_email')
+        status_filter = request.args.get('status', 'all')
+        type_filter = request.args.get('type')
+        if user_email:
+            statement = statement.where(Dashboard.sender_email == user_email)
+        if status_filter != 'all':
+            statement = statement.where(Dashboard.status == status_filter)
+        if type_filter:
+            statement = statement.where(Dashboard.type == type_filter)
+        if since:
+            statement = statement.where(Dashboard.created_at >= since)
+        if until:
+            statement = statement.where(Dashboard.created_at < until)
+        statement = statement.order_by(Dashboard.created_at.desc(), Dashboard.payment_id.desc())
+
+        use_gzip = request.accept_encodings['gzip'] > 0  # honors q-values, so gzip;q=0 opts out
+        rows = stream_export_rows(statement, export_format)
+        if use_gzip:
+            rows = gzip_stream(rows)
+
+        response = Response(
+            stream_with_context(rows),
+            mimetype='text/csv' if export_format == 'csv' else 'application/x-ndjson'
+        )
+        response.headers['Content-Disposition'] = f'attachment; filename=transactions.{export_format}'
+        response.headers['Vary'] = 'Accept-Encoding'
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+def stream_export_rows(statement, export_format):
+    """
+    Yield the export body one chunk of rows at a time
+
+    The query runs with a server-side cursor (stream_results) where the driver
+    supports one and fetches EXPORT_CHUNK_SIZE rows per round trip. Errors after
+    the first chunk cannot change the status code any more; NDJSON exports end
+    with an {"error": ...} line instead.
+    """
+    session = Session()
+    try:
+        result = session.execute(
+            statement.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE)
+        )
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if export_format == 'csv' else None
+        if writer:
+            writer.writerow(EXPORT_COLUMNS)
+
+        for partition in result.partitions():
+            for row in partition:
+                if writer:
+                    writer.writerow([
+                        row.created_at.isoformat() if column == 'created_at' else getattr(row, column)
+                        for column in EXPORT_COLUMNS
+                    ])
+                else:
+                    buffer.write(json.dumps(transaction_to_dict(row), separators=(',', ':')))
+                    buffer.write('\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    except Exception as e:
+        print(f"[Export] Transaction export failed: {e}")
+        if export_format == 'ndjson':
+            yield json.dumps({"error": f"Database error: {str(e)}"}) + '\n'
+    finally:
+        session.close()
+
+
+def gzip_stream(chunks):
+    """Gzip a stream of text chunks, flushing after each so clients get data as it is produced"""
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def encode_cursor(payment):
+    """Build an opaque keyset cursor pointing at the given payment"""
+    return f"{payment.created_at.isoformat()}|{payment.payment_id}"
+
+
+def decode_cursor(cursor):
+    """
+    Parse a cursor produced by encode_cursor
+
+    Returns:
+        tuple: (created_at, payment_id), or None if the cursor is malformed
+    """
+    created_at, _, payment_id = cursor.partition('|')
+    try:
+        return datetime.fromisoformat(created_at), payment_id
+    except ValueError:
+        return None
+
+
 @app.route('/profile/<identifier>', methods=['GET'])
 def get_profile(identifier):
     """
@@ -653,43 +1951,28 @@ def get_profile(identifier):
     - disconnect
     """
     try:
-        session = Session()
-
         try:
-            # Try to find by email first, then by full name
-            user = session.query(Profile).filter_by(email_address=identifier).first()
-            if not user:
-                user = session.query(Profile).filter_by(full_name=identifier).first()
+            user = load_profile(identifier)
 
             if not user:
-                session.close()
                 return jsonify({"error": "Profile not found"}), 404
 
             # Get associated wallet
-            wallet = session.query(Wallet).filter_by(user_email=user.email_address).first()
+            wallet = load_wallet(user_email=user['email_address'])
 
             response_data = {
                 "success": True,
-                "profile": {
-                    "full_name": user.full_name,
-                    "email_address": user.email_address,
-                    "wallet_address": user.wallet_address,
-                    "notifications": user.notifications,
-                    "language": user.language,
-                    "disconnect": user.disconnect
-                },
+                "profile": user,
                 "wallet_info": {
-                    "wallet_id": wallet.wallet_id if wallet else None,
-                    "balance": wallet.balance if wallet else 0,
-                    "status": wallet.status if wallet else None
+                    "wallet_id": wallet['wallet_id'],
+                    "balance": wallet['balance'],
+                    "status": wallet['status']
                 } if wallet else None
             }
 
-            session.close()
             return jsonify(response_data), 200
 
         except Exception as e:
-            session.close()
             return jsonify({"error": f"Database error: {str(e)}"}), 500
 
     except Exception as e:
@@ -728,6 +2011,8 @@ def update_profile():
                 session.close()
                 return jsonify({"error": "Profile not found"}), 404
 
+            previous_name = user.full_name
+
             # Update fields if provided
             if 'full_name' in data:
                 user.full_name = data['full_name']
@@ -739,6 +2024,7 @@ def update_profile():
                 user.disconnect = data['disconnect']
 
             session.commit()
+            invalidate_profile(user.email_address, previous_name, user.full_name)
 
             response_data = {
                 "success": True,
@@ -765,7 +2051,7 @@ def update_profile():
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 
-def send_circle_payment(sender_wallet, recipient_address, amount, transaction_type):
+def send_circle_payment(sender_wallet, recipient_address, amount, transaction_type, idempotency_key=None):
     """
     Send payment via Circle API
 
@@ -774,60 +2060,26 @@ def send_circle_payment(sender_wallet, recipient_address, amount, transaction_ty
         recipient_address (str): Recipient's wallet address
         amount (float): Amount to send
         transaction_type (str): Type of transaction
+        idempotency_key (str): Circle idempotency key, normally the payment_id
 
     Returns:
         dict: Response from Circle API
     """
-    if not CIRCLE_API_KEY:
+    client = get_circle_client()
+    if not client:
         return {
             "success": False,
             "error": "Circle API Key not configured"
         }
 
-    headers = {
-        "Authorization": f"Bearer {os.getenv('CircleAPI_KEY')}",
-        "Content-Type": "application/json"
-    }
-
-    payload = {
-        "idempotencyKey": str(uuid.uuid4()),
-        "source": {
-            "type": "wallet",
-            "id": sender_wallet
-        },
-        "destination": {
-            "type": "blockchain",
-            "address": recipient_address
-        },
-        "amount": {
-            "amount": str(amount),
-            "currency": "USD"
-        },
-        "metadata": {
-            "transactionType": transaction_type
-        }
-    }
-
     try:
         # Call Circle API to send payment
-        response = requests.post(
-            f"{CIRCLE_API_URL}/transfers",
-            headers=headers,
-            json=payload,
-            timeout=10
+        response = client.post(
+            "/transfers",
+            transfer_payload(sender_wallet, recipient_address, amount, transaction_type, idempotency_key),
+            idempotent=True
         )
-
-        if response.status_code in [200, 201]:
-            return {
-                "success": True,
-                "data": response.json()
-            }
-        else:
-            return {
-                "success": False,
-                "error": f"Circle API error: {response.status_code}",
-                "details": response.text
-            }
+        return circle_result(response)
 
     except requests.exceptions.RequestException as e:
         return {
@@ -839,44 +2091,269 @@ def send_circle_payment(sender_wallet, recipient_address, amount, transaction_ty
 @app.route('/wallet/user/<user_email>', methods=['GET'])
 def get_user_wallet(user_email):
     """Get wallet by user email"""
+    wallet = load_wallet(user_email=user_email)
+    if wallet:
+        return jsonify(wallet), 200
+    else:
+        return jsonify({"error": "Wallet not found for this user"}), 404
+
+
+@app.route('/list_wallets', methods=['GET'])
+def list_wallets():
+    """
+    List wallets with keyset pagination
+
+    Query parameters:
+    - status: Filter by wallet status (active, inactive, suspended)
+    - limit: Page size (default 50, max 500)
+    - after: Cursor returned as next_cursor by the previous page
+    - include_total: Set to false to skip counting all matching wallets
+
+    Balances are the local ones; balance_checked_at tells when they were
+    last compared with Circle.
+    """
+    try:
+        try:
+            limit = parse_page_size(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        try:
+            page = load_wallet_page(
+                request.args.get('status'), request.args.get('after'), limit,
+                request.args.get('include_total', 'true').lower() != 'false'
+            )
+        except Exception as e:
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+
+        return jsonify({"success": True, **page}), 200
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+@app.route('/list_wallets_with_balances', methods=['GET'])
+def list_wallets_with_balances():
+    """
+    List wallets like /list_wallets, each with its live Circle balance
+
+    Query parameters: as /list_wallets, plus
+    - timeout: Seconds to wait for Circle (default 2, max 10)
+
+    Balances are looked up concurrently and cached for a few seconds.
+    Lookups still running when the timeout passes are reported with
+    circle_balance_status "pending" and the response has partial=true; they
+    keep running in the background, so repeating the request picks them up
+    from the cache. When too many lookups are already queued, new ones are
+    not started and reported as "skipped".
+    """
+    try:
+        try:
+            limit = parse_page_size(request.args)
+            timeout = min(max(float(request.args.get('timeout', LIST_BALANCE_TIMEOUT)), 0), 10)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        try:
+            page = load_wallet_page(
+                request.args.get('status'), request.args.get('after'), limit,
+                request.args.get('include_total', 'true').lower() != 'false'
+            )
+        except Exception as e:
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+
+        lookups = [(balance_lookups.submit(wallet['wallet_id']), wallet) for wallet in page['wallets']]
+        done, _ = wait([future for future, _ in lookups if future is not None], timeout=timeout)
+
+        pending = 0
+        for future, wallet in lookups:
+            wallet['circle_balance'] = None
+            if future is None:
+                pending += 1
+                wallet['circle_balance_status'] = 'skipped'
+            elif future not in done:
+                pending += 1
+                wallet['circle_balance_status'] = 'pending'
+            else:
+                result = future.result()
+                wallet['circle_balance'] = result['balance']
+                wallet['circle_balance_status'] = 'ok' if result['error'] is None else 'error'
+
+        return jsonify({"success": True, "partial": pending > 0, "pending": pending, **page}), 200
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+def parse_page_size(args):
+    """
+    Read the limit query parameter, capped at MAX_PAGE_SIZE
+
+    Raises:
+        ValueError: If limit is not a positive integer
+    """
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def load_wallet_page(status, after, limit, include_total=True):
+    """
+    One page of wallets ordered by wallet_id, reading only the listed columns
+
+    Args:
+        status (str): Wallet status to filter by, or None for all
+        after (str): wallet_id of the last wallet on the previous page
+        limit (int): Page size
+        include_total (bool): Also count all matching wallets
+
+    Returns:
+        dict: count, total, next_cursor and wallets
+    """
     session = Session()
     try:
-        wallet = session.query(Wallet).filter_by(user_email=user_email).first()
-        if wallet:
-            return jsonify({
-                "wallet_id": wallet.wallet_id,
-                "user_email": wallet.user_email,
-                "wallet_address": wallet.wallet_address,
-                "balance": wallet.balance,
-                "blockchains": wallet.blockchains,
-                "transaction_types": wallet.transaction_types,
-                "status": wallet.status
-            }), 200
-        else:
-            return jsonify({"error": "Wallet not found for this user"}), 404
+        statement = select(
+            Wallet.wallet_id, Wallet.user_email, Wallet.wallet_address, Wallet.balance,
+            Wallet.blockchains, Wallet.status, Wallet.balance_checked_at
+        )
+        if status:
+            statement = statement.where(Wallet.status == status)
+
+        total = None
+        if include_total:
+            total = session.execute(
+                select(func.count()).select_from(statement.subquery())
+            ).scalar()
+
+        if after:
+            statement = statement.where(Wallet.wallet_id > after)
+        rows = session.execute(statement.order_by(Wallet.wallet_id).limit(limit + 1)).all()
     finally:
         session.close()
 
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "count": len(rows),
+        "total": total,
+        "next_cursor": rows[-1].wallet_id if has_more else None,
+        "wallets": [{
+            "wallet_id": row.wallet_id,
+            "user_email": row.user_email,
+            "wallet_address": row.wallet_address,
+            "balance": row.balance,
+            "blockchains": list(row.blockchains or []),
+            "status": row.status,
+            "balance_checked_at": row.balance_checked_at.isoformat() if row.balance_checked_at else None
+        } for row in rows]
+    }
+
+
+class BalanceLookups:
+    """
+    Circle balance lookups shared by all requests
+
+    Concurrent requests for the same wallet share one lookup. Lookups that
+    would exceed max_pending queued or running ones are shed rather than
+    queued, so a slow Circle cannot build an unbounded backlog. Every call
+    goes through the reconciler's rate limiter, so listings and
+    reconciliation together stay within RECONCILE_RATE in this process.
+    Results, failures included, are cached for LIST_BALANCE_CACHE_TTL.
+    """
+
+    def __init__(self, limiter, max_workers=LIST_BALANCE_CONCURRENCY, max_pending=LIST_BALANCE_MAX_PENDING):
+        self.limiter = limiter
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='balance-lookup')
+        self._in_flight = {}  # wallet_id -> Future
+        self._lock = threading.Lock()
+        self.shed = 0
+
+    def submit(self, wallet_id):
+        """Future of {"balance", "error"} for the wallet, or None if the lookup was shed"""
+        with self._lock:
+            future = self._in_flight.get(wallet_id)
+            if future is not None:
+                return future
+            if len(self._in_flight) >= self.max_pending:
+                self.shed += 1
+                return None
+            future = self._executor.submit(self._load, wallet_id)
+            self._in_flight[wallet_id] = future
+        future.add_done_callback(lambda _: self._forget(wallet_id))
+        return future
+
+    def _forget(self, wallet_id):
+        with self._lock:
+            self._in_flight.pop(wallet_id, None)
+
+    def _load(self, wallet_id):
+        def loader():
+            self.limiter.acquire()
+            result = fetch_circle_balance(wallet_id)
+            if not result.get('success'):
+                return {"balance": None, "error": result.get('error')}
+            return {"balance": token_balance(result['data'] or {}), "error": None}
+
+        return cache.get_or_load(f"circle_balance:{wallet_id}", loader, ttl=LIST_BALANCE_CACHE_TTL)
+
+
+balance_lookups = BalanceLookups(balance_reconciler.limiter)
+
 
 # Additional endpoint to check user status
 @app.route('/user/<full_name>', methods=['GET'])
 def get_user(full_name):
     """Get user information"""
-    session = Session()
+    user = load_user(full_name)
+    if user:
+        return jsonify(user), 200
+    else:
+        return jsonify({"error": "User not found"}), 404
+
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    """
+    AI assistant endpoint
+
+    Expected JSON data:
+    {
+        "message": "How do I send USDC on Arc?",
+        "conversation_id": "5b1e..."  // optional, returned by the first call
+    }
+
+    The conversation is kept server-side: send back the returned
+    conversation_id instead of the full history on every turn.
+    """
     try:
-        user = session.query(Profile).filter_by(full_name=full_name).first()
-        if user:
+        data = request.get_json()
+
+        if not data or not isinstance(data.get('message'), str) or not data['message'].strip():
+            return jsonify({"error": "message is required"}), 400
+
+        conversation_id = data.get('conversation_id') or str(uuid.uuid4())
+        reply = get_ai_reply(data['message'], [], conversation_id=conversation_id)
+
+        if reply is None:
             return jsonify({
-                "full_name": user.full_name,
-                "email_address": user.email_address,
-                "wallet_address": user.wallet_address,
-                "notifications": user.notifications,
-                "language": user.language
-            }), 200
-        else:
-            return jsonify({"error": "User not found"}), 404
-    finally:
-        session.close()
+                "success": False,
+                "error": "AI assistant is unavailable",
+                "conversation_id": conversation_id
+            }), 503
+
+        return jsonify({
+            "success": True,
+            "reply": reply,
+            "conversation_id": conversation_id
+        }), 200
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 
 @app.route('/logout', methods=['POST'])
@@ -932,6 +2409,7 @@ def logout():
             # Update disconnect status
             user.disconnect = ['Yes']
             session.commit()
+            invalidate_profile(user.email_address, user.full_name)
 
             response_data = {
                 "success": True,
@@ -966,17 +2444,13 @@ def terminate_circle_session(email, wallet_address):
     Returns:
         dict: Response from Circle API
     """
-    if not CIRCLE_API_KEY:
+    client = get_circle_client()
+    if not client:
         return {
             "success": False,
             "error": "Circle API Key not configured"
         }
 
-    headers = {
-        "Authorization": f"Bearer {os.getenv('CircleAPI_KEY')}",
-        "Content-Type": "application/json"
-    }
-
     payload = {
         "email": email,
         "walletAddress": wallet_address,
@@ -985,12 +2459,7 @@ def terminate_circle_session(email, wallet_address):
 
     try:
         # Call Circle API to terminate session
-        response = requests.post(
-            f"{CIRCLE_API_URL}/businessAccount/sessions/terminate",
-            headers=headers,
-            json=payload,
-            timeout=10
-        )
+        response = client.post("/businessAccount/sessions/terminate", payload)
 
         if response.status_code in [200, 201, 204]:
             return {
@@ -1012,4 +2481,7 @@ def terminate_circle_session(email, wallet_address):
 
 
 if __name__ == '__main__':
+    # The debug reloader runs this block in a parent and a child process; only the child serves
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        balance_reconciler.start()
     app.run(debug=True)
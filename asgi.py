@@ -0,0 +1,769 @@
+import asyncio
+import io
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from flask import Request
+from sqlalchemy import select, update
+from app import (
+    app as flask_app, idempotency_store, payment_workers, MAX_CONTENT_LENGTH, MAX_PAYMENT_WAIT,
+    PAYMENT_OUTCOME_ATTEMPTS, PAYMENT_POLL_INTERVAL, circle_result, create_wallet_payload, existing_payment_result,
+    invalidate_wallet, payment_id_for, recover_stale_payments, register_wallet_payload, transfer_payload
+)
+from balances import credit, current_balance, debit, open_wallet
+from circle_client import backoff_delay, close_async_circle_client, get_async_circle_client, httpx
+from idempotency import (
+    IDEMPOTENCY_HEADER, IDEMPOTENCY_MAX_KEY_LENGTH, IN_PROGRESS, REPLAY, key_error, mark_upstream_call,
+    poll_delays, replay_response, request_fingerprint, stored_headers, upstream_called, upstream_key
+)
+from metrics import instrument_engine, observe_request, set_route
+from payment_stats import change, record
+from models import Dashboard, Profile, Wallet, TRANSACTION_TYPES, build_async_engine
+
+# --- ASGI serving mode ---
+# Run with any ASGI server, e.g.  uvicorn asgi:application --workers 4
+#
+# The endpoints that wait on Circle (sign_up, create_wallet, send_payment) and
+# the /payment/<payment_id> long-poll run here as coroutines on an async
+# database engine and an httpx client, so a worker is not tied up while they
+# wait. Every other route is served by the Flask app on a bounded thread pool.
+# Responses are rendered by Flask's JSON provider, so they are byte-identical
+# to the WSGI deployment.
+#
+# Needs: httpx, sqlalchemy[asyncio] and the asyncio DB driver (aiosqlite for SQLite).
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', '32'))  # threads for routes served by Flask
+ASGI_STREAM_BUFFER = 8  # response chunks buffered between a Flask thread and the event loop
+
+_wsgi_executor = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix='asgi-wsgi')
+
+async_engine = None
+AsyncSession = None
+
+_background_tasks = set()
+_payment_events = {}  # payment_id -> asyncio.Event set when its processing task ends
+
+if httpx is not None:
+    CIRCLE_CONNECTION_ERRORS = (requests.exceptions.RequestException, httpx.HTTPError)
+else:
+    CIRCLE_CONNECTION_ERRORS = (requests.exceptions.RequestException,)
+
+
+async def startup():
+    """Create the async engine and session factory (idempotent)"""
+    global async_engine, AsyncSession
+    if async_engine is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        async_engine = build_async_engine()
+        instrument_engine(async_engine.sync_engine)
+        # Keep attribute values after commit; refreshing them would need awaits
+        AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+        payment_workers.start_recovery(recover_stale_payments)
+
+
+async def shutdown():
+    """Let in-flight payments finish, then close connections"""
+    if _background_tasks:
+        await asyncio.wait(list(_background_tasks), timeout=MAX_PAYMENT_WAIT)
+    await close_async_circle_client()
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+async def _first(session, statement):
+    result = await session.execute(statement.limit(1))
+    return result.scalars().first()
+
+
+# --- Circle API (async) ---
+
+async def circle_post(path, payload, unwrap_data=False):
+    """
+    POST to Circle without blocking the event loop
+
+    Args:
+        path (str): Endpoint path
+        payload (dict): JSON body
+        unwrap_data (bool): Return the body's "data" object instead of the whole body
+
+    Returns:
+        dict: Same result dict as the blocking helpers in app.py
+    """
+    client = get_async_circle_client()
+    if not client:
+        return {
+            "success": False,
+            "error": "Circle API Key not configured"
+        }
+
+    try:
+        response = await client.post(path, payload, idempotent=True)
+        return circle_result(response, unwrap_data=unwrap_data)
+    except CIRCLE_CONNECTION_ERRORS as e:
+        return {
+            "success": False,
+            "error": f"Circle API connection error: {str(e)}"
+        }
+
+
+# --- Handlers ---
+# Each mirrors the Flask view of the same name in app.py and returns
+# (data, status) or (data, status, headers).
+
+async def sign_up(request):
+    """POST /sign_up"""
+    try:
+        data = request.get_json()
+
+        if not data:
+            return {"error": "No data provided in request"}, 400
+
+        required_fields = ['full_name', 'email_address', 'wallet_address']
+        for field in required_fields:
+            if field not in data:
+                return {"error": f"Missing field: {field}"}, 400
+
+        async with AsyncSession() as session:
+            try:
+                if await _first(session, select(Profile).filter_by(full_name=data['full_name'])):
+                    return {"error": "User with this name already exists"}, 409
+
+                if await _first(session, select(Profile).filter_by(email_address=data['email_address'])):
+                    return {"error": "This email address is already registered"}, 409
+
+                mark_upstream_call(request)
+                circle_response = await circle_post(
+                    "/businessAccount/wallets/addresses/deposit",
+                    register_wallet_payload(data['email_address'], data['wallet_address'])
+                )
+
+                if not circle_response.get('success'):
+                    return {
+                        "error": "Circle API registration error",
+                        "details": circle_response.get('error')
+                    }, 500
+
+                new_profile = Profile(
+                    full_name=data['full_name'],
+                    email_address=data['email_address'],
+                    wallet_address=data['wallet_address'],
+                    notifications=data.get('notifications', ['Yes', 'No']),
+                    language=data.get('language', ['English', 'French', 'German']),
+                    disconnect=['Yes']
+                )
+                session.add(new_profile)
+                await session.commit()
+
+                return {
+                    "success": True,
+                    "message": "User successfully registered",
+                    "user": {
+                        "full_name": new_profile.full_name,
+                        "email_address": new_profile.email_address,
+                        "wallet_address": new_profile.wallet_address
+                    },
+                    "circle_data": circle_response.get('data')
+                }, 201
+
+            except Exception as e:
+                await session.rollback()
+                return {"error": f"Database error: {str(e)}"}, 500
+
+    except Exception as e:
+        return {"error": f"Server error: {str(e)}"}, 500
+
+
+async def create_wallet(request):
+    """POST /create_wallet"""
+    try:
+        data = request.get_json()
+
+        if not data:
+            return {"error": "No data provided in request"}, 400
+
+        user_email = data.get('user_email')
+        user_id = data.get('user_id')
+
+        if not user_email and not user_id:
+            return {
+                "error": "Either user_email or user_id must be provided"
+            }, 400
+
+        blockchains = data.get('blockchains', ["ARC-TESTNET"])
+
+        async with AsyncSession() as session:
+            try:
+                if user_email:
+                    user = await _first(session, select(Profile).filter_by(email_address=user_email))
+                else:
+                    user = await _first(session, select(Profile).filter_by(full_name=user_id))
+
+                if not user:
+                    return {"error": "User not found"}, 404
+
+                existing_wallet = await _first(session, select(Wallet).filter_by(user_email=user.email_address))
+
+                if existing_wallet:
+                    return {
+                        "error": "Wallet already exists for this user",
+                        "wallet_id": existing_wallet.wallet_id
+                    }, 409
+
+                mark_upstream_call(request)
+                circle_response = await circle_post(
+                    "/w3s/user/wallets", create_wallet_payload(
+                        user.email_address, blockchains,
+                        upstream_key('create_wallet', request.headers.get(IDEMPOTENCY_HEADER))
+                    ),
+                    unwrap_data=True
+                )
+
+                if not circle_response.get('success'):
+                    return {
+                        "error": "Failed to create wallet in Circle API",
+                        "details": circle_response.get('error')
+                    }, 500
+
+                wallet_data = circle_response.get('data', {})
+                new_wallet = Wallet(
+                    wallet_id=wallet_data.get('id', str(uuid.uuid4())),
+                    user_email=user.email_address,
+                    wallet_address=wallet_data.get('address', user.wallet_address),
+                    balance=0.0,
+                    blockchains=blockchains,
+                    transaction_types=['rent', 'purchase', 'deposit', 'insurance', 'transfer'],
+                    status='active'
+                )
+                session.add(new_wallet)
+                open_wallet(session, new_wallet.wallet_id, new_wallet.balance)
+                await session.commit()
+                invalidate_wallet(new_wallet.wallet_id, new_wallet.user_email)
+
+                return {
+                    "success": True,
+                    "message": "Wallet successfully created",
+                    "wallet": {
+                        "wallet_id": new_wallet.wallet_id,
+                        "wallet_address": new_wallet.wallet_address,
+                        "user_email": new_wallet.user_email,
+                        "balance": new_wallet.balance,
+                        "blockchains": new_wallet.blockchains,
+                        "status": new_wallet.status
+                    },
+                    "circle_data": wallet_data
+                }, 201
+
+            except Exception as e:
+                await session.rollback()
+                return {"error": f"Database error: {str(e)}"}, 500
+
+    except Exception as e:
+        return {"error": f"Server error: {str(e)}"}, 500
+
+
+async def send_payment(request):
+    """POST /send_payment"""
+    try:
+        data = request.get_json()
+
+        if not data:
+            return {"error": "No data provided in request"}, 400
+
+        required_fields = ['sender_email', 'recipient_address', 'amount']
+        for field in required_fields:
+            if field not in data:
+                return {"error": f"Missing field: {field}"}, 400
+
+        async with AsyncSession() as session:
+            try:
+                payment_id = payment_id_for(request.headers.get(IDEMPOTENCY_HEADER))
+                existing_payment = await session.get(Dashboard, payment_id)
+                if existing_payment:
+                    return existing_payment_result(existing_payment, data)
+
+                wallet = await _first(session, select(Wallet).filter_by(user_email=data['sender_email']))
+
+                if not wallet:
+                    return {"error": "Sender wallet not found"}, 404
+
+                if wallet.balance < data['amount']:
+                    return {
+                        "error": "Insufficient balance",
+                        "current_balance": wallet.balance,
+                        "required": data['amount']
+                    }, 400
+
+                transaction_type = data.get('type', 'transfer')
+                if transaction_type not in TRANSACTION_TYPES:
+                    return {
+                        "error": f"Invalid transaction type. Must be one of: {', '.join(TRANSACTION_TYPES)}"
+                    }, 400
+
+                new_payment = Dashboard(
+                    payment_id=payment_id,
+                    recipient_address=data['recipient_address'],
+                    sender_email=data['sender_email'],
+                    sender_wallet_id=wallet.wallet_id,
+                    amount=data['amount'],
+                    note=data.get('note', ''),
+                    status='pending',
+                    transaction_status='pending',
+                    type=transaction_type
+                )
+                session.add(new_payment)
+                await session.flush()
+                await session.run_sync(record, [change(new_payment, None, 'pending')])
+                await session.commit()
+                mark_upstream_call(request)
+
+            except Exception as e:
+                await session.rollback()
+                return {"error": f"Database error: {str(e)}"}, 500
+
+        payment_info = {
+            "payment_id": payment_id,
+            "recipient_address": new_payment.recipient_address,
+            "amount": new_payment.amount,
+            "note": new_payment.note,
+            "type": new_payment.type
+        }
+
+        # Async mode: process on the event loop and return immediately
+        if data.get('async') or request.headers.get('Prefer') == 'respond-async':
+            _submit_payment(payment_id)
+            payment_info["status"] = 'pending'
+            return {
+                "success": True,
+                "message": "Payment accepted for processing",
+                "payment": payment_info,
+                "status_url": f"/payment/{payment_id}"
+            }, 202, {"Location": f"/payment/{payment_id}"}
+
+        try:
+            circle_response, new_balance = await process_payment(payment_id)
+        except Exception as e:
+            return {"error": f"Database error: {str(e)}"}, 500
+        payment_info["status"] = 'completed' if circle_response.get('success') else 'failed'
+
+        return {
+            "success": circle_response.get('success', False),
+            "message": "Payment processed",
+            "error": circle_response.get('error'),
+            "payment": payment_info,
+            "new_balance": new_balance,
+            "circle_data": circle_response.get('data')
+        }, 201
+
+    except Exception as e:
+        return {"error": f"Server error: {str(e)}"}, 500
+
+
+def _submit_payment(payment_id):
+    """Process a payment in the background, waking long-pollers when it is done"""
+    done = _payment_events[payment_id] = asyncio.Event()
+
+    async def run():
+        try:
+            await process_payment(payment_id)
+        except Exception as e:
+            print(f"[ASGI] Payment {payment_id} failed: {e}")
+        finally:
+            done.set()
+            _payment_events.pop(payment_id, None)
+
+    task = asyncio.ensure_future(run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def process_payment(payment_id):
+    """
+    Submit a pending payment to Circle and record the outcome
+
+    Same claim / reserve / release steps as app.process_payment; the ledger
+    helpers run on the async session through run_sync.
+
+    Returns:
+        tuple: (Circle response dict, sender's new balance)
+    """
+    async with AsyncSession() as session:
+        try:
+            claimed = await session.execute(
+                update(Dashboard)
+                .where(Dashboard.payment_id == payment_id, Dashboard.status == 'pending')
+                .values(status='processing', transaction_status='processing')
+            )
+
+            if not claimed.rowcount:
+                await session.rollback()
+                return {"success": False, "error": "Payment is no longer pending"}, None
+
+            payment = await _first(session, select(Dashboard).filter_by(payment_id=payment_id))
+            wallet = await _first(session, select(Wallet).filter_by(user_email=payment.sender_email))
+
+            if not wallet or not await session.run_sync(debit, wallet.wallet_id, payment.amount, payment_id):
+                payment.status = 'failed'
+                payment.transaction_status = 'failed'
+                await session.run_sync(record, [change(payment, 'pending', 'failed')])
+                await session.commit()
+                error = "Insufficient balance" if wallet else "Sender wallet not found"
+                balance = await session.run_sync(current_balance, wallet.wallet_id) if wallet else None
+                return {"success": False, "error": error}, balance
+
+            await session.run_sync(record, [change(payment, 'pending', 'processing')])
+            await session.commit()
+            wallet_id, user_email = wallet.wallet_id, wallet.user_email
+            transfer = (wallet.wallet_address, payment.recipient_address, payment.amount, payment.type)
+        except Exception:
+            await session.rollback()
+            raise
+
+    invalidate_wallet(wallet_id, user_email)
+    circle_response = await circle_post("/transfers", transfer_payload(*transfer, idempotency_key=payment_id))
+    return circle_response, await record_payment_outcome(payment_id, wallet_id, user_email, circle_response)
+
+
+async def record_payment_outcome(payment_id, wallet_id, user_email, circle_response):
+    """Async app.record_payment_outcome: retried, and left to the recovery sweep if it keeps failing"""
+    for attempt in range(PAYMENT_OUTCOME_ATTEMPTS):
+        async with AsyncSession() as session:
+            try:
+                payment = await _first(
+                    session, select(Dashboard).filter_by(payment_id=payment_id, status='processing')
+                )
+                if payment is None:
+                    # Already recorded, e.g. by the recovery sweep
+                    return await session.run_sync(current_balance, wallet_id)
+
+                if circle_response.get('success'):
+                    payment.status = 'completed'
+                    payment.transaction_status = 'completed'
+                else:
+                    payment.status = 'failed'
+                    payment.transaction_status = 'failed'
+
+                    # Release the reserved amount
+                    await session.run_sync(credit, wallet_id, payment.amount, payment_id)
+
+                await session.run_sync(record, [change(payment, 'processing', payment.status)])
+                await session.commit()
+                invalidate_wallet(wallet_id, user_email)
+                return await session.run_sync(current_balance, wallet_id)
+
+            except Exception as e:
+                await session.rollback()
+                print(f"[Payments] Recording the outcome of payment {payment_id} failed (attempt {attempt + 1}): {e}")
+        if attempt < PAYMENT_OUTCOME_ATTEMPTS - 1:
+            await asyncio.sleep(backoff_delay(attempt))
+    return None
+
+
+async def get_payment(request, payment_id):
+    """GET /payment/<payment_id>?wait= - long-polls without holding a thread"""
+    try:
+        try:
+            wait = min(float(request.args.get('wait', 0)), MAX_PAYMENT_WAIT)
+        except ValueError:
+            return {"error": "wait must be a number"}, 400
+
+        deadline = time.monotonic() + wait
+
+        while True:
+            async with AsyncSession() as session:
+                payment = await _first(session, select(Dashboard).filter_by(payment_id=payment_id))
+            if not payment:
+                return {"error": "Payment not found"}, 404
+
+            remaining = deadline - time.monotonic()
+            if payment.status not in ('pending', 'processing') or remaining <= 0:
+                return {
+                    "success": True,
+                    "payment": {
+                        "payment_id": payment.payment_id,
+                        "recipient_address": payment.recipient_address,
+                        "sender_email": payment.sender_email,
+                        "amount": payment.amount,
+                        "note": payment.note,
+                        "status": payment.status,
+                        "type": payment.type,
+                        "created_at": payment.created_at.isoformat(),
+                        "updated_at": payment.updated_at.isoformat()
+                    }
+                }, 200
+
+            # Wake early if this worker is processing the payment; otherwise poll
+            poll = min(remaining, PAYMENT_POLL_INTERVAL)
+            done = _payment_events.get(payment_id)
+            if done is not None:
+                try:
+                    await asyncio.wait_for(done.wait(), poll)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(poll)
+
+    except Exception as e:
+        return {"error": f"Server error: {str(e)}"}, 500
+
+
+# (method, Flask-style rule, handler)
+ROUTES = [
+    ('POST', '/sign_up', sign_up),
+    ('POST', '/create_wallet', create_wallet),
+    ('POST', '/send_payment', send_payment),
+    ('GET', '/payment/<payment_id>', get_payment),
+]
+
+_compiled_routes = [
+    (method, re.compile('^' + re.sub(r'<(\w+)>', r'(?P<\1>[^/]+)', rule) + '$'), rule, handler)
+    for method, rule, handler in ROUTES
+]
+
+# Handlers that honor the Idempotency-Key header, as their Flask views do
+IDEMPOTENT_HANDLERS = {sign_up, create_wallet, send_payment}
+
+
+def _match(method, path):
+    for route_method, pattern, rule, handler in _compiled_routes:
+        if route_method == method:
+            match = pattern.match(path)
+            if match:
+                return handler, rule, match.groupdict()
+    return None, None, None
+
+
+# --- ASGI plumbing ---
+
+def _build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope, used by flask.Request and the Flask fallback"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f"HTTP_{name}"
+        value = raw_value.decode('latin-1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _read_body(scope, receive, limit=MAX_CONTENT_LENGTH):
+    """Collect the request body; None if it is, or declares to be, larger than limit"""
+    for name, value in scope.get('headers', []):
+        if name.lower() == b'content-length':
+            try:
+                if int(value) > limit:
+                    return None
+            except ValueError:
+                pass
+
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+def _encode_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+async def _call_flask(environ, send):
+    """
+    Serve a request with the Flask app on the WSGI thread pool
+
+    The whole request, including iterating the response, runs on one thread
+    (Flask contexts are thread-bound); chunks are handed to the event loop
+    through a small queue, so streamed responses stay streamed.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=ASGI_STREAM_BUFFER)
+    response_start = {}
+    abandoned = threading.Event()
+    done = object()
+
+    def put(item):
+        if abandoned.is_set():
+            raise ConnectionAbortedError("client went away")
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def start_response(status, headers, exc_info=None):
+        response_start['status'] = int(status.split(' ', 1)[0])
+        response_start['headers'] = headers
+        return put
+
+    def run():
+        try:
+            iterable = flask_app(environ, start_response)
+            try:
+                for chunk in iterable:
+                    if chunk:
+                        put(chunk)
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+        except ConnectionAbortedError:
+            return
+        except Exception as e:
+            print(f"[ASGI] Flask fallback error: {e}")
+        finally:
+            if not abandoned.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put(done), loop).result()
+
+    worker = loop.run_in_executor(_wsgi_executor, run)
+    started = False
+    try:
+        while True:
+            item = await queue.get()
+            if not started:
+                status = response_start.get('status', 500)
+                headers = _encode_headers(response_start.get('headers', []))
+                await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+                started = True
+            if item is done:
+                break
+            await send({'type': 'http.response.body', 'body': item, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        abandoned.set()
+        while not queue.empty():
+            queue.get_nowait()
+        await worker
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await startup()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def _render(data, status, headers=None):
+    # Flask's own JSON provider keeps the bytes identical to the WSGI app
+    response = flask_app.json.response(data)
+    response.status_code = status
+    for name, value in (headers or {}).items():
+        response.headers[name] = value
+    return response
+
+
+async def _run_handler(handler, request, params):
+    return _render(*await handler(request, **params))
+
+
+async def _run_idempotent(handler, request, params):
+    """Async counterpart of idempotency.idempotent; store calls run on worker threads"""
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if len(key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+        return _render({"error": f"Idempotency-Key must be at most {IDEMPOTENCY_MAX_KEY_LENGTH} characters"}, 400)
+
+    endpoint = handler.__name__  # same as the Flask endpoint name
+    fingerprint = request_fingerprint(request.method, request.path, request.get_data())
+    outcome, record = await asyncio.to_thread(idempotency_store.claim, key, endpoint, fingerprint)
+    for delay in poll_delays():
+        if outcome != IN_PROGRESS:
+            break
+        await asyncio.sleep(delay)
+        outcome, record = await asyncio.to_thread(idempotency_store.claim, key, endpoint, fingerprint)
+
+    if outcome == REPLAY:
+        return replay_response(record)
+    error = key_error(outcome)
+    if error:
+        return _render(*error, {'Retry-After': '1'} if outcome == IN_PROGRESS else None)
+
+    try:
+        response = await _run_handler(handler, request, params)
+    except BaseException:
+        # Includes cancellation when the client disconnects
+        if not upstream_called(request):
+            await asyncio.shield(asyncio.to_thread(idempotency_store.release, key, endpoint))
+        raise
+    await asyncio.to_thread(
+        idempotency_store.finish, key, endpoint, response.status_code,
+        response.get_data(as_text=True), stored_headers(response), upstream_called(request)
+    )
+    return response
+
+
+async def application(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    body = await _read_body(scope, receive)
+    if body is None:
+        response = _render({"error": f"Request body exceeds {MAX_CONTENT_LENGTH} bytes"}, 413)
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': _encode_headers(response.headers.items())
+        })
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+        return
+
+    environ = _build_environ(scope, body)
+    handler, rule, params = _match(scope['method'], scope['path'])
+    if handler is None:
+        await _call_flask(environ, send)
+        return
+
+    await startup()  # no-op after the first call; covers servers without lifespan events
+    set_route(rule)
+    started = time.perf_counter()
+    request = Request(environ)
+    if handler in IDEMPOTENT_HANDLERS and request.headers.get(IDEMPOTENCY_HEADER):
+        response = await _run_idempotent(handler, request, params)
+    else:
+        response = await _run_handler(handler, request, params)
+
+    observe_request(scope['method'], rule, response.status_code, time.perf_counter() - started)
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': _encode_headers(response.headers.items())
+    })
+    await send({'type': 'http.response.body', 'body': response.get_data()})
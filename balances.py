@@ -0,0 +1,201 @@
+import zlib
+from datetime import datetime
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from models import BalanceTotal, Wallet, LedgerEntry
+
+# --- Atomic wallet balance changes ---
+# Balances are changed with a single conditional UPDATE instead of
+# read-modify-write in Python, so concurrent payments from one wallet can
+# never overdraw it and no application-level lock is needed. Every change
+# also appends to ledger_entries in the same transaction; Wallet.balance is
+# the materialized result, so balance reads stay a single-row lookup.
+#
+# balance_totals keeps the sum of all balances per wallet status in the same
+# transactions, so the dashboard's total is a handful of rows instead of a
+# scan of wallets. A wallet's changes go to one of BALANCE_TOTAL_SHARDS rows,
+# which keeps concurrent payments of different wallets off a single hot row;
+# which shard holds an amount does not matter for the total. Code that
+# changes Wallet.status outside this module must move the balance between
+# statuses, or run python payment_stats.py rebuild afterwards.
+BALANCE_TOTAL_SHARDS = 16
+
+
+def debit(session, wallet_id, amount, payment_id=None):
+    """
+    Subtract amount from the wallet if its balance covers it
+
+    Runs inside the caller's transaction; the caller commits.
+
+    Args:
+        session: Database session
+        wallet_id (str): Wallet to debit
+        amount (float): Amount to subtract
+        payment_id (str): Payment the debit belongs to, if any
+
+    Returns:
+        bool: True if the wallet was debited, False if funds were insufficient
+    """
+    return debit_many(session, wallet_id, [(payment_id, amount)])
+
+
+def debit_many(session, wallet_id, entries):
+    """
+    Debit the total of several payments with one conditional UPDATE
+
+    Args:
+        session: Database session
+        wallet_id (str): Wallet to debit
+        entries (list): (payment_id, amount) pairs, one ledger entry each
+
+    Returns:
+        bool: True if the wallet was debited, False if funds were insufficient
+    """
+    total = sum(amount for _, amount in entries)
+    row = session.execute(
+        update(Wallet)
+        .where(Wallet.wallet_id == wallet_id, Wallet.balance >= total)
+        .values(balance=Wallet.balance - total, last_activity_at=datetime.utcnow())
+        .returning(Wallet.balance, Wallet.status)
+        .execution_options(synchronize_session=False)
+    ).first()
+
+    if row is None:
+        return False
+
+    _append_entries(session, wallet_id, 'debit', entries, row.balance + total, -1)
+    _add_to_total(session, wallet_id, row.status, -total)
+    return True
+
+
+def credit(session, wallet_id, amount, payment_id=None):
+    """
+    Add amount to the wallet, e.g. to release a reservation after a failed transfer
+
+    Runs inside the caller's transaction; the caller commits.
+    """
+    credit_many(session, wallet_id, [(payment_id, amount)])
+
+
+def credit_many(session, wallet_id, entries):
+    """Credit the total of several payments with one UPDATE"""
+    total = sum(amount for _, amount in entries)
+    row = session.execute(
+        update(Wallet)
+        .where(Wallet.wallet_id == wallet_id)
+        .values(balance=Wallet.balance + total, last_activity_at=datetime.utcnow())
+        .returning(Wallet.balance, Wallet.status)
+        .execution_options(synchronize_session=False)
+    ).first()
+
+    if row is not None:
+        _append_entries(session, wallet_id, 'credit', entries, row.balance - total, 1)
+        _add_to_total(session, wallet_id, row.status, total)
+
+
+def adjust(session, wallet_id, amount):
+    """
+    Correct the balance by amount after comparing it with Circle
+
+    Unlike credit and debit this is not wallet activity and never fails for
+    insufficient funds, since it records money that already moved on chain.
+    Runs inside the caller's transaction; the caller commits.
+
+    Returns:
+        float: The new balance, or None if the wallet does not exist
+    """
+    row = session.execute(
+        update(Wallet)
+        .where(Wallet.wallet_id == wallet_id)
+        .values(balance=Wallet.balance + amount)
+        .returning(Wallet.balance, Wallet.status)
+        .execution_options(synchronize_session=False)
+    ).first()
+
+    if row is None:
+        return None
+    _append_entries(session, wallet_id, 'adjustment', [(None, abs(amount))], row.balance - amount, 1 if amount > 0 else -1)
+    _add_to_total(session, wallet_id, row.status, amount)
+    return row.balance
+
+
+def open_wallet(session, wallet_id, balance=0.0):
+    """
+    Record a new wallet's starting balance as its 'opening' ledger entry
+
+    Call it in the transaction that inserts the wallet, so the ledger of
+    every wallet sums to Wallet.balance. Works with sync and async sessions.
+    New wallets start at 0, so balance_totals is not touched; fund a wallet
+    with credit() instead of inserting it with a balance.
+    """
+    session.add(LedgerEntry(**opening_entry(wallet_id, balance)))
+
+
+def opening_entry(wallet_id, balance=0.0):
+    """Row of a wallet's 'opening' ledger entry, for bulk inserts"""
+    return {
+        "wallet_id": wallet_id,
+        "payment_id": None,
+        "entry_type": 'opening',
+        "amount": balance,
+        "balance_after": balance
+    }
+
+
+def total_balance(session, status='active'):
+    """Sum of the balances of all wallets with this status, from balance_totals"""
+    return session.execute(
+        select(func.coalesce(func.sum(BalanceTotal.balance_total), 0)).where(BalanceTotal.status == status)
+    ).scalar()
+
+
+def rebuild_totals(session):
+    """Recompute balance_totals from wallets; runs inside the caller's transaction"""
+    session.execute(delete(BalanceTotal))
+    session.execute(
+        insert(BalanceTotal).from_select(
+            ['status', 'shard', 'balance_total'],
+            select(Wallet.status, 0, func.coalesce(func.sum(Wallet.balance), 0))
+            .where(Wallet.status.isnot(None))
+            .group_by(Wallet.status)
+        )
+    )
+
+
+def _add_to_total(session, wallet_id, status, amount):
+    if not amount or status is None:
+        return
+    shard = zlib.crc32(wallet_id.encode()) % BALANCE_TOTAL_SHARDS
+    increment = (
+        update(BalanceTotal)
+        .where(BalanceTotal.status == status, BalanceTotal.shard == shard)
+        .values(balance_total=BalanceTotal.balance_total + amount)
+        .execution_options(synchronize_session=False)
+    )
+    if session.execute(increment).rowcount:
+        return
+    try:
+        with session.begin_nested():
+            session.execute(insert(BalanceTotal).values(status=status, shard=shard, balance_total=amount))
+    except IntegrityError:
+        # Another transaction created the shard first
+        session.execute(increment)
+
+
+def _append_entries(session, wallet_id, entry_type, entries, balance_before, sign):
+    """Append one ledger entry per (payment_id, amount) with a running balance"""
+    balance = balance_before
+    for payment_id, amount in entries:
+        balance += sign * amount
+        session.add(LedgerEntry(
+            wallet_id=wallet_id,
+            payment_id=payment_id,
+            entry_type=entry_type,
+            amount=sign * amount,
+            balance_after=balance
+        ))
+
+
+def current_balance(session, wallet_id):
+    """Read the committed balance straight from the database"""
+    return session.query(Wallet.balance).filter_by(wallet_id=wallet_id).scalar()
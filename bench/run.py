@@ -0,0 +1,393 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.stub_server import StubConfig, start_stub_server  # noqa: E402
+
+# --- Load-test harness ---
+# Seeds a throwaway database, points the app at the local Circle/AIML stub,
+# serves the real Flask app on a threaded WSGI server and drives it with a
+# weighted request mix. Results are printed and saved as JSON per commit.
+#
+#   python bench/run.py --users 2000 --requests 5000 --concurrency 32
+#   python bench/run.py --baseline bench/results/<previous>.json
+
+DEFAULT_MIX = {
+    'sign_up': 5,
+    'create_wallet': 5,
+    'send_payment': 30,
+    'get_transactions': 30,
+    'get_profile': 30,
+    'chat': 0,
+}
+
+
+def parse_mix(text):
+    """Parse "send_payment=50,get_profile=50" into weights, keeping unlisted defaults"""
+    mix = dict(DEFAULT_MIX)
+    if text:
+        for part in text.split(','):
+            name, _, weight = part.partition('=')
+            if name.strip() not in DEFAULT_MIX:
+                raise SystemExit(f"Unknown endpoint in --mix: {name}")
+            mix[name.strip()] = float(weight)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def seed_database(users, payments_per_user, without_wallet_ratio, rng):
+    """
+    Fill the app database with profiles, wallets, ledger openings and payments
+
+    Returns:
+        tuple: (emails with a wallet, emails without one)
+    """
+    from sqlalchemy import insert
+    from sqlalchemy.orm import sessionmaker
+    from models import Dashboard, LedgerEntry, Profile, Wallet, engine, PAYMENT_STATUSES, TRANSACTION_TYPES
+
+    now = datetime.utcnow()
+    profiles, wallets, ledger, payments = [], [], [], []
+    with_wallet, without_wallet = [], []
+
+    for i in range(users):
+        email = f"bench-{i}@example.com"
+        profiles.append({
+            "full_name": f"Bench User {i}",
+            "email_address": email,
+            "wallet_address": f"0x{i:040x}",
+            "notifications": ['Yes'],
+            "language": ['English'],
+            "disconnect": ['Yes']
+        })
+        if rng.random() < without_wallet_ratio:
+            without_wallet.append(email)
+            continue
+
+        with_wallet.append(email)
+        wallet_id = f"bench-wallet-{i}"
+        balance = 1_000_000_000.0
+        wallets.append({
+            "wallet_id": wallet_id,
+            "user_email": email,
+            "wallet_address": f"0x{i:040x}",
+            "balance": balance,
+            "blockchains": ['ARC-TESTNET'],
+            "transaction_types": list(TRANSACTION_TYPES),
+            "status": 'active'
+        })
+        ledger.append({
+            "wallet_id": wallet_id,
+            "entry_type": 'opening',
+            "amount": balance,
+            "balance_after": balance,
+            "created_at": now - timedelta(days=91)
+        })
+        for _ in range(payments_per_user):
+            status = rng.choice(PAYMENT_STATUSES)
+            payments.append({
+                "payment_id": f"{rng.getrandbits(128):032x}",
+                "recipient_address": f"0x{rng.getrandbits(160):040x}",
+                "sender_email": email,
+                "sender_wallet_id": wallet_id,
+                "amount": rng.randint(1, 500),
+                "note": "seeded",
+                "status": status,
+                "transaction_status": status,
+                "type": rng.choice(TRANSACTION_TYPES),
+                "created_at": now - timedelta(seconds=rng.randint(0, 90 * 86400))
+            })
+
+    session = sessionmaker(bind=engine)()
+    try:
+        for model, rows in ((Profile, profiles), (Wallet, wallets), (LedgerEntry, ledger), (Dashboard, payments)):
+            for start in range(0, len(rows), 5000):
+                session.execute(insert(model), rows[start:start + 5000])
+        session.commit()
+    finally:
+        session.close()
+    return with_wallet, without_wallet
+
+
+class Workload:
+    """Request generators for each endpoint in the mix"""
+
+    def __init__(self, base_url, with_wallet, without_wallet):
+        self.base_url = base_url
+        self.with_wallet = with_wallet
+        self.without_wallet = without_wallet
+        self._signups = 0
+        self._lock = threading.Lock()
+
+    def _next_signup(self):
+        with self._lock:
+            self._signups += 1
+            return self._signups
+
+    def _pop_without_wallet(self):
+        with self._lock:
+            return self.without_wallet.pop() if self.without_wallet else None
+
+    def sign_up(self, http, rng):
+        n = self._next_signup()
+        email = f"bench-new-{n}@example.com"
+        response = http.post(f"{self.base_url}/sign_up", json={
+            "full_name": f"Bench New {n}",
+            "email_address": email,
+            "wallet_address": f"0x{n:040x}"
+        })
+        if response.status_code == 201:
+            with self._lock:
+                self.without_wallet.append(email)
+        return response
+
+    def create_wallet(self, http, rng):
+        email = self._pop_without_wallet()
+        if email is None:
+            # Nobody left without a wallet: measure the duplicate path instead
+            email = rng.choice(self.with_wallet)
+        response = http.post(f"{self.base_url}/create_wallet", json={"user_email": email})
+        return response
+
+    def send_payment(self, http, rng):
+        return http.post(f"{self.base_url}/send_payment", json={
+            "sender_email": rng.choice(self.with_wallet),
+            "recipient_address": f"0x{rng.getrandbits(160):040x}",
+            "amount": rng.randint(1, 100),
+            "note": "bench",
+            "type": "transfer"
+        })
+
+    def get_transactions(self, http, rng):
+        params = {"user_email": rng.choice(self.with_wallet), "limit": 50}
+        if rng.random() < 0.5:
+            params["status"] = rng.choice(['completed', 'pending', 'failed'])
+        return http.get(f"{self.base_url}/transactions", params=params)
+
+    def get_profile(self, http, rng):
+        return http.get(f"{self.base_url}/profile/{rng.choice(self.with_wallet)}")
+
+    def chat(self, http, rng):
+        return http.post(f"{self.base_url}/api/chat", json={
+            "message": rng.choice([
+                "How do I send USDC on Arc?",
+                "What fees apply to a transfer?",
+                f"Explain payment {rng.randint(1, 1000)}"
+            ])
+        })
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    """Per-endpoint throughput, status counts and latency percentiles in ms"""
+    by_endpoint = {}
+    for name, status, latency in samples:
+        by_endpoint.setdefault(name, []).append((status, latency))
+
+    endpoints = {}
+    for name, results in sorted(by_endpoint.items()):
+        latencies = sorted(latency * 1000 for _, latency in results)
+        statuses = {}
+        for status, _ in results:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        endpoints[name] = {
+            "count": len(results),
+            "errors": sum(1 for status, _ in results if status == 'error' or status >= 500),
+            "statuses": statuses,
+            "throughput_rps": round(len(results) / elapsed, 2),
+            "mean_ms": round(sum(latencies) / len(latencies), 3),
+            "p50_ms": round(percentile(latencies, 0.50), 3),
+            "p95_ms": round(percentile(latencies, 0.95), 3),
+            "p99_ms": round(percentile(latencies, 0.99), 3),
+            "max_ms": round(latencies[-1], 3)
+        }
+
+    all_latencies = sorted(latency * 1000 for _, _, latency in samples)
+    overall = {
+        "count": len(samples),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(all_latencies, 0.50), 3) if samples else None,
+        "p95_ms": round(percentile(all_latencies, 0.95), 3) if samples else None,
+        "p99_ms": round(percentile(all_latencies, 0.99), 3) if samples else None
+    }
+    return overall, endpoints
+
+
+def run_load(workload, mix, total_requests, duration, concurrency, warmup, seed):
+    """Drive the app from `concurrency` threads and collect (endpoint, status, seconds)"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = []
+    lock = threading.Lock()
+    issued = [0]
+    deadline = [None]
+
+    def take_ticket():
+        with lock:
+            if duration is None and issued[0] >= total_requests + warmup:
+                return None
+            if duration is not None and deadline[0] is not None and time.perf_counter() >= deadline[0]:
+                return None
+            issued[0] += 1
+            return issued[0]
+
+    def worker(worker_id):
+        rng = random.Random(seed * 1000 + worker_id)
+        http = requests.Session()
+        local = []
+        while True:
+            ticket = take_ticket()
+            if ticket is None:
+                break
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                status = getattr(workload, name)(http, rng).status_code
+            except requests.exceptions.RequestException:
+                status = 'error'
+            if ticket > warmup:
+                local.append((name, status, time.perf_counter() - started))
+        with lock:
+            samples.extend(local)
+
+    started = time.perf_counter()
+    if duration is not None:
+        deadline[0] = started + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    return samples, time.perf_counter() - started
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+def print_report(overall, endpoints, baseline=None):
+    header = f"{'endpoint':<18}{'count':>7}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    if baseline:
+        header += f"{'p95 vs base':>13}"
+    print(header)
+    for name, stats in endpoints.items():
+        line = (f"{name:<18}{stats['count']:>7}{stats['errors']:>6}{stats['throughput_rps']:>9.1f}"
+                f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}")
+        base = (baseline or {}).get('endpoints', {}).get(name)
+        if base and base.get('p95_ms'):
+            line += f"{(stats['p95_ms'] / base['p95_ms'] - 1) * 100:>+12.1f}%"
+        print(line)
+    print(f"{'total':<18}{overall['count']:>7}{'':>6}{overall['throughput_rps']:>9.1f}"
+          f"{overall['p50_ms']:>9.1f}{overall['p95_ms']:>9.1f}{overall['p99_ms']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PayMind API load test")
+    parser.add_argument('--users', type=int, default=1000, help="seeded profiles")
+    parser.add_argument('--payments-per-user', type=int, default=20)
+    parser.add_argument('--without-wallet', type=float, default=0.1,
+                        help="fraction of seeded users left for create_wallet")
+    parser.add_argument('--requests', type=int, default=2000, help="measured requests")
+    parser.add_argument('--duration', type=float, help="run for N seconds instead of --requests")
+    parser.add_argument('--warmup', type=int, default=100, help="unmeasured requests first")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--mix', help="endpoint weights, e.g. send_payment=50,get_profile=50,chat=5")
+    parser.add_argument('--circle-latency', type=float, default=0.05, help="seconds")
+    parser.add_argument('--ai-latency', type=float, default=0.5, help="seconds")
+    parser.add_argument('--circle-error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db', help="SQLAlchemy URL (default: a fresh SQLite file in a temp dir)")
+    parser.add_argument('--output', help="result file (default: bench/results/<time>_<commit>.json)")
+    parser.add_argument('--baseline', help="earlier result file to compare p95 against")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    stub_config = StubConfig(args.circle_latency, args.ai_latency, error_rate=args.circle_error_rate)
+    stub, stub_url = start_stub_server(stub_config)
+
+    # The app reads its configuration at import time
+    os.environ['DATABASE_URL'] = args.db or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='paymind-bench-'), 'bench.db')}"
+    os.environ['CIRCLE_API_URL'] = stub_url
+    os.environ['CircleAPI_KEY'] = 'bench'
+    os.environ['AIMLAPI_BASE_URL'] = stub_url
+    os.environ['AIMLAPI_API_KEY'] = 'bench'
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from app import app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    with_wallet, without_wallet = seed_database(args.users, args.payments_per_user, args.without_wallet, rng)
+    print(f"[Bench] Seeded {args.users} users and {len(with_wallet) * args.payments_per_user} payments "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    workload = Workload(base_url, with_wallet, without_wallet)
+    samples, elapsed = run_load(workload, mix, args.requests, args.duration, args.concurrency,
+                                args.warmup, args.seed)
+    server.shutdown()
+    stub.shutdown()
+
+    overall, endpoints = summarize(samples, elapsed)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(overall, endpoints, baseline)
+
+    revision = git_revision()
+    result = {
+        "meta": {
+            "commit": revision,
+            "timestamp": datetime.utcnow().isoformat() + 'Z',
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+            "mix": mix,
+            "upstream_calls": stub_config.calls
+        },
+        "overall": overall,
+        "endpoints": endpoints
+    }
+    output = args.output or os.path.join(
+        ROOT, 'bench', 'results', f"{datetime.utcnow():%Y%m%dT%H%M%S}_{revision}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"[Bench] Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Local stand-in for the Circle and AIML APIs ---
+# Answers every Circle endpoint the app calls and the OpenAI-compatible
+# /chat/completions endpoint with canned JSON after a configurable delay, so
+# benchmarks measure the app rather than the network.
+
+
+class StubConfig:
+    def __init__(self, circle_latency=0.05, ai_latency=0.5, jitter=0.2, error_rate=0.0):
+        self.circle_latency = circle_latency  # seconds
+        self.ai_latency = ai_latency  # seconds
+        self.jitter = jitter  # +/- fraction of the latency
+        self.error_rate = error_rate  # fraction of Circle calls answered with 503
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def count(self, path):
+        with self._lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+
+    def delay(self, latency):
+        if latency > 0:
+            time.sleep(latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+def _make_handler(config):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            config.count(self.path)
+
+            if self.path.endswith('/chat/completions'):
+                config.delay(config.ai_latency)
+                last = body.get('messages', [{}])[-1].get('content', '')
+                self._send(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get('model', 'stub'),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": f"Stub reply to: {last[:80]}"},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20}
+                })
+                return
+
+            config.delay(config.circle_latency)
+            if config.error_rate and random.random() < config.error_rate:
+                self._send(503, {"code": 503, "message": "Stub outage"})
+                return
+            self._send(201, {"data": {
+                "id": str(uuid.uuid4()),
+                "address": f"0x{uuid.uuid4().hex}",
+                "status": "pending",
+                "idempotencyKey": body.get('idempotencyKey')
+            }})
+
+        def _send(self, status, payload):
+            out = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+
+def start_stub_server(config, host='127.0.0.1', port=0):
+    """
+    Serve the stub APIs on a background thread
+
+    Returns:
+        tuple: (server, base_url) - call server.shutdown() to stop it
+    """
+    server = ThreadingHTTPServer((host, port), _make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='bench-stub', daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local Circle/AIML stand-in")
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--circle-latency', type=float, default=0.05)
+    parser.add_argument('--ai-latency', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    stub_config = StubConfig(args.circle_latency, args.ai_latency, error_rate=args.error_rate)
+    stub, url = start_stub_server(stub_config, port=args.port)
+    print(f"[Stub] Circle: CIRCLE_API_URL={url}  AIML: AIMLAPI_BASE_URL={url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.shutdown()
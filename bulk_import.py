@@ -0,0 +1,439 @@
+import argparse
+import csv
+import io
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from balances import opening_entry
+from models import LedgerEntry, Profile, Wallet
+
+# --- Bulk profile and wallet import ---
+# Records are handled IMPORT_BATCH_SIZE at a time: one set-based query finds
+# existing profiles and wallets for the whole batch, Circle is called for the
+# new ones with at most IMPORT_CONCURRENCY requests in flight, and the batch is
+# inserted in one transaction. After every committed batch a checkpoint records
+# how far the input has been consumed, so a failed run resumes from there.
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '200'))
+IMPORT_CONCURRENCY = int(os.getenv('IMPORT_CONCURRENCY', '8'))
+IMPORT_MAX_REPORTED_FAILURES = 100
+
+REQUIRED_FIELDS = ['full_name', 'email_address', 'wallet_address']
+LIST_FIELDS = ['notifications', 'language', 'blockchains']  # ";"-separated in CSV
+DEFAULT_BLOCKCHAINS = ['ARC-TESTNET']
+
+# Wallet idempotency keys are derived from the email, so re-running an import
+# after a crash never creates a second Circle wallet for the same user
+_WALLET_KEY_NAMESPACE = uuid.UUID('6f1c1d8e-3f0a-4b53-9d1e-5a7c2b9e4d10')
+
+
+def read_records(stream, fmt):
+    """
+    Parse profiles from a CSV or JSONL text stream
+
+    Args:
+        stream: Text stream
+        fmt (str): "csv" or "jsonl"
+
+    Yields:
+        tuple: (record number starting at 1, dict or None, parse error or None)
+    """
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(stream), start=1):
+            record = {key.strip(): (value or '').strip() for key, value in row.items() if key}
+            for field in LIST_FIELDS:
+                if record.get(field):
+                    record[field] = [item.strip() for item in record[field].split(';') if item.strip()]
+                else:
+                    record.pop(field, None)
+            yield number, record, None
+        return
+
+    number = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield number, None, "Each line must be a JSON object"
+            continue
+        yield number, record, None
+
+
+def load_checkpoint(path):
+    """Return the saved checkpoint dict, or None when starting fresh"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, state):
+    """Write the checkpoint atomically so a crash never leaves it half-written"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+class BulkImporter:
+    """
+    Create profiles and wallets in bulk
+
+    Args:
+        session_factory: sessionmaker bound to the app's engine
+        register_wallet (callable): register_circle_wallet(email, wallet_address) -> result dict
+        create_wallet (callable): create_circle_wallet(user_email, blockchains, idempotency_key) -> result dict
+    """
+
+    def __init__(self, session_factory, register_wallet, create_wallet,
+                 batch_size=IMPORT_BATCH_SIZE, concurrency=IMPORT_CONCURRENCY):
+        self.session_factory = session_factory
+        self.register_wallet = register_wallet
+        self.create_wallet = create_wallet
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+
+    def run(self, records, create_wallets=True, checkpoint_path=None):
+        """
+        Import records produced by read_records
+
+        Args:
+            records: Iterable of (number, record, error)
+            create_wallets (bool): Also create a Circle wallet for users without one
+            checkpoint_path (str): File used to resume an interrupted import
+
+        Returns:
+            dict: Counts, the first IMPORT_MAX_REPORTED_FAILURES failures and the resume point
+        """
+        checkpoint = load_checkpoint(checkpoint_path) or {}
+        resume_after = checkpoint.get('processed', 0)
+        summary = {
+            "processed": resume_after,
+            "created_profiles": checkpoint.get('created_profiles', 0),
+            "created_wallets": checkpoint.get('created_wallets', 0),
+            "skipped": checkpoint.get('skipped', 0),
+            "failed_count": checkpoint.get('failed_count', 0),
+            "failed": [],
+            "resumed_from": resume_after
+        }
+        seen_names, seen_emails = set(), set()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            batch = []
+            for number, record, error in records:
+                if number <= resume_after:
+                    continue
+                batch.append((number, record, error))
+                if len(batch) >= self.batch_size:
+                    self._run_batch(batch, create_wallets, executor, seen_names, seen_emails, summary)
+                    self._checkpoint(checkpoint_path, summary, batch[-1][0])
+                    batch = []
+            if batch:
+                self._run_batch(batch, create_wallets, executor, seen_names, seen_emails, summary)
+                self._checkpoint(checkpoint_path, summary, batch[-1][0])
+
+        # Finished: the next run of the same file starts from the beginning again
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        return summary
+
+    def _checkpoint(self, path, summary, last_number):
+        summary["processed"] = last_number
+        if path:
+            save_checkpoint(path, {key: summary[key] for key in (
+                "processed", "created_profiles", "created_wallets", "skipped", "failed_count"
+            )})
+
+    def _fail(self, summary, number, record, error):
+        summary["failed_count"] += 1
+        if len(summary["failed"]) < IMPORT_MAX_REPORTED_FAILURES:
+            summary["failed"].append({
+                "record": number,
+                "email_address": (record or {}).get('email_address'),
+                "error": error
+            })
+
+    def _run_batch(self, batch, create_wallets, executor, seen_names, seen_emails, summary):
+        # Validate and drop duplicates within the input
+        candidates = []
+        for number, record, error in batch:
+            if error:
+                self._fail(summary, number, record, error)
+                continue
+            missing = [field for field in REQUIRED_FIELDS if not record.get(field)]
+            if missing:
+                self._fail(summary, number, record, f"Missing field: {missing[0]}")
+                continue
+            if record['full_name'] in seen_names or record['email_address'] in seen_emails:
+                self._fail(summary, number, record, "Duplicate of an earlier record in this import")
+                continue
+            seen_names.add(record['full_name'])
+            seen_emails.add(record['email_address'])
+            candidates.append((number, record))
+
+        if not candidates:
+            return
+
+        # One query each for the existing profiles and wallets of the whole batch
+        names = [record['full_name'] for _, record in candidates]
+        emails = [record['email_address'] for _, record in candidates]
+        session = self.session_factory()
+        try:
+            existing = session.execute(
+                select(Profile.full_name, Profile.email_address).where(
+                    or_(Profile.full_name.in_(names), Profile.email_address.in_(emails))
+                )
+            ).all()
+            with_wallet = set(session.execute(
+                select(Wallet.user_email).where(Wallet.user_email.in_(emails))
+            ).scalars())
+        finally:
+            session.close()
+        profile_by_email = {email: name for name, email in existing}
+        taken_names = {name for name, _ in existing}
+
+        work = []  # (number, record, needs_profile, needs_wallet)
+        for number, record in candidates:
+            email = record['email_address']
+            if email in profile_by_email:
+                if profile_by_email[email] != record['full_name']:
+                    self._fail(summary, number, record, "This email address is already registered")
+                    continue
+                needs_profile = False
+            elif record['full_name'] in taken_names:
+                self._fail(summary, number, record, "User with this name already exists")
+                continue
+            else:
+                needs_profile = True
+            needs_wallet = create_wallets and email not in with_wallet
+            if not needs_profile and not needs_wallet:
+                summary["skipped"] += 1
+                continue
+            work.append((number, record, needs_profile, needs_wallet))
+
+        # Circle calls, at most `concurrency` in flight
+        results = list(executor.map(lambda item: self._call_circle(*item), work))
+
+        profiles, wallets = [], []
+        for (number, record, needs_profile, needs_wallet), (error, wallet_data) in zip(work, results):
+            if error:
+                self._fail(summary, number, record, error)
+                continue
+            if needs_profile:
+                profiles.append({
+                    "full_name": record['full_name'],
+                    "email_address": record['email_address'],
+                    "wallet_address": record['wallet_address'],
+                    "notifications": record.get('notifications', ['Yes', 'No']),
+                    "language": record.get('language', ['English', 'French', 'German']),
+                    "disconnect": ['Yes']
+                })
+            if needs_wallet:
+                wallets.append({
+                    "wallet_id": wallet_data.get('id', str(uuid.uuid4())),
+                    "user_email": record['email_address'],
+                    "wallet_address": wallet_data.get('address', record['wallet_address']),
+                    "balance": 0.0,
+                    "blockchains": record.get('blockchains', DEFAULT_BLOCKCHAINS),
+                    "transaction_types": ['rent', 'purchase', 'deposit', 'insurance', 'transfer'],
+                    "status": 'active'
+                })
+
+        self._insert(profiles, wallets, summary)
+
+    def _call_circle(self, number, record, needs_profile, needs_wallet):
+        """Returns (error or None, wallet data)"""
+        if needs_profile:
+            registered = self.register_wallet(record['email_address'], record['wallet_address'])
+            if not registered.get('success'):
+                return f"Circle API registration error: {registered.get('error')}", None
+        wallet_data = {}
+        if needs_wallet:
+            key = str(uuid.uuid5(_WALLET_KEY_NAMESPACE, record['email_address']))
+            created = self.create_wallet(
+                record['email_address'], record.get('blockchains', DEFAULT_BLOCKCHAINS), key
+            )
+            if not created.get('success'):
+                return f"Failed to create wallet in Circle API: {created.get('error')}", None
+            wallet_data = created.get('data') or {}
+        return None, wallet_data
+
+    def _insert(self, profiles, wallets, summary):
+        """Insert the batch in one transaction, falling back to row by row if another writer got there first"""
+        session = self.session_factory()
+        try:
+            try:
+                if profiles:
+                    session.execute(insert(Profile), profiles)
+                if wallets:
+                    session.execute(insert(Wallet), wallets)
+                    session.execute(insert(LedgerEntry), [opening_entry(w["wallet_id"], w["balance"]) for w in wallets])
+                session.commit()
+                summary["created_profiles"] += len(profiles)
+                summary["created_wallets"] += len(wallets)
+                return
+            except IntegrityError:
+                session.rollback()
+
+            for model, rows, counter in ((Profile, profiles, "created_profiles"), (Wallet, wallets, "created_wallets")):
+                for row in rows:
+                    try:
+                        with session.begin_nested():
+                            session.execute(insert(model), [row])
+                            if model is Wallet:
+                                session.execute(insert(LedgerEntry), [opening_entry(row["wallet_id"], row["balance"])])
+                        summary[counter] += 1
+                    except IntegrityError:
+                        summary["skipped"] += 1
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+# --- Background import jobs ---
+# /import/profiles spools the upload next to the checkpoint and runs it on a
+# job pool. The job's state is kept in a JSON status file beside them, so any
+# worker process on the host can report it.
+JOB_ACTIVE_STATES = ('queued', 'running')
+
+
+def job_paths(directory, job_id):
+    """(upload, checkpoint, status) file paths of a job"""
+    base = os.path.join(directory, job_id)
+    return f"{base}.upload", f"{base}.json", f"{base}.status.json"
+
+
+def spool_upload(stream, path, max_bytes, chunk_size=64 * 1024):
+    """
+    Copy an uploaded file to disk, giving up once it exceeds max_bytes
+
+    Returns:
+        bool: True if the whole upload was written, False if it was too large (nothing is kept)
+    """
+    written = 0
+    with open(path, 'wb') as f:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                return True
+            written += len(chunk)
+            if written > max_bytes:
+                break
+            f.write(chunk)
+    os.remove(path)
+    return False
+
+
+def update_job(status_path, **changes):
+    """Merge changes into a job's status file"""
+    status = load_checkpoint(status_path) or {}
+    status.update(changes, updated_at=datetime.utcnow().isoformat())
+    save_checkpoint(status_path, status)
+    return status
+
+
+def job_status(directory, job_id):
+    """
+    Current state of a job, with progress from its checkpoint while it runs
+
+    Returns:
+        dict: The status file's content, or None for an unknown job
+    """
+    _, checkpoint_path, status_path = job_paths(directory, job_id)
+    status = load_checkpoint(status_path)
+    if status is None:
+        return None
+    if status.get('state') in JOB_ACTIVE_STATES:
+        status["progress"] = load_checkpoint(checkpoint_path) or {"processed": 0}
+    return status
+
+
+def job_active(directory, job_id, stale_after):
+    """True if the job is queued or running and has made progress within stale_after seconds"""
+    _, checkpoint_path, status_path = job_paths(directory, job_id)
+    status = load_checkpoint(status_path)
+    if not status or status.get('state') not in JOB_ACTIVE_STATES:
+        return False
+    # A job whose process died stays 'running'; its files stop changing
+    touched = max(os.path.getmtime(path) for path in (status_path, checkpoint_path) if os.path.exists(path))
+    return time.time() - touched < stale_after
+
+
+def prune_jobs(directory, max_age):
+    """Delete the files of finished jobs whose status has not changed for max_age seconds"""
+    cutoff = time.time() - max_age
+    for entry in os.scandir(directory):
+        if not entry.name.endswith('.status.json'):
+            continue
+        job_id = entry.name[:-len('.status.json')]
+        try:
+            if entry.stat().st_mtime >= cutoff or (load_checkpoint(entry.path) or {}).get('state') in JOB_ACTIVE_STATES:
+                continue
+        except (OSError, ValueError):
+            continue
+        for path in job_paths(directory, job_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def run_job(importer, directory, job_id, fmt, create_wallets=True):
+    """
+    Run a spooled import, recording its outcome in the job's status file
+
+    The upload is deleted once the import completes. After a failure it is
+    kept with the checkpoint, so the job can be started again and resumes.
+    """
+    upload_path, checkpoint_path, status_path = job_paths(directory, job_id)
+    update_job(status_path, state='running', started_at=datetime.utcnow().isoformat())
+    try:
+        with io.open(upload_path, newline='', encoding='utf-8') as stream:
+            summary = importer.run(read_records(stream, fmt), create_wallets, checkpoint_path)
+    except Exception as e:
+        print(f"[Import] Job {job_id} failed: {e}")
+        update_job(status_path, state='failed', error=str(e))
+        return
+    update_job(status_path, state='completed', summary=summary, finished_at=datetime.utcnow().isoformat())
+    os.remove(upload_path)
+
+
+def import_file(path, fmt=None, create_wallets=True, checkpoint_path=None,
+                batch_size=IMPORT_BATCH_SIZE, concurrency=IMPORT_CONCURRENCY):
+    """Import a CSV or JSONL file with the app's database and Circle client"""
+    from app import Session, create_circle_wallet, register_circle_wallet
+
+    fmt = fmt or ('csv' if path.endswith('.csv') else 'jsonl')
+    importer = BulkImporter(Session, register_circle_wallet, create_circle_wallet, batch_size, concurrency)
+    with io.open(path, newline='', encoding='utf-8') as stream:
+        return importer.run(read_records(stream, fmt), create_wallets, checkpoint_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk-import profiles (and wallets) from CSV or JSONL")
+    parser.add_argument('path', help="CSV with a header row, or JSONL with one profile per line")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="default: from the file extension")
+    parser.add_argument('--no-wallets', action='store_true', help="only create profiles")
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument('--concurrency', type=int, default=IMPORT_CONCURRENCY)
+    parser.add_argument('--checkpoint', help="resume file (default: <path>.checkpoint.json)")
+    args = parser.parse_args()
+
+    result = import_file(
+        args.path, args.format, not args.no_wallets,
+        args.checkpoint or f"{args.path}.checkpoint.json", args.batch_size, args.concurrency
+    )
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+try:
+    # Any Redis-protocol server works (Redis, Valkey, KeyDB, Dragonfly)
+    import redis  # type: ignore
+    _HAS_REDIS = True
+except Exception:
+    redis = None  # type: ignore
+    _HAS_REDIS = False
+
+# --- Read-through cache configuration ---
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')  # memory, redis, none
+CACHE_TTL = float(os.getenv('CACHE_TTL', '60'))  # seconds
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '10000'))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+CACHE_GENERATION_TTL = int(os.getenv('CACHE_GENERATION_TTL', '3600'))  # seconds a redis generation token is kept
+GENERATION_STRIPES = 1024
+
+
+class MemoryBackend:
+    """In-process LRU store with per-entry expiry"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._generations = [0] * GENERATION_STRIPES  # bumped by delete, striped by key hash
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def generation(self, key):
+        with self._lock:
+            return self._generations[hash(key) % GENERATION_STRIPES]
+
+    def set(self, key, value, ttl, generation=None):
+        with self._lock:
+            if generation is not None and self._generations[hash(key) % GENERATION_STRIPES] != generation:
+                return False
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._generations[hash(key) % GENERATION_STRIPES] += 1
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Shared store on a Redis-compatible server, visible to every worker process"""
+
+    name = 'redis'
+
+    def __init__(self, url=REDIS_URL, prefix='paymind:'):
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def generation(self, key):
+        # b'' rather than None for a key that was never deleted, since None means unconditional
+        return self._client.get(self.prefix + 'gen:' + key) or b''
+
+    def set(self, key, value, ttl, generation=None):
+        if generation is None:
+            self._client.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+            return True
+
+        # WATCH aborts the write if a delete replaces the token before EXEC
+        generation_key = self.prefix + 'gen:' + key
+        with self._client.pipeline() as pipe:
+            try:
+                pipe.watch(generation_key)
+                if (pipe.get(generation_key) or b'') != generation:
+                    return False
+                pipe.multi()
+                pipe.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    def delete(self, keys):
+        if keys:
+            pipe = self._client.pipeline()
+            for key in keys:
+                pipe.set(self.prefix + 'gen:' + key, uuid.uuid4().hex, ex=CACHE_GENERATION_TTL)
+            pipe.delete(*[self.prefix + key for key in keys])
+            pipe.execute()
+
+    def size(self):
+        return None
+
+
+class NullBackend:
+    """Backend that never stores anything (CACHE_BACKEND=none)"""
+
+    name = 'none'
+
+    def get(self, key):
+        return None
+
+    def generation(self, key):
+        return None
+
+    def set(self, key, value, ttl, generation=None):
+        return False
+
+    def delete(self, keys):
+        pass
+
+    def size(self):
+        return 0
+
+
+class ReadThroughCache:
+    """
+    Read-through cache for JSON-serializable values with hit/miss counters
+
+    Writers must call invalidate() for every key their change affects.
+    Invalidating a key also bumps its generation, so a load that started
+    before the invalidation does not write its stale value back.
+    """
+
+    def __init__(self, backend, ttl=CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader, ttl=None):
+        """
+        Return the cached value for key, calling loader() on a miss
+
+        None results are not cached, so missing records are always re-checked.
+        Backend failures fall through to the loader. ttl overrides the
+        cache's default lifetime for this entry.
+        """
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            self._count('errors')
+            print(f"[Cache] Backend read error: {e}")
+            value = None
+
+        if value is not None:
+            self._count('hits')
+            return value
+
+        self._count('misses')
+        try:
+            generation = self.backend.generation(key)
+        except Exception as e:
+            self._count('errors')
+            print(f"[Cache] Backend read error: {e}")
+            return loader()
+
+        value = loader()
+        if value is not None:
+            try:
+                self.backend.set(key, value, ttl or self.ttl, generation)
+            except Exception as e:
+                self._count('errors')
+                print(f"[Cache] Backend write error: {e}")
+        return value
+
+    def invalidate(self, *keys):
+        """Drop the given keys; None entries are ignored"""
+        keys = [key for key in keys if key]
+        try:
+            self.backend.delete(keys)
+        except Exception as e:
+            self._count('errors')
+            print(f"[Cache] Backend delete error: {e}")
+        self._count('invalidations', len(keys))
+
+    def stats(self):
+        """Counters for monitoring the cache"""
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "ttl": self.ttl,
+            "size": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "errors": self.errors
+        }
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+
+def build_backend(backend=CACHE_BACKEND, max_entries=CACHE_MAX_ENTRIES, prefix='paymind:'):
+    """Create the store for the configured backend, falling back to memory"""
+    if backend == 'none':
+        return NullBackend()
+    if backend == 'redis':
+        if _HAS_REDIS:
+            return RedisBackend(prefix=prefix)
+        print("[Cache] redis package not installed, using in-process cache")
+    return MemoryBackend(max_entries)
+
+
+def build_cache(backend=CACHE_BACKEND):
+    """Create the cache for the configured backend, falling back to memory"""
+    return ReadThroughCache(build_backend(backend))
+
+
+cache = build_cache()
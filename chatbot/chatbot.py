@@ -1,5 +1,14 @@
+import hashlib
+import json
 import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 
 # --- AI Chatbot helpers ---
 try:
@@ -10,10 +19,555 @@ except Exception:
     OpenAI = None  # type: ignore
     _HAS_OPENAI_V1 = False
 
+try:
+    # Upstream latency metrics when running inside the PayMind API
+    from metrics import observe_upstream  # type: ignore
+except Exception:
+    def observe_upstream(upstream, endpoint, outcome, duration):
+        pass
+
+# Timeouts and connection pool size shared by the SDK and the requests fallback
+AI_TIMEOUT = float(os.getenv('AIMLAPI_TIMEOUT', '30'))  # seconds
+AI_POOL_SIZE = int(os.getenv('AIMLAPI_POOL_SIZE', '10'))
+
+# Process-wide clients, created lazily and reused across chat turns
+_clients = {}  # (base_url, api_key) -> OpenAI client
+_clients_lock = threading.Lock()
+_http_session = None
+
+
+def _get_openai_client(api_key: str, base_url: str):
+    """Return a cached OpenAI-compatible client for this base URL and key."""
+    key = (base_url, api_key)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            options = {"api_key": api_key, "base_url": base_url, "timeout": AI_TIMEOUT}
+            try:
+                # The SDK is built on httpx; size its keep-alive pool explicitly
+                import httpx  # type: ignore
+                options["http_client"] = httpx.Client(
+                    timeout=AI_TIMEOUT,
+                    limits=httpx.Limits(
+                        max_connections=AI_POOL_SIZE,
+                        max_keepalive_connections=AI_POOL_SIZE
+                    )
+                )
+            except Exception:
+                pass
+            client = OpenAI(**options)
+            _clients[key] = client
+    return client
+
+
+def _get_http_session():
+    """Return the pooled requests session used by the fallback path."""
+    global _http_session
+    if _http_session is None:
+        with _clients_lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=AI_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _http_session = session
+    return _http_session
+
+
+# --- Response cache ---
+# Replies are keyed by a hash of the system prompt, model, trimmed history and
+# normalized message, so repeated questions skip the model call entirely.
+AI_CACHE_MAX_ENTRIES = int(os.getenv('AI_CACHE_MAX_ENTRIES', '1000'))
+AI_CACHE_TTL = float(os.getenv('AI_CACHE_TTL', '86400'))  # seconds
+AI_CACHE_PATH = os.getenv('AI_CACHE_PATH')  # optional SQLite file that survives restarts
+AI_CACHE_MAX_DISK_ENTRIES = int(os.getenv('AI_CACHE_MAX_DISK_ENTRIES', '20000'))
+
+
+class ResponseCache:
+    """LRU + TTL cache of AI replies with an optional SQLite store behind it."""
+
+    def __init__(self, max_entries=AI_CACHE_MAX_ENTRIES, ttl=AI_CACHE_TTL, path=AI_CACHE_PATH,
+                 max_disk_entries=AI_CACHE_MAX_DISK_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()  # key -> (expires_at, reply)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.store_errors = 0  # SQLite reads and writes that failed
+
+        self._db = None
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS ai_replies "
+                    "(key TEXT PRIMARY KEY, reply TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"[AI] Response cache store unavailable ({path}): {e}")
+                self._db = None
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        "SELECT reply, expires_at FROM ai_replies WHERE key = ? AND expires_at > ?",
+                        (key, now)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    # A broken store only costs a model call
+                    self.store_errors += 1
+                    print(f"[AI] Response cache read error: {e}")
+                    row = None
+                if row:
+                    self._remember(key, row[1], row[0])
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def set(self, key, reply):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, reply)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO ai_replies (key, reply, expires_at) VALUES (?, ?, ?)",
+                        (key, reply, expires_at)
+                    )
+                    self._writes += 1
+                    if self._writes % 100 == 0:
+                        self._prune_disk()
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    self.store_errors += 1
+                    print(f"[AI] Response cache write error: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "store_errors": self.store_errors,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "persistent": self._db is not None
+        }
+
+    def _remember(self, key, expires_at, reply):
+        self._entries[key] = (expires_at, reply)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _prune_disk(self):
+        self._db.execute("DELETE FROM ai_replies WHERE expires_at <= ?", (time.time(),))
+        self._db.execute(
+            "DELETE FROM ai_replies WHERE key NOT IN "
+            "(SELECT key FROM ai_replies ORDER BY expires_at DESC LIMIT ?)",
+            (self.max_disk_entries,)
+        )
+
+
+response_cache = ResponseCache()
+
+
+def _normalize(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", text).strip().lower().rstrip("?!. ")
+
+
+def _cache_key(system_prompt: str, model: str, trimmed, message: str) -> str:
+    """Stable hash of everything that determines the model's answer."""
+    payload = json.dumps({
+        "system": system_prompt,
+        "model": model,
+        "history": [[m["role"], _normalize(m["content"])] for m in trimmed],
+        "message": _normalize(message),
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# --- Request coalescing ---
+# Identical concurrent requests (same cache key) share one upstream call.
+AI_COALESCE_TIMEOUT = float(os.getenv('AI_COALESCE_TIMEOUT', str(AI_TIMEOUT * 2)))  # seconds
+
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution."""
+
+    def __init__(self):
+        self._calls = {}  # key -> _InFlightCall
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key, func, timeout):
+        """
+        Run func() once per key at a time; other callers wait for its result.
+
+        Each waiter has its own timeout and raises TimeoutError when it expires.
+        An exception raised by func() is re-raised in every caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _InFlightCall()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.result = func()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+        elif not call.done.wait(timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise TimeoutError("Timed out waiting for identical in-flight AI request")
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "upstream_calls": self.leaders,
+            "coalesced": self.coalesced,
+            "waiter_timeouts": self.timeouts
+        }
+
+
+inflight_requests = SingleFlight()
+
+
+def get_cache_stats():
+    """Counters of the AI response cache, request coalescing and conversation memory."""
+    return dict(
+        response_cache.stats(),
+        coalescing=inflight_requests.stats(),
+        memory=conversations.stats()
+    )
+
+
+SYSTEM_PROMPT = (
+    "You're an expert AI engineer collaborating in the Arc hackathon."
+    " Your focus: build intelligent, real-world payment systems where AI drives decisions and Arc executes them using USDC."
+    " Your mission: design and prototype an AI-powered payment solution built on Arc that uses USDC for transactions."
+    " Projects must deliver functional, working prototypes within the following innovation tracks:"
+    " - AI-driven automation: Smart agents making real-time financial or business decisions."
+    " - Dynamic payments: Adaptive pricing, subscriptions, or incentives based on AI insights."
+    " - Data intelligence: Predictive models enhancing trust, credit, or financial forecasting."
+    " - User experience: Seamless, secure, and human-centered payment interactions."
+    " Respond clearly, professionally, and in English unless the user switches language."
+    " Keep answers practical and technically grounded — focus on architecture, integration, and real-world use cases."
+)
+
+
+# --- Server-side conversation memory ---
+# Conversations keep their recent turns verbatim within a token budget; older
+# turns are folded into a rolling summary that is reused on every later turn.
+# State is kept in a cache backend (the app's CACHE_BACKEND unless
+# AI_CONVERSATION_BACKEND says otherwise); with redis every worker process
+# sees the same conversations. Summaries are written by a background pool,
+# so a chat turn never waits for the summary call.
+AI_CONTEXT_TOKENS = int(os.getenv('AI_CONTEXT_TOKENS', '1500'))  # budget for verbatim turns
+AI_SUMMARY_TOKENS = int(os.getenv('AI_SUMMARY_TOKENS', '300'))
+AI_MAX_CONVERSATIONS = int(os.getenv('AI_MAX_CONVERSATIONS', '10000'))  # in-process backend only
+AI_CONVERSATION_TTL = float(os.getenv('AI_CONVERSATION_TTL', '86400'))  # idle seconds
+AI_CONVERSATION_BACKEND = os.getenv('AI_CONVERSATION_BACKEND')  # memory or redis
+AI_SUMMARY_WORKERS = int(os.getenv('AI_SUMMARY_WORKERS', '2'))
+AI_SUMMARY_MAX_PENDING = int(os.getenv('AI_SUMMARY_MAX_PENDING', '100'))  # queued summaries before turns are truncated instead
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation between a user and a payments assistant."
+    " Merge the existing summary with the new turns."
+    " Keep facts the assistant may need later: names, amounts, wallet addresses, dates, decisions and open questions."
+    " Write plain sentences, no preamble."
+)
+
+try:
+    # Shared cache backends when running inside the PayMind API
+    from cache import CACHE_BACKEND, build_backend  # type: ignore
+except Exception:
+    CACHE_BACKEND, build_backend = 'memory', None
+
+
+class _LocalBackend:
+    """In-process LRU store, used when the app's cache module is unavailable."""
+
+    name = 'memory'
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def size(self):
+        return len(self._entries)
+
 
-def get_ai_reply(message: str, history):
+def _conversation_backend(name=None):
+    name = name or AI_CONVERSATION_BACKEND or CACHE_BACKEND
+    if build_backend is None:
+        return _LocalBackend(AI_MAX_CONVERSATIONS)
+    # Conversations are state rather than a cache, so 'none' still keeps them in process
+    return build_backend('memory' if name == 'none' else name, max_entries=AI_MAX_CONVERSATIONS, prefix='paymind:ai:')
+
+
+def _estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+class Conversation:
+    """Turns and rolling summary of one chat conversation."""
+
+    def __init__(self, summary="", turns=None, tokens=0):
+        self.summary = summary
+        self.turns = turns or []  # [{"role": ..., "content": ...}], oldest first
+        self.tokens = tokens
+
+    @classmethod
+    def from_state(cls, state):
+        """Conversation from its stored form; a new one for None."""
+        if not state:
+            return cls()
+        return cls(state.get("summary") or "", list(state.get("turns") or []), state.get("tokens") or 0)
+
+    def to_state(self):
+        return {"summary": self.summary, "turns": list(self.turns), "tokens": self.tokens}
+
+    def append(self, role: str, content: str):
+        self.turns.append({"role": role, "content": content})
+        self.tokens += _estimate_tokens(content)
+
+    def overflow(self):
+        """Oldest turns to fold so that half the budget is free; the last exchange always stays."""
+        if self.tokens <= AI_CONTEXT_TOKENS:
+            return []
+        tokens = self.tokens
+        folded = []
+        for turn in self.turns[:-2]:
+            if tokens <= AI_CONTEXT_TOKENS // 2:
+                break
+            tokens -= _estimate_tokens(turn["content"])
+            folded.append(turn)
+        return folded
+
+    def drop_oldest(self, count: int):
+        for turn in self.turns[:count]:
+            self.tokens -= _estimate_tokens(turn["content"])
+        del self.turns[:count]
+
+
+class ConversationStore:
+    """Conversations in a cache backend with idle expiry."""
+
+    def __init__(self, backend, ttl=AI_CONVERSATION_TTL, lock_stripes=64):
+        self.backend = backend
+        self.ttl = ttl
+        # Guards load-modify-save of one conversation within this process; never held over a model call
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._lock = threading.Lock()
+        self._summarizing = set()  # conversation ids with a queued summary
+        self.summaries = 0
+        self.truncations = 0
+        self.errors = 0
+
+    def lock(self, conversation_id: str):
+        return self._locks[hash(conversation_id) % len(self._locks)]
+
+    def load(self, conversation_id: str) -> Conversation:
+        """Return the conversation, starting a new one if unknown or expired."""
+        try:
+            state = self.backend.get(f"conversation:{conversation_id}")
+        except Exception as e:
+            self.count('errors')
+            print(f"[AI] Conversation store read error: {e}")
+            state = None
+        return Conversation.from_state(state)
+
+    def save(self, conversation_id: str, conversation: Conversation):
+        try:
+            self.backend.set(f"conversation:{conversation_id}", conversation.to_state(), self.ttl)
+        except Exception as e:
+            self.count('errors')
+            print(f"[AI] Conversation store write error: {e}")
+
+    def begin_summary(self, conversation_id: str) -> bool:
+        """Reserve the conversation for one background summary; False if queued already or the queue is full."""
+        with self._lock:
+            if conversation_id in self._summarizing or len(self._summarizing) >= AI_SUMMARY_MAX_PENDING:
+                return False
+            self._summarizing.add(conversation_id)
+            return True
+
+    def end_summary(self, conversation_id: str):
+        with self._lock:
+            self._summarizing.discard(conversation_id)
+
+    def count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        return {
+            "backend": self.backend.name,
+            "conversations": self.backend.size(),
+            "summaries": self.summaries,
+            "pending_summaries": len(self._summarizing),
+            "truncations": self.truncations,
+            "errors": self.errors
+        }
+
+
+conversations = ConversationStore(_conversation_backend())
+_summary_executor = ThreadPoolExecutor(max_workers=AI_SUMMARY_WORKERS, thread_name_prefix='ai-summary')
+
+
+def _transcript(turns) -> str:
+    return "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+
+
+def _truncate_into_summary(conversation: Conversation):
+    """Fold the overflow without a model call: keep the most recent text within the summary budget."""
+    folded = conversation.overflow()
+    if folded:
+        combined = f"{conversation.summary}\n{_transcript(folded)}".strip()
+        conversation.summary = combined[-AI_SUMMARY_TOKENS * 4:]
+        conversation.drop_oldest(len(folded))
+
+
+def _schedule_summary(conversation_id: str, conversation: Conversation, api_key: str, base_url: str, model: str):
+    """Queue a background summary once the verbatim turns exceed the budget.
+
+    Turns are folded until half the budget is free, so a summary call happens
+    every few turns rather than on each one. If summaries fall behind and the
+    turns reach twice the budget, they are truncated on the spot instead.
+    """
+    if conversation.tokens <= AI_CONTEXT_TOKENS:
+        return
+    if conversations.begin_summary(conversation_id):
+        try:
+            # Runs once the caller saves the turn and releases the conversation lock
+            _summary_executor.submit(_fold_into_summary, conversation_id, api_key, base_url, model)
+            return
+        except RuntimeError:
+            # Executor shut down at interpreter exit
+            conversations.end_summary(conversation_id)
+    if conversation.tokens > AI_CONTEXT_TOKENS * 2:
+        _truncate_into_summary(conversation)
+        conversations.count('truncations')
+
+
+def _fold_into_summary(conversation_id: str, api_key: str, base_url: str, model: str):
+    """Move the oldest turns into the summary (runs on the summary pool).
+
+    The model is called without holding the conversation lock. The result is
+    only written back if the folded turns and the summary are unchanged, so a
+    turn that arrived meanwhile is kept and a concurrent fold wins.
+    """
+    try:
+        with conversations.lock(conversation_id):
+            conversation = conversations.load(conversation_id)
+            folded = conversation.overflow()
+            previous = conversation.summary
+        if not folded:
+            return
+
+        transcript = _transcript(folded)
+        summary = _request_completion(api_key, base_url, model, [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Existing summary:\n{previous or '(none)'}\n\nNew turns:\n{transcript}"},
+        ], max_tokens=AI_SUMMARY_TOKENS)
+
+        with conversations.lock(conversation_id):
+            conversation = conversations.load(conversation_id)
+            if conversation.summary != previous or conversation.turns[:len(folded)] != folded:
+                return
+            if summary:
+                conversation.summary = summary
+                conversation.drop_oldest(len(folded))
+            else:
+                # Summarizer unavailable
+                _truncate_into_summary(conversation)
+            conversations.save(conversation_id, conversation)
+        conversations.count('summaries' if summary else 'truncations')
+    except Exception as e:
+        print(f"[AI] Conversation summary failed: {e}")
+    finally:
+        conversations.end_summary(conversation_id)
+
+
+def get_ai_reply(message: str, history, conversation_id: str = None):
     """Return AI-generated reply if OPENAI/AIMLAPI key is configured; otherwise None.
     Uses a concise, safe system prompt with site context (Polish by default).
+
+    With a conversation_id the server-side conversation memory is used and the
+    client-supplied history is ignored.
     """
     # Prefer AIMLAPI creds if provided, fall back to OPENAI_API_KEY for compatibility
     api_key = os.getenv('AIMLAPI_API_KEY') or os.getenv('OPENAI_API_KEY')
@@ -21,6 +575,29 @@ def get_ai_reply(message: str, history):
     if not api_key:
         return None
 
+    # Domyślnie użyj modelu gpt-4 (zgodnie z przykładem AIML API); można nadpisać przez ENV
+    model = os.getenv('AIMLAPI_MODEL', os.getenv('OPENAI_MODEL', 'gpt-4'))
+    message = message[:4000]
+
+    if conversation_id:
+        # Snapshot under the lock and call the model without it, like _fold_into_summary
+        with conversations.lock(conversation_id):
+            conversation = conversations.load(conversation_id)
+        system_content = SYSTEM_PROMPT
+        if conversation.summary:
+            system_content += f"\n\nSummary of the earlier conversation:\n{conversation.summary}"
+
+        reply = _complete(api_key, base_url, model, system_content, list(conversation.turns), message)
+        if reply:
+            # Reload, since a summary or another turn may have been saved meanwhile
+            with conversations.lock(conversation_id):
+                conversation = conversations.load(conversation_id)
+                conversation.append("user", message)
+                conversation.append("assistant", reply)
+                _schedule_summary(conversation_id, conversation, api_key, base_url, model)
+                conversations.save(conversation_id, conversation)
+        return reply
+
     # Cap history for token safety
     trimmed = []
     try:
@@ -31,50 +608,57 @@ def get_ai_reply(message: str, history):
     except Exception:
         trimmed = []
 
-    system_prompt = (
-        "You're an expert AI engineer collaborating in the Arc hackathon."
-        " Your focus: build intelligent, real-world payment systems where AI drives decisions and Arc executes them using USDC."
-        " Your mission: design and prototype an AI-powered payment solution built on Arc that uses USDC for transactions."
-        " Projects must deliver functional, working prototypes within the following innovation tracks:"
-        " - AI-driven automation: Smart agents making real-time financial or business decisions."
-        " - Dynamic payments: Adaptive pricing, subscriptions, or incentives based on AI insights."
-        " - Data intelligence: Predictive models enhancing trust, credit, or financial forecasting."
-        " - User experience: Seamless, secure, and human-centered payment interactions."
-        " Respond clearly, professionally, and in English unless the user switches language."
-        " Keep answers practical and technically grounded — focus on architecture, integration, and real-world use cases."
-    )
+    return _complete(api_key, base_url, model, SYSTEM_PROMPT, trimmed, message)
 
-    # Domyślnie użyj modelu gpt-4 (zgodnie z przykładem AIML API); można nadpisać przez ENV
-    model = os.getenv('AIMLAPI_MODEL', os.getenv('OPENAI_MODEL', 'gpt-4'))
 
-    messages = [{"role": "system", "content": system_prompt}] + trimmed + [
-        {"role": "user", "content": message[:4000]}
+def _complete(api_key: str, base_url: str, model: str, system_content: str, trimmed, message: str):
+    """Answer from the response cache, or make one coalesced upstream call."""
+    messages = [{"role": "system", "content": system_content}] + trimmed + [
+        {"role": "user", "content": message}
     ]
 
+    cache_key = _cache_key(system_content, model, trimmed, message)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    def fetch():
+        reply = _request_completion(api_key, base_url, model, messages)
+        if reply:
+            # Cache before leaving the in-flight map so late arrivals hit it
+            response_cache.set(cache_key, reply)
+        return reply
+
+    try:
+        return inflight_requests.do(cache_key, fetch, AI_COALESCE_TIMEOUT)
+    except Exception as e:
+        print(f"[AI] Request failed: {e}")
+        return None
+
+
+def _request_completion(api_key: str, base_url: str, model: str, messages, max_tokens: int = 512):
+    """Call the chat completions API; return the reply text or None."""
     # Najpierw spróbuj SDK kompatybilnego z OpenAI, jeśli dostępny
     if _HAS_OPENAI_V1:
+        started = time.perf_counter()
         try:
-            client = OpenAI(api_key=api_key, base_url=base_url)
+            client = _get_openai_client(api_key, base_url)
             resp = client.chat.completions.create(
                 model=model,
                 messages=messages,
                 temperature=0.3,
-                max_tokens=512
+                max_tokens=max_tokens
             )
+            observe_upstream('ai', 'chat/completions', '2xx', time.perf_counter() - started)
             return resp.choices[0].message.content.strip() if resp and resp.choices else None
         except Exception as e:
+            observe_upstream('ai', 'chat/completions', 'error', time.perf_counter() - started)
             print(f"[AI] OpenAI SDK error (fallback to requests): {e}")
 
-    # Fallback: bezpośrednie wywołanie AIML API przez requests
+    # Fallback: bezpośrednie wywołanie AIML API przez współdzieloną sesję requests
+    started = time.perf_counter()
     try:
-        try:
-            import requests as _requests  # lokalny import na wypadek braku globalnego
-        except Exception:
-            _requests = requests  # użyj modułu importowanego globalnie
-        if _requests is None:
-            return None
-
-        resp = _requests.post(
+        resp = _get_http_session().post(
             f"{base_url}/chat/completions",
             headers={
                 "Content-Type": "application/json",
@@ -84,10 +668,11 @@ def get_ai_reply(message: str, history):
                 "model": model,
                 "messages": messages,
                 "temperature": 0.3,
-                "max_tokens": 512,
+                "max_tokens": max_tokens,
             },
-            timeout=30,
+            timeout=AI_TIMEOUT,
         )
+        observe_upstream('ai', 'chat/completions', f"{resp.status_code // 100}xx", time.perf_counter() - started)
         data = resp.json()
         choices = data.get("choices") or []
         if choices:
@@ -96,5 +681,6 @@ def get_ai_reply(message: str, history):
             return content.strip() if content else None
         return None
     except Exception as e:
+        observe_upstream('ai', 'chat/completions', 'error', time.perf_counter() - started)
         print(f"[AI] AIML API error: {e}")
         return None
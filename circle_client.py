@@ -0,0 +1,445 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import observe_upstream, register_callback, status_outcome, upstream_rejections
+
+try:
+    # Only needed by the ASGI app (asgi.py)
+    import httpx  # type: ignore
+    _HAS_HTTPX = True
+except Exception:
+    httpx = None  # type: ignore
+    _HAS_HTTPX = False
+
+# --- Shared Circle API client ---
+# One requests.Session per process keeps TCP+TLS connections to Circle alive
+# between calls instead of paying a new handshake on every request.
+CIRCLE_API_URL = os.getenv('CIRCLE_API_URL', 'https://api.circle.com/v1')
+CIRCLE_POOL_SIZE = int(os.getenv('CIRCLE_POOL_SIZE', '20'))
+CIRCLE_MAX_RETRIES = int(os.getenv('CIRCLE_MAX_RETRIES', '2'))
+CIRCLE_BACKOFF_BASE = float(os.getenv('CIRCLE_BACKOFF_BASE', '0.2'))  # seconds
+CIRCLE_BACKOFF_MAX = float(os.getenv('CIRCLE_BACKOFF_MAX', '2.0'))  # seconds
+
+# (connect, read) timeouts in seconds per endpoint
+DEFAULT_TIMEOUT = (3.05, 10)
+ENDPOINT_TIMEOUTS = {
+    '/businessAccount/wallets/addresses/deposit': (3.05, 10),
+    '/w3s/user/wallets': (3.05, 10),
+    '/transfers': (3.05, 10),
+    '/businessAccount/sessions/terminate': (3.05, 5),
+    '/w3s/wallets/{id}/balances': (3.05, 5),
+}
+
+# Responses worth retrying when the call is idempotent
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Circuit breaker: after CIRCLE_BREAKER_FAILURES consecutive failed or slow calls
+# to an endpoint, calls to it fail fast for CIRCLE_BREAKER_RESET seconds; then a
+# single probe call decides whether to close the breaker again.
+CIRCLE_BREAKER_FAILURES = int(os.getenv('CIRCLE_BREAKER_FAILURES', '5'))
+CIRCLE_BREAKER_RESET = float(os.getenv('CIRCLE_BREAKER_RESET', '30'))  # seconds
+CIRCLE_BREAKER_SLOW_CALL = float(os.getenv('CIRCLE_BREAKER_SLOW_CALL', '5'))  # seconds, counts as a failure
+CIRCLE_BREAKER_HALF_OPEN_CALLS = int(os.getenv('CIRCLE_BREAKER_HALF_OPEN_CALLS', '1'))
+
+# Bulkhead: at most CIRCLE_BULKHEAD_SIZE threads inside calls to one endpoint;
+# others wait up to CIRCLE_BULKHEAD_WAIT seconds for a slot, then fail fast.
+# Sized to the connection pool by default, since extra slots would only queue for a connection.
+CIRCLE_BULKHEAD_SIZE = int(os.getenv('CIRCLE_BULKHEAD_SIZE', str(CIRCLE_POOL_SIZE)))
+CIRCLE_BULKHEAD_WAIT = float(os.getenv('CIRCLE_BULKHEAD_WAIT', '1.0'))  # seconds
+
+# Async client: coroutines share one pool, so far more calls can be in flight
+CIRCLE_ASYNC_MAX_CONNECTIONS = int(os.getenv('CIRCLE_ASYNC_MAX_CONNECTIONS', '1000'))
+CIRCLE_ASYNC_BULKHEAD_SIZE = int(os.getenv('CIRCLE_ASYNC_BULKHEAD_SIZE', str(CIRCLE_ASYNC_MAX_CONNECTIONS)))
+
+
+class CircleUnavailable(requests.exceptions.ConnectionError):
+    """Call rejected locally without reaching Circle"""
+
+
+class CircuitOpenError(CircleUnavailable):
+    """The endpoint's circuit breaker is open"""
+
+
+class BulkheadFullError(CircleUnavailable):
+    """Too many calls to the endpoint are already in progress"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with half-open probing"""
+
+    CLOSED = 'closed'
+    HALF_OPEN = 'half_open'
+    OPEN = 'open'
+
+    def __init__(self, failure_threshold=CIRCLE_BREAKER_FAILURES, reset_timeout=CIRCLE_BREAKER_RESET,
+                 half_open_calls=CIRCLE_BREAKER_HALF_OPEN_CALLS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may go out now; half-open admits only probe calls"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probes = 0
+            if self.state == self.HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    return False
+                self._probes += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                print("[Circle] Circuit closed after successful probe")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def release_probe(self):
+        """Give back a half-open probe slot whose call was abandoned without an outcome"""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"[Circle] Circuit opened after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+# Breakers are per endpoint and shared by the blocking and async clients
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(path):
+    """The circuit breaker for an endpoint path, created on first use"""
+    with _breakers_lock:
+        if path not in _breakers:
+            _breakers[path] = CircuitBreaker()
+        return _breakers[path]
+
+
+class CircleClient:
+    """Pooled HTTP client for the Circle API"""
+
+    def __init__(self, api_key, base_url=CIRCLE_API_URL, pool_size=CIRCLE_POOL_SIZE,
+                 max_retries=CIRCLE_MAX_RETRIES):
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.bulkheads = {}  # path -> [BoundedSemaphore, calls in progress]
+        self._guards_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+    def post(self, path, payload, idempotent=False):
+        """
+        POST a JSON payload to a Circle endpoint
+
+        Args:
+            path (str): Endpoint path, e.g. "/transfers"
+            payload (dict): JSON body
+            idempotent (bool): Retry connection errors and 429/5xx responses
+
+        Returns:
+            requests.Response: Final response from Circle
+
+        Raises:
+            requests.exceptions.RequestException: If the last attempt fails to connect
+        """
+        return self.request('POST', path, idempotent=idempotent, json=payload)
+
+    def request(self, method, path, idempotent=False, endpoint=None, **kwargs):
+        """
+        Send a request with the endpoint's timeout, retrying idempotent calls
+
+        Paths that contain an id pass endpoint, the path template (e.g.
+        "/w3s/wallets/{id}/balances"), so all ids share one breaker, bulkhead,
+        timeout and metrics label.
+
+        Raises:
+            CircuitOpenError: The endpoint's breaker is open
+            BulkheadFullError: No call slot for the endpoint freed up in time
+        """
+        endpoint = endpoint or path
+        timeout = ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+        attempts = 1 + (self.max_retries if idempotent else 0)
+        breaker, bulkhead = self._guards(endpoint)
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            with self._call_slot(endpoint, breaker, bulkhead):
+                started = time.perf_counter()
+                try:
+                    response = self.session.request(
+                        method, f"{self.base_url}{path}", timeout=timeout, **kwargs
+                    )
+                except requests.exceptions.RequestException as e:
+                    observe_upstream('circle', endpoint, 'error', time.perf_counter() - started)
+                    breaker.record_failure()
+                    if last_attempt or not isinstance(
+                        e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+                    ):
+                        raise
+                except Exception:
+                    breaker.record_failure()
+                    raise
+                else:
+                    duration = time.perf_counter() - started
+                    observe_upstream('circle', endpoint, status_outcome(response.status_code), duration)
+                    if response.status_code in RETRYABLE_STATUS_CODES or duration >= CIRCLE_BREAKER_SLOW_CALL:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                    if last_attempt or response.status_code not in RETRYABLE_STATUS_CODES:
+                        return response
+            time.sleep(backoff_delay(attempt))
+
+    def _guards(self, path):
+        """The circuit breaker and bulkhead for an endpoint, created on first use"""
+        with self._guards_lock:
+            if path not in self.bulkheads:
+                self.bulkheads[path] = [threading.BoundedSemaphore(CIRCLE_BULKHEAD_SIZE), 0]
+            return breaker_for(path), self.bulkheads[path]
+
+    @contextmanager
+    def _call_slot(self, path, breaker, bulkhead):
+        """Hold a bulkhead slot for one attempt, failing fast when full or when the breaker is open"""
+        semaphore = bulkhead[0]
+        if not semaphore.acquire(timeout=CIRCLE_BULKHEAD_WAIT):
+            upstream_rejections.inc('circle', path, 'bulkhead_full')
+            raise BulkheadFullError(f"Too many concurrent Circle calls to {path}")
+        try:
+            if not breaker.allow():
+                upstream_rejections.inc('circle', path, 'circuit_open')
+                raise CircuitOpenError(f"Circle circuit open for {path}")
+            with self._guards_lock:
+                bulkhead[1] += 1
+            try:
+                yield
+            finally:
+                with self._guards_lock:
+                    bulkhead[1] -= 1
+        finally:
+            semaphore.release()
+
+    def in_flight(self):
+        """Calls in progress per endpoint"""
+        with self._guards_lock:
+            return {path: bulkhead[1] for path, bulkhead in self.bulkheads.items()}
+
+
+class AsyncCircleClient:
+    """
+    Circle API client for coroutines (ASGI mode)
+
+    Same timeouts, retries, backoff and circuit breakers as CircleClient, on an
+    httpx connection pool, so a handful of workers can keep thousands of Circle
+    calls in flight.
+    """
+
+    def __init__(self, api_key, base_url=CIRCLE_API_URL, max_connections=CIRCLE_ASYNC_MAX_CONNECTIONS,
+                 max_retries=CIRCLE_MAX_RETRIES):
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.bulkheads = {}  # path -> [asyncio.Semaphore, calls in progress]
+        self.client = httpx.AsyncClient(
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json"
+            },
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=CIRCLE_POOL_SIZE)
+        )
+
+    async def post(self, path, payload, idempotent=False):
+        """
+        POST a JSON payload to a Circle endpoint
+
+        Returns:
+            httpx.Response: Final response from Circle
+
+        Raises:
+            httpx.TransportError: If the last attempt fails to connect or times out
+            CircleUnavailable: The breaker is open or the bulkhead is full
+        """
+        return await self.request('POST', path, idempotent=idempotent, json=payload)
+
+    async def request(self, method, path, idempotent=False, endpoint=None, **kwargs):
+        """Send a request with the endpoint's timeout, retrying idempotent calls"""
+        endpoint = endpoint or path
+        connect_timeout, read_timeout = ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+        timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        attempts = 1 + (self.max_retries if idempotent else 0)
+        breaker = breaker_for(endpoint)
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            async with self._call_slot(endpoint, breaker):
+                started = time.perf_counter()
+                try:
+                    response = await self.client.request(
+                        method, f"{self.base_url}{path}", timeout=timeout, **kwargs
+                    )
+                except httpx.TransportError:
+                    observe_upstream('circle', endpoint, 'error', time.perf_counter() - started)
+                    breaker.record_failure()
+                    if last_attempt:
+                        raise
+                except asyncio.CancelledError:
+                    breaker.release_probe()
+                    raise
+                except Exception:
+                    breaker.record_failure()
+                    raise
+                else:
+                    duration = time.perf_counter() - started
+                    observe_upstream('circle', endpoint, status_outcome(response.status_code), duration)
+                    if response.status_code in RETRYABLE_STATUS_CODES or duration >= CIRCLE_BREAKER_SLOW_CALL:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                    if last_attempt or response.status_code not in RETRYABLE_STATUS_CODES:
+                        return response
+            await asyncio.sleep(backoff_delay(attempt))
+
+    @asynccontextmanager
+    async def _call_slot(self, path, breaker):
+        """Hold a bulkhead slot for one attempt, failing fast when full or when the breaker is open"""
+        bulkhead = self.bulkheads.get(path)
+        if bulkhead is None:
+            bulkhead = self.bulkheads[path] = [asyncio.Semaphore(CIRCLE_ASYNC_BULKHEAD_SIZE), 0]
+        try:
+            await asyncio.wait_for(bulkhead[0].acquire(), CIRCLE_BULKHEAD_WAIT)
+        except asyncio.TimeoutError:
+            upstream_rejections.inc('circle', path, 'bulkhead_full')
+            raise BulkheadFullError(f"Too many concurrent Circle calls to {path}")
+        try:
+            if not breaker.allow():
+                upstream_rejections.inc('circle', path, 'circuit_open')
+                raise CircuitOpenError(f"Circle circuit open for {path}")
+            bulkhead[1] += 1
+            try:
+                yield
+            finally:
+                bulkhead[1] -= 1
+        finally:
+            bulkhead[0].release()
+
+    def in_flight(self):
+        """Calls in progress per endpoint"""
+        return {path: bulkhead[1] for path, bulkhead in self.bulkheads.items()}
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter for the given retry attempt"""
+    return random.uniform(0, min(CIRCLE_BACKOFF_MAX, CIRCLE_BACKOFF_BASE * (2 ** attempt)))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_circle_client():
+    """
+    Return the process-wide Circle client, creating it on first use
+
+    Returns:
+        CircleClient: Shared client, or None if CircleAPI_KEY is not set
+    """
+    global _client
+    if _client is None:
+        api_key = os.getenv('CircleAPI_KEY')
+        if not api_key:
+            return None
+        with _client_lock:
+            if _client is None:
+                _client = CircleClient(api_key)
+    return _client
+
+
+_async_client = None
+
+
+def get_async_circle_client():
+    """
+    Return the Circle client for coroutines, creating it on first use
+
+    Must be called from the event loop that will use it.
+
+    Returns:
+        AsyncCircleClient: Shared client, or None if CircleAPI_KEY is not set
+
+    Raises:
+        RuntimeError: If httpx is not installed
+    """
+    global _async_client
+    if _async_client is None:
+        if not _HAS_HTTPX:
+            raise RuntimeError("ASGI mode needs httpx: pip install httpx")
+        api_key = os.getenv('CircleAPI_KEY')
+        if not api_key:
+            return None
+        _async_client = AsyncCircleClient(api_key)
+    return _async_client
+
+
+async def close_async_circle_client():
+    """Close the async client's connections (ASGI shutdown)"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+BREAKER_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+
+def _collect_breaker_states():
+    with _breakers_lock:
+        return {('circle', path): BREAKER_STATE_VALUES[breaker.state] for path, breaker in _breakers.items()}
+
+
+def _collect_in_flight():
+    totals = {}
+    for client in (_client, _async_client):
+        if client is not None:
+            for path, count in client.in_flight().items():
+                totals[('circle', path)] = totals.get(('circle', path), 0) + count
+    return totals
+
+
+register_callback(
+    'paymind_circuit_breaker_state', 'Circuit breaker state per upstream endpoint (0 closed, 1 half-open, 2 open)',
+    ('upstream', 'endpoint'), _collect_breaker_states
+)
+register_callback(
+    'paymind_upstream_in_flight', 'Upstream calls in progress per endpoint (bulkhead occupancy)',
+    ('upstream', 'endpoint'), _collect_in_flight
+)
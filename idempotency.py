@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import Response, jsonify, make_response, request
+from sqlalchemy import and_, delete, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from models import IdempotencyKey
+
+# --- Idempotency-Key handling ---
+# The first request with a given key claims a row in idempotency_keys; its
+# response is stored there and replayed for every retry with the same key
+# until it expires. A duplicate that arrives while the first is still running
+# waits for it instead of repeating the DB work and the Circle call. Server
+# errors are not stored, so the client can retry them for real - unless the
+# view already sent something to Circle (mark_upstream_call). Then the claim
+# is kept until IDEMPOTENCY_LOCK_TIMEOUT, and the retry that takes it over
+# runs with the same derived keys, so Circle and the view deduplicate it.
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', '86400'))  # seconds a response is replayed
+IDEMPOTENCY_WAIT = float(os.getenv('IDEMPOTENCY_WAIT', '30'))  # seconds a duplicate waits for the first request
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', '120'))  # claims older than this are abandoned
+IDEMPOTENCY_PURGE_RATE = 0.01  # fraction of claims that also delete expired rows
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+REPLAYED_HEADERS = ['Content-Type', 'Location']
+
+NEW, REPLAY, MISMATCH, IN_PROGRESS = 'new', 'replay', 'mismatch', 'in_progress'
+UPSTREAM_CALLED = 'paymind.upstream_called'  # WSGI environ flag set by mark_upstream_call
+
+# Upstream keys are derived from the client's key, so a retry that does reach
+# Circle (e.g. after the stored claim expired) is still deduplicated there
+_UPSTREAM_KEY_NAMESPACE = uuid.UUID('0b7e4f52-8c1d-4a8e-b6f3-2d9c5e1a7f04')
+
+
+def request_fingerprint(method, path, body):
+    """sha256 of the parts of a request that must match for a replay; JSON bodies are compared by value"""
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode()
+    except ValueError:
+        pass
+    digest = hashlib.sha256(f"{method} {path}\n".encode())
+    digest.update(body or b'')
+    return digest.hexdigest()
+
+
+def upstream_key(endpoint, key):
+    """Circle idempotency key for a client Idempotency-Key, or None without one"""
+    if not key:
+        return None
+    return str(uuid.uuid5(_UPSTREAM_KEY_NAMESPACE, f"{endpoint}:{key}"))
+
+
+def mark_upstream_call(req=None):
+    """Record that this request is sending a side effect to Circle, so its claim is never released"""
+    (req or request).environ[UPSTREAM_CALLED] = True
+
+
+def upstream_called(req=None):
+    return bool((req or request).environ.get(UPSTREAM_CALLED))
+
+
+def poll_delays(wait=IDEMPOTENCY_WAIT):
+    """Sleep intervals for a duplicate waiting on the first request, 50 ms doubling up to 1 s"""
+    deadline = time.monotonic() + wait
+    delay = 0.05
+    while time.monotonic() < deadline:
+        yield min(delay, max(deadline - time.monotonic(), 0))
+        delay = min(delay * 2, 1.0)
+
+
+class IdempotencyStore:
+    """
+    Claims and stored responses in the idempotency_keys table
+
+    Args:
+        session_factory: sessionmaker bound to the app's engine
+    """
+
+    def __init__(self, session_factory, ttl=IDEMPOTENCY_TTL, lock_timeout=IDEMPOTENCY_LOCK_TIMEOUT):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+
+    def claim(self, key, endpoint, fingerprint):
+        """
+        Claim a key for a new request, or look up what happened to it before
+
+        Returns:
+            tuple: (NEW, None), (REPLAY, stored response dict), (MISMATCH, None) or (IN_PROGRESS, None)
+        """
+        now = datetime.utcnow()
+        row = {
+            "fingerprint": fingerprint,
+            "status_code": None,
+            "response_body": None,
+            "response_headers": None,
+            "locked_at": now,
+            "expires_at": now + timedelta(seconds=self.ttl)
+        }
+        session = self.session_factory()
+        try:
+            if random.random() < IDEMPOTENCY_PURGE_RATE:
+                session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= now))
+                session.commit()
+
+            try:
+                session.execute(insert(IdempotencyKey).values(key=key, endpoint=endpoint, **row))
+                session.commit()
+                return NEW, None
+            except IntegrityError:
+                session.rollback()
+
+            # Take over an expired record or a claim whose request died
+            taken = session.execute(
+                update(IdempotencyKey)
+                .where(
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.endpoint == endpoint,
+                    or_(
+                        IdempotencyKey.expires_at <= now,
+                        and_(
+                            IdempotencyKey.status_code.is_(None),
+                            IdempotencyKey.locked_at <= now - timedelta(seconds=self.lock_timeout)
+                        )
+                    )
+                )
+                .values(**row)
+            ).rowcount
+            session.commit()
+            if taken:
+                return NEW, None
+
+            record = session.execute(
+                select(IdempotencyKey).where(IdempotencyKey.key == key, IdempotencyKey.endpoint == endpoint)
+            ).scalars().first()
+            if record is None:
+                # Released between the insert and the select
+                return self.claim(key, endpoint, fingerprint)
+            if record.fingerprint != fingerprint:
+                return MISMATCH, None
+            if record.status_code is None:
+                return IN_PROGRESS, None
+            return REPLAY, {
+                "status": record.status_code,
+                "body": record.response_body,
+                "headers": record.response_headers or {}
+            }
+        finally:
+            session.close()
+
+    def finish(self, key, endpoint, status, body, headers, keep_claim=False):
+        """
+        Store the response of a claimed request
+
+        Server errors are not stored. Their claim is released, or with
+        keep_claim left to expire after the lock timeout.
+        """
+        if status >= 500:
+            if not keep_claim:
+                self.release(key, endpoint)
+            return
+        session = self.session_factory()
+        try:
+            session.execute(
+                update(IdempotencyKey)
+                .where(IdempotencyKey.key == key, IdempotencyKey.endpoint == endpoint)
+                .values(status_code=status, response_body=body, response_headers=headers)
+            )
+            session.commit()
+        finally:
+            session.close()
+
+    def release(self, key, endpoint):
+        """Drop an unfinished claim so the next retry runs the request again"""
+        session = self.session_factory()
+        try:
+            session.execute(
+                delete(IdempotencyKey).where(
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.endpoint == endpoint,
+                    IdempotencyKey.status_code.is_(None)
+                )
+            )
+            session.commit()
+        finally:
+            session.close()
+
+
+def stored_headers(response):
+    return {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+
+
+def replay_response(record):
+    response = Response(record["body"], status=record["status"], headers=record["headers"])
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def key_error(outcome):
+    """(body, status) for a key that cannot be used, or None"""
+    if outcome == MISMATCH:
+        return {"error": "Idempotency-Key was already used for a different request"}, 422
+    if outcome == IN_PROGRESS:
+        return {"error": "A request with this Idempotency-Key is still in progress"}, 409
+    return None
+
+
+def idempotent(store):
+    """
+    Honor the Idempotency-Key header on a Flask view
+
+    Requests without the header run as before. The view's endpoint name scopes
+    the key, so the same key may be used once per endpoint.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+                return jsonify({"error": f"Idempotency-Key must be at most {IDEMPOTENCY_MAX_KEY_LENGTH} characters"}), 400
+
+            endpoint = request.endpoint
+            fingerprint = request_fingerprint(request.method, request.path, request.get_data())
+            outcome, record = store.claim(key, endpoint, fingerprint)
+            for delay in poll_delays():
+                if outcome != IN_PROGRESS:
+                    break
+                time.sleep(delay)
+                outcome, record = store.claim(key, endpoint, fingerprint)
+
+            if outcome == REPLAY:
+                return replay_response(record)
+            error = key_error(outcome)
+            if error:
+                response = make_response(jsonify(error[0]), error[1])
+                if outcome == IN_PROGRESS:
+                    response.headers['Retry-After'] = '1'
+                return response
+
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                if not upstream_called():
+                    store.release(key, endpoint)
+                raise
+            store.finish(
+                key, endpoint, response.status_code, response.get_data(as_text=True), stored_headers(response),
+                keep_claim=upstream_called()
+            )
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,269 @@
+import threading
+import time
+from contextvars import ContextVar
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+# --- Prometheus-compatible metrics ---
+# A small in-process registry rendered in the Prometheus text format, so no
+# client library is needed. Scrape GET /metrics.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class CallbackMetric:
+    """Values read from a callback at scrape time (gauge or externally kept counter)"""
+
+    def __init__(self, name, documentation, labels, collect, kind='gauge'):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.collect = collect  # returns {label_values tuple: value}
+
+    def samples(self):
+        try:
+            values = self.collect()
+        except Exception as e:
+            print(f"[Metrics] Collecting {self.name} failed: {e}")
+            return
+        for label_values, value in values.items():
+            if value is not None:
+                yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    """Cumulative histogram with labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label_values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(state)) for labels, state in self._values.items()]
+        for label_values, state in items:
+            for bound, count in zip(self.buckets, state):
+                labels = _format_labels(self.labels, label_values, [('le', bound)])
+                yield f"{self.name}_bucket{labels} {count}"
+            labels = _format_labels(self.labels, label_values, [('le', '+Inf')])
+            yield f"{self.name}_bucket{labels} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labels, label_values)} {state[-2]}"
+            yield f"{self.name}_count{_format_labels(self.labels, label_values)} {state[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    'paymind_http_requests_total', 'HTTP requests by route and status code',
+    ('method', 'route', 'status')
+))
+http_latency = registry.register(Histogram(
+    'paymind_http_request_duration_seconds', 'HTTP request latency by route',
+    ('method', 'route')
+))
+db_queries = registry.register(Counter(
+    'paymind_db_queries_total', 'SQL statements executed, by route', ('route',)
+))
+db_latency = registry.register(Histogram(
+    'paymind_db_query_duration_seconds', 'SQL statement latency by route', ('route',)
+))
+db_queries_per_request = registry.register(Histogram(
+    'paymind_db_queries_per_request', 'SQL statements executed per HTTP request',
+    ('route',), buckets=QUERY_COUNT_BUCKETS
+))
+upstream_requests = registry.register(Counter(
+    'paymind_upstream_requests_total', 'Calls to external APIs by outcome',
+    ('upstream', 'endpoint', 'outcome')
+))
+upstream_latency = registry.register(Histogram(
+    'paymind_upstream_request_duration_seconds', 'Latency of calls to external APIs',
+    ('upstream', 'endpoint')
+))
+upstream_rejections = registry.register(Counter(
+    'paymind_upstream_rejections_total', 'Upstream calls failed fast by a circuit breaker or bulkhead',
+    ('upstream', 'endpoint', 'reason')
+))
+
+
+def observe_upstream(upstream, endpoint, outcome, duration):
+    """
+    Record one call to an external API
+
+    Args:
+        upstream (str): "circle" or "ai"
+        endpoint (str): Endpoint name or path template (keep cardinality low)
+        outcome (str): HTTP status class such as "2xx", or "error"
+        duration (float): Seconds spent on the call
+    """
+    upstream_requests.inc(upstream, endpoint, outcome)
+    upstream_latency.observe(duration, upstream, endpoint)
+
+
+def status_outcome(status_code):
+    """Map an HTTP status code to its class label, e.g. 503 -> "5xx" """
+    return f"{status_code // 100}xx"
+
+
+# Route of the request being handled outside Flask (ASGI handlers)
+_route = ContextVar('metrics_route', default='background')
+
+
+def _current_route():
+    if has_request_context():
+        return request.url_rule.rule if request.url_rule else 'unmatched'
+    return _route.get()
+
+
+def set_route(route):
+    """Label SQL executed by the current task with route (for handlers not run by Flask)"""
+    _route.set(route)
+
+
+def observe_request(method, route, status, duration):
+    """Record one HTTP request handled outside Flask"""
+    http_requests.inc(method, route, str(status))
+    http_latency.observe(duration, method, route)
+
+
+def register_callback(name, documentation, labels, collect, kind='gauge'):
+    """
+    Expose values computed at scrape time, e.g. counters kept by the cache
+
+    Args:
+        collect (callable): Returns {label values tuple: number}
+        kind (str): "gauge" or "counter"
+    """
+    return registry.register(CallbackMetric(name, documentation, labels, collect, kind))
+
+
+def init_app(app, engine):
+    """
+    Instrument the Flask app and SQLAlchemy engine and add GET /metrics
+
+    Args:
+        app: Flask application
+        engine: SQLAlchemy engine whose statements should be timed
+    """
+    instrument_engine(engine)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = _current_route()
+            http_requests.inc(request.method, route, str(response.status_code))
+            http_latency.observe(time.perf_counter() - start, request.method, route)
+            db_queries_per_request.observe(g.pop('metrics_queries', 0), route)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus scrape endpoint"""
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def instrument_engine(engine):
+    """
+    Time every SQL statement run on engine, labelled with the current route
+
+    Args:
+        engine: SQLAlchemy engine (for an AsyncEngine pass engine.sync_engine)
+    """
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_query_start')
+        if not starts:
+            return
+        duration = time.perf_counter() - starts.pop()
+        route = _current_route()
+        db_queries.inc(route)
+        db_latency.observe(duration, route)
+        if has_request_context() and 'metrics_queries' in g:
+            g.metrics_queries += 1
+
+    @event.listens_for(engine, 'handle_error')
+    def discard_query_timer(exception_context):
+        connection = exception_context.connection
+        starts = connection.info.get('metrics_query_start') if connection is not None else None
+        if starts:
+            starts.pop()
@@ -0,0 +1,276 @@
+import json
+import uuid
+from datetime import datetime
+from sqlalchemy import inspect, text
+
+# --- Schema migrations for existing databases ---
+# create_all() only creates missing tables, so column/index changes to
+# tables that already exist in paymind.db are applied here. Every migration
+# must be safe to run against a freshly created schema as well.
+
+
+def _add_payment_sender(conn):
+    """Add sender_email to send_payments so payments can be filtered per sender"""
+    columns = {column['name'] for column in inspect(conn).get_columns('send_payments')}
+    if 'sender_email' not in columns:
+        conn.execute(text("ALTER TABLE send_payments ADD COLUMN sender_email VARCHAR"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_send_payments_sender_email "
+        "ON send_payments (sender_email)"
+    ))
+
+
+def _normalize_payment_columns(conn):
+    """
+    Replace the one-element JSON lists on send_payments with scalar columns
+
+    The table is rebuilt because SQLite cannot change column types in place.
+    Existing rows are copied in chunks, keeping the first list element.
+    """
+    columns = {column['name'] for column in inspect(conn).get_columns('send_payments')}
+    conn.execute(text("DROP INDEX IF EXISTS ix_send_payments_sender_email"))
+
+    if 'transaction_status' not in columns:
+        conn.execute(text("ALTER TABLE send_payments RENAME TO send_payments_legacy"))
+        conn.execute(text(
+            "CREATE TABLE send_payments ("
+            "recipient_address VARCHAR NOT NULL PRIMARY KEY, "
+            "sender_email VARCHAR, "
+            "amount INTEGER, "
+            "note VARCHAR, "
+            "status VARCHAR(16) NOT NULL, "
+            "transaction_status VARCHAR(16) NOT NULL, "
+            "type VARCHAR(16) NOT NULL, "
+            "created_at TIMESTAMP NOT NULL)"
+        ))
+
+        def first_value(raw, allowed, fallback):
+            try:
+                values = json.loads(raw) if raw else []
+            except (TypeError, ValueError):
+                values = []
+            value = values[0] if isinstance(values, list) and values else None
+            return value if value in allowed else fallback
+
+        statuses = ('pending', 'completed', 'failed', 'cancelled')
+        types = ('rent', 'purchase', 'deposit', 'insurance', 'transfer')
+        # Legacy rows have no timestamp, so they all get the migration time
+        migrated_at = datetime.utcnow().isoformat(sep=' ')
+
+        legacy = conn.execute(text(
+            "SELECT recipient_address, sender_email, amount, note, status, transactions, type "
+            "FROM send_payments_legacy"
+        ))
+        while True:
+            rows = legacy.fetchmany(1000)
+            if not rows:
+                break
+            conn.execute(
+                text(
+                    "INSERT INTO send_payments (recipient_address, sender_email, amount, note, "
+                    "status, transaction_status, type, created_at) VALUES (:recipient_address, "
+                    ":sender_email, :amount, :note, :status, :transaction_status, :type, :created_at)"
+                ),
+                [{
+                    "recipient_address": row.recipient_address,
+                    "sender_email": row.sender_email,
+                    "amount": row.amount,
+                    "note": row.note,
+                    "status": first_value(row.status, statuses, 'pending'),
+                    "transaction_status": first_value(row.transactions, statuses, 'pending'),
+                    "type": first_value(row.type, types, 'transfer'),
+                    "created_at": migrated_at
+                } for row in rows]
+            )
+
+        conn.execute(text("DROP TABLE send_payments_legacy"))
+
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_send_payments_sender_status_created "
+        "ON send_payments (sender_email, status, created_at)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_send_payments_sender_type_created "
+        "ON send_payments (sender_email, type, created_at)"
+    ))
+
+
+def _add_payment_id(conn):
+    """Give every payment a stable payment_id that clients can poll"""
+    columns = {column['name'] for column in inspect(conn).get_columns('send_payments')}
+    if 'payment_id' not in columns:
+        conn.execute(text("ALTER TABLE send_payments ADD COLUMN payment_id VARCHAR"))
+
+    missing = conn.execute(text(
+        "SELECT recipient_address FROM send_payments WHERE payment_id IS NULL"
+    )).fetchall()
+    if missing:
+        conn.execute(
+            text("UPDATE send_payments SET payment_id = :payment_id WHERE recipient_address = :recipient_address"),
+            [{"payment_id": str(uuid.uuid4()), "recipient_address": row.recipient_address} for row in missing]
+        )
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_send_payments_payment_id ON send_payments (payment_id)"
+    ))
+
+
+def _key_payments_by_id(conn):
+    """
+    Make payment_id the primary key of send_payments and start the ledger
+
+    Rebuilds send_payments so several payments to one recipient are allowed,
+    links payments to the sender's wallet, and records an opening ledger entry
+    for every wallet that has none yet.
+    """
+    primary_key = inspect(conn).get_pk_constraint('send_payments')['constrained_columns']
+    # The primary key makes the separate unique index redundant
+    conn.execute(text("DROP INDEX IF EXISTS ix_send_payments_payment_id"))
+
+    if primary_key != ['payment_id']:
+        for index in ('ix_send_payments_sender_status_created', 'ix_send_payments_sender_type_created'):
+            conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+
+        conn.execute(text("ALTER TABLE send_payments RENAME TO send_payments_legacy"))
+        conn.execute(text(
+            "CREATE TABLE send_payments ("
+            "payment_id VARCHAR NOT NULL PRIMARY KEY, "
+            "recipient_address VARCHAR NOT NULL, "
+            "sender_email VARCHAR, "
+            "sender_wallet_id VARCHAR, "
+            "amount INTEGER, "
+            "note VARCHAR, "
+            "status VARCHAR(16) NOT NULL, "
+            "transaction_status VARCHAR(16) NOT NULL, "
+            "type VARCHAR(16) NOT NULL, "
+            "created_at TIMESTAMP NOT NULL)"
+        ))
+        conn.execute(text(
+            "INSERT INTO send_payments (payment_id, recipient_address, sender_email, amount, note, "
+            "status, transaction_status, type, created_at) "
+            "SELECT payment_id, recipient_address, sender_email, amount, note, "
+            "status, transaction_status, type, created_at FROM send_payments_legacy"
+        ))
+        conn.execute(text("DROP TABLE send_payments_legacy"))
+
+    conn.execute(text(
+        "UPDATE send_payments SET sender_wallet_id = ("
+        "SELECT wallet_id FROM wallets WHERE wallets.user_email = send_payments.sender_email"
+        ") WHERE sender_wallet_id IS NULL"
+    ))
+
+    for name, columns in (
+        ('ix_send_payments_recipient_address', 'recipient_address'),
+        ('ix_send_payments_sender_wallet_id', 'sender_wallet_id'),
+        ('ix_send_payments_sender_status_created', 'sender_email, status, created_at'),
+        ('ix_send_payments_sender_type_created', 'sender_email, type, created_at'),
+    ):
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON send_payments ({columns})"))
+
+    conn.execute(
+        text(
+            "INSERT INTO ledger_entries (wallet_id, payment_id, entry_type, amount, balance_after, created_at) "
+            "SELECT wallet_id, NULL, 'opening', COALESCE(balance, 0), COALESCE(balance, 0), :created_at "
+            "FROM wallets WHERE wallet_id NOT IN (SELECT wallet_id FROM ledger_entries)"
+        ),
+        {"created_at": datetime.utcnow().isoformat(sep=' ')}
+    )
+
+
+def _add_wallet_freshness(conn):
+    """Track wallet activity and balance checks so the reconciler can prioritize wallets"""
+    columns = {column['name'] for column in inspect(conn).get_columns('wallets')}
+    if 'last_activity_at' not in columns:
+        conn.execute(text("ALTER TABLE wallets ADD COLUMN last_activity_at TIMESTAMP"))
+    if 'balance_checked_at' not in columns:
+        conn.execute(text("ALTER TABLE wallets ADD COLUMN balance_checked_at TIMESTAMP"))
+
+    conn.execute(text(
+        "UPDATE wallets SET last_activity_at = ("
+        "SELECT MAX(created_at) FROM ledger_entries "
+        "WHERE ledger_entries.wallet_id = wallets.wallet_id AND entry_type IN ('debit', 'credit')"
+        ") WHERE last_activity_at IS NULL"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_wallets_status_activity ON wallets (status, last_activity_at)"
+    ))
+
+
+def _build_payment_stats(conn):
+    """Fill the dashboard rollups from the payments already recorded"""
+    if conn.execute(text("SELECT COUNT(*) FROM payment_stats")).scalar():
+        return
+    conn.execute(text(
+        "INSERT INTO payment_stats (wallet_id, status, type, day, payment_count, amount_total) "
+        "SELECT COALESCE(sender_wallet_id, ''), status, type, DATE(created_at), COUNT(*), COALESCE(SUM(amount), 0) "
+        "FROM send_payments GROUP BY COALESCE(sender_wallet_id, ''), status, type, DATE(created_at)"
+    ))
+
+
+def _add_payment_updated_at(conn):
+    """Add updated_at to send_payments and newest-first indexes for recent transactions"""
+    columns = {column['name'] for column in inspect(conn).get_columns('send_payments')}
+    if 'updated_at' not in columns:
+        conn.execute(text("ALTER TABLE send_payments ADD COLUMN updated_at TIMESTAMP"))
+    conn.execute(text("UPDATE send_payments SET updated_at = created_at WHERE updated_at IS NULL"))
+
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_send_payments_created_desc "
+        "ON send_payments (created_at DESC, payment_id DESC)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_send_payments_sender_created_desc "
+        "ON send_payments (sender_email, created_at DESC, payment_id DESC)"
+    ))
+
+
+def _add_payment_status_updated_index(conn):
+    """Index the payment recovery sweep's lookup of unfinished payments"""
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_send_payments_status_updated ON send_payments (status, updated_at)"
+    ))
+
+
+def _build_balance_totals(conn):
+    """Fill the balance totals from the wallets already recorded (all in shard 0; any shard adds up the same)"""
+    if conn.execute(text("SELECT COUNT(*) FROM balance_totals")).scalar():
+        return
+    conn.execute(text(
+        "INSERT INTO balance_totals (status, shard, balance_total) "
+        "SELECT status, 0, COALESCE(SUM(balance), 0) FROM wallets WHERE status IS NOT NULL GROUP BY status"
+    ))
+
+
+# (version, description, migration function) - append only, never reorder
+MIGRATIONS = [
+    (1, "Add sender_email to send_payments", _add_payment_sender),
+    (2, "Normalize send_payments status/type into scalar columns", _normalize_payment_columns),
+    (3, "Add payment_id to send_payments", _add_payment_id),
+    (4, "Key send_payments by payment_id and open the wallet ledger", _key_payments_by_id),
+    (5, "Add wallet activity and balance check timestamps", _add_wallet_freshness),
+    (6, "Build dashboard statistics rollups", _build_payment_stats),
+    (7, "Add updated_at and newest-first indexes to send_payments", _add_payment_updated_at),
+    (8, "Index send_payments by status and updated_at", _add_payment_status_updated_index),
+    (9, "Build wallet balance totals", _build_balance_totals),
+]
+
+
+def upgrade(engine):
+    """
+    Apply all pending migrations
+
+    Args:
+        engine: SQLAlchemy engine of the database to upgrade
+    """
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+        current = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_version (version) VALUES (:version)"),
+                {"version": version}
+            )
+            print(f"[DB] Applied migration {version}: {description}")
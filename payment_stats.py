@@ -0,0 +1,155 @@
+import argparse
+from datetime import datetime
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from balances import rebuild_totals
+from models import Dashboard, PaymentStat, engine
+
+# --- Dashboard statistics rollups ---
+# payment_stats holds payment counts and amounts per (sender wallet, status,
+# type, day the payment was created). Every status change is applied to it
+# in the same transaction as the change itself, so /api/dashboard/stats reads
+# a handful of rollup rows instead of scanning send_payments. Rows of a
+# bucket that empties are deleted, which keeps the pending/processing part of
+# the table as small as the number of open payments.
+ACTIVE_STATUSES = ('pending', 'processing')  # not yet completed, failed or cancelled
+
+
+def change(payment, old_status, new_status):
+    """
+    One status change of a payment, in the form record() takes
+
+    Args:
+        payment: Dashboard row (flushed, so created_at is set)
+        old_status (str): Status before the change, None for a new payment
+        new_status (str): Status after the change
+    """
+    return (payment.sender_wallet_id, payment.type, payment.created_at, payment.amount, old_status, new_status)
+
+
+def record(session, changes):
+    """
+    Apply payment status changes to the rollups
+
+    Runs inside the caller's transaction; the caller commits.
+
+    Args:
+        session: Database session
+        changes (list): (sender_wallet_id, type, created_at, amount, old_status, new_status)
+    """
+    deltas = {}
+    for wallet_id, payment_type, created_at, amount, old_status, new_status in changes:
+        if old_status == new_status:
+            continue
+        for status, sign in ((old_status, -1), (new_status, 1)):
+            if status is None:
+                continue
+            key = (wallet_id or '', status, payment_type, created_at.date())
+            count, total = deltas.get(key, (0, 0))
+            deltas[key] = (count + sign, total + sign * (amount or 0))
+
+    # Sorted, so concurrent transactions lock rollup rows in the same order
+    for key, (count, total) in sorted(deltas.items()):
+        if count or total:
+            _apply(session, key, count, total)
+
+
+def _apply(session, key, count, total):
+    wallet_id, status, payment_type, day = key
+    match = (
+        PaymentStat.wallet_id == wallet_id,
+        PaymentStat.status == status,
+        PaymentStat.type == payment_type,
+        PaymentStat.day == day
+    )
+    increment = (
+        update(PaymentStat)
+        .where(*match)
+        .values(payment_count=PaymentStat.payment_count + count, amount_total=PaymentStat.amount_total + total)
+        .execution_options(synchronize_session=False)
+    )
+
+    if not session.execute(increment).rowcount:
+        try:
+            with session.begin_nested():
+                session.execute(insert(PaymentStat).values(
+                    wallet_id=wallet_id, status=status, type=payment_type, day=day,
+                    payment_count=count, amount_total=total
+                ))
+        except IntegrityError:
+            # Another transaction created the bucket first
+            session.execute(increment)
+
+    if count < 0:
+        session.execute(delete(PaymentStat).where(*match, PaymentStat.payment_count <= 0))
+
+
+def dashboard_stats(session, wallet_ids=None, now=None):
+    """
+    Open payment counts and this month's completed volume
+
+    Args:
+        session: Database session
+        wallet_ids (list): Sender wallets to include, None for all
+        now (datetime): Reference time for the current month
+
+    Returns:
+        dict: activePayments, pendingPayments and monthlyVolume
+    """
+    month_start = (now or datetime.utcnow()).date().replace(day=1)
+    statement = (
+        select(PaymentStat.status, func.sum(PaymentStat.payment_count), func.sum(PaymentStat.amount_total))
+        .where(or_(
+            PaymentStat.status.in_(ACTIVE_STATUSES),
+            and_(PaymentStat.status == 'completed', PaymentStat.day >= month_start)
+        ))
+        .group_by(PaymentStat.status)
+    )
+    if wallet_ids is not None:
+        statement = statement.where(PaymentStat.wallet_id.in_(wallet_ids))
+
+    by_status = {status: (count or 0, total or 0) for status, count, total in session.execute(statement)}
+    return {
+        "activePayments": sum(by_status.get(status, (0, 0))[0] for status in ACTIVE_STATUSES),
+        "pendingPayments": by_status.get('pending', (0, 0))[0],
+        "monthlyVolume": by_status.get('completed', (0, 0))[1]
+    }
+
+
+def rebuild(session):
+    """
+    Recompute all rollups from send_payments, and the balance totals from
+    wallets, in one transaction
+
+    Returns:
+        int: Number of payment rollup rows written
+    """
+    rebuild_totals(session)
+    wallet_id = func.coalesce(Dashboard.sender_wallet_id, '')
+    day = func.date(Dashboard.created_at)
+    session.execute(delete(PaymentStat))
+    session.execute(
+        insert(PaymentStat).from_select(
+            ['wallet_id', 'status', 'type', 'day', 'payment_count', 'amount_total'],
+            select(
+                wallet_id, Dashboard.status, Dashboard.type, day,
+                func.count(), func.coalesce(func.sum(Dashboard.amount), 0)
+            ).group_by(wallet_id, Dashboard.status, Dashboard.type, day)
+        )
+    )
+    session.commit()
+    return session.query(PaymentStat).count()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Dashboard statistics rollups")
+    parser.add_argument('command', choices=['rebuild'],
+                        help="rebuild: recompute payment_stats from send_payments and balance_totals from wallets")
+    parser.parse_args()
+
+    session = sessionmaker(bind=engine)()
+    try:
+        print(f"[Stats] Rebuilt payment_stats: {rebuild(session)} rows")
+    finally:
+        session.close()
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Background payment submission ---
+PAYMENT_WORKERS = int(os.getenv('PAYMENT_WORKERS', '8'))
+PAYMENT_RECOVERY_INTERVAL = float(os.getenv('PAYMENT_RECOVERY_INTERVAL', '60'))  # seconds, 0 disables the sweep
+
+
+class PaymentWorkerPool:
+    """Runs payment submissions on background threads and lets callers wait for them"""
+
+    def __init__(self, max_workers=PAYMENT_WORKERS):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='payment-worker'
+        )
+        self._in_flight = {}  # payment_id -> threading.Event
+        self._lock = threading.Lock()
+        self._recovery_thread = None
+
+    def submit(self, payment_id, func, *args):
+        """
+        Queue func(*args) for the given payment
+
+        Args:
+            payment_id (str): Payment being processed
+            func (callable): Function that submits the payment
+
+        Returns:
+            bool: False if the payment is already queued or running in this pool
+        """
+        done = threading.Event()
+        with self._lock:
+            if payment_id in self._in_flight:
+                return False
+            self._in_flight[payment_id] = done
+
+        def run():
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"[Payments] Worker error for payment {payment_id}: {e}")
+            finally:
+                with self._lock:
+                    self._in_flight.pop(payment_id, None)
+                done.set()
+
+        self._executor.submit(run)
+        return True
+
+    def running(self, payment_id):
+        """True if the payment is queued or being processed in this pool"""
+        with self._lock:
+            return payment_id in self._in_flight
+
+    def start_recovery(self, sweep, interval=PAYMENT_RECOVERY_INTERVAL):
+        """
+        Call sweep() every interval seconds on a daemon thread (once per process)
+
+        Args:
+            sweep (callable): Finds abandoned payments and submits them to this pool
+        """
+        if self._recovery_thread is not None or interval <= 0:
+            return
+        with self._lock:
+            if self._recovery_thread is not None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        sweep()
+                    except Exception as e:
+                        print(f"[Payments] Recovery sweep failed: {e}")
+
+            self._recovery_thread = threading.Thread(target=run, name='payment-recovery', daemon=True)
+            self._recovery_thread.start()
+
+    def wait(self, payment_id, timeout):
+        """
+        Block until the payment leaves this pool or timeout seconds pass
+
+        Payments queued by another process cannot be observed here, so the
+        call simply sleeps for timeout and the caller re-checks the database.
+
+        Returns:
+            bool: True if the payment is known to have finished
+        """
+        with self._lock:
+            done = self._in_flight.get(payment_id)
+        if done is None:
+            time.sleep(timeout)
+            return False
+        return done.wait(timeout)
+
+
+payment_workers = PaymentWorkerPool()
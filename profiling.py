@@ -0,0 +1,268 @@
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from flask import Response, current_app, g, has_request_context, jsonify, request
+from sqlalchemy import event
+
+# --- Opt-in per-request profiling ---
+# A profiled request gets a stack sampler on its thread and a log of every SQL
+# statement it runs. The sampled stacks are written in the folded format read by
+# flamegraph.pl and speedscope; the SQL log and repeated-query findings go into a
+# JSON report next to it.
+PROFILE_HEADER = 'X-Profile'
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')  # required header value; empty = debug mode only
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))  # fraction of requests, 0-1
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.001'))  # seconds between stack samples
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_REPEAT_THRESHOLD = int(os.getenv('PROFILE_REPEAT_THRESHOLD', '2'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '500'))  # profiles kept in PROFILE_DIR, 0 = no limit
+PROFILE_MAX_AGE = float(os.getenv('PROFILE_MAX_AGE', '86400'))  # seconds a profile is kept, 0 = no limit
+
+_SELECT_FROM = re.compile(r'^\s*SELECT\b.*?\bFROM\s+"?(\w+)', re.IGNORECASE | re.DOTALL)
+
+
+class StackSampler:
+    """Samples the call stack of one thread from a background thread"""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        """Stacks in the folded format: "outer;inner count" per line"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class RequestProfile:
+    """SQL log and stack samples collected for one request"""
+
+    def __init__(self, reason):
+        self.profile_id = uuid.uuid4().hex
+        self.reason = reason
+        self.started = time.perf_counter()
+        self.duration = None
+        self.queries = []
+        self.sampler = StackSampler(threading.get_ident())
+
+    def record_query(self, statement, started, duration, executemany):
+        self.queries.append({
+            "statement": statement,
+            "offset_ms": round((started - self.started) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+            "executemany": executemany
+        })
+
+    def findings(self):
+        """
+        Flag statements that look like N+1 access patterns
+
+        Returns:
+            list: repeated_statement entries for identical SQL run several times,
+                  and repeated_table entries for several different SELECTs on
+                  one table that could usually be a single query
+        """
+        found = []
+        by_statement = {}
+        for query in self.queries:
+            by_statement.setdefault(query["statement"], []).append(query["duration_ms"])
+        for statement, durations in by_statement.items():
+            if len(durations) >= PROFILE_REPEAT_THRESHOLD:
+                found.append({
+                    "kind": "repeated_statement",
+                    "statement": statement,
+                    "count": len(durations),
+                    "total_ms": round(sum(durations), 3)
+                })
+
+        by_table = {}
+        for statement, durations in by_statement.items():
+            match = _SELECT_FROM.match(statement)
+            if match:
+                by_table.setdefault(match.group(1), []).append((statement, durations))
+        for table, statements in by_table.items():
+            count = sum(len(durations) for _, durations in statements)
+            if len(statements) > 1 and count >= PROFILE_REPEAT_THRESHOLD:
+                found.append({
+                    "kind": "repeated_table",
+                    "table": table,
+                    "count": count,
+                    "statements": [statement for statement, _ in statements],
+                    "total_ms": round(sum(sum(durations) for _, durations in statements), 3)
+                })
+        return found
+
+    def report(self):
+        return {
+            "profile_id": self.profile_id,
+            "method": request.method,
+            "path": request.path,
+            "route": request.url_rule.rule if request.url_rule else None,
+            "reason": self.reason,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "query_count": len(self.queries),
+            "query_ms": round(sum(query["duration_ms"] for query in self.queries), 3),
+            "samples": sum(self.sampler.stacks.values()),
+            "findings": self.findings(),
+            "queries": self.queries
+        }
+
+
+def _header_allowed():
+    """The profiling header is honoured with the right token, or in debug mode without one"""
+    value = request.headers.get(PROFILE_HEADER)
+    if not value:
+        return False
+    if PROFILE_TOKEN:
+        return value == PROFILE_TOKEN
+    return current_app.debug
+
+
+def _write_profile(profile):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, profile.profile_id)
+    with open(base + '.folded', 'w') as f:
+        f.write(profile.sampler.folded())
+    with open(base + '.json', 'w') as f:
+        json.dump(profile.report(), f, indent=2)
+    _prune_profiles()
+
+
+def _prune_profiles():
+    """Delete the oldest profiles beyond PROFILE_MAX_FILES and any older than PROFILE_MAX_AGE"""
+    reports = []
+    for entry in os.scandir(PROFILE_DIR):
+        if entry.name.endswith('.json'):
+            try:
+                reports.append((entry.stat().st_mtime, entry.name[:-len('.json')]))
+            except FileNotFoundError:
+                pass
+    reports.sort(reverse=True)
+
+    expired = reports[PROFILE_MAX_FILES:] if PROFILE_MAX_FILES else []
+    if PROFILE_MAX_AGE:
+        cutoff = time.time() - PROFILE_MAX_AGE
+        expired += [report for report in reports[:len(reports) - len(expired)] if report[0] < cutoff]
+    for _, profile_id in expired:
+        for suffix in ('.json', '.folded'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, profile_id + suffix))
+            except FileNotFoundError:
+                # Removed by a concurrent request
+                pass
+
+
+def init_app(app, engine):
+    """
+    Profile requests that send the X-Profile header or fall into the sample rate
+
+    Profiled responses carry X-Profile-Id; the report is served at
+    GET /debug/profiles/<profile_id> (add ?format=folded for the flamegraph input).
+
+    Args:
+        app: Flask application
+        engine: SQLAlchemy engine whose statements should be recorded
+    """
+
+    @app.before_request
+    def start_profile():
+        if request.path.startswith('/debug/profiles'):
+            return
+        if _header_allowed():
+            reason = 'header'
+        elif PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            reason = 'sampled'
+        else:
+            return
+        g.profile = RequestProfile(reason)
+        g.profile.sampler.start()
+
+    @app.after_request
+    def tag_profile(response):
+        profile = g.get('profile')
+        if profile is not None:
+            response.headers['X-Profile-Id'] = profile.profile_id
+        return response
+
+    @app.teardown_request
+    def finish_profile(exc):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profile.duration = time.perf_counter() - profile.started
+        profile.sampler.stop()
+        try:
+            _write_profile(profile)
+            print(f"[Profile] {request.method} {request.path}: {profile.duration * 1000:.1f} ms, "
+                  f"{len(profile.queries)} queries -> {profile.profile_id}")
+        except OSError as e:
+            print(f"[Profile] Could not write profile {profile.profile_id}: {e}")
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and g.get('profile') is not None:
+            conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('profile_query_start')
+        if not starts or not has_request_context():
+            return
+        started = starts.pop()
+        profile = g.get('profile')
+        if profile is not None:
+            profile.record_query(statement, started, time.perf_counter() - started, executemany)
+
+    @event.listens_for(engine, 'handle_error')
+    def discard_query(exception_context):
+        connection = exception_context.connection
+        starts = connection.info.get('profile_query_start') if connection is not None else None
+        if starts:
+            starts.pop()
+
+    @app.route('/debug/profiles/<profile_id>', methods=['GET'])
+    def get_profile_report(profile_id):
+        """
+        Return a stored request profile
+
+        Requires the X-Profile header like profiled requests do.
+        Query params: format=json (default) or folded
+        """
+        if not _header_allowed():
+            return jsonify({"error": "Profiling is not enabled for this request"}), 403
+        if not re.fullmatch(r'[0-9a-f]{32}', profile_id):
+            return jsonify({"error": "Profile not found"}), 404
+
+        folded = request.args.get('format') == 'folded'
+        path = os.path.join(PROFILE_DIR, profile_id + ('.folded' if folded else '.json'))
+        if not os.path.exists(path):
+            return jsonify({"error": "Profile not found"}), 404
+        with open(path) as f:
+            content = f.read()
+        return Response(content, mimetype='text/plain' if folded else 'application/json')
@@ -0,0 +1,359 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import and_, case, func, or_, select, update
+from balances import adjust
+from models import Dashboard, Wallet
+
+# --- Background wallet balance reconciliation ---
+# Wallet.balance only changes through local debits and credits, so deposits
+# and anything else that happens on chain are never seen. The reconciler
+# periodically compares each active wallet with its Circle balance and books
+# the difference as an 'adjustment' ledger entry, so reads can keep using the
+# local column. Recently active wallets are refreshed every
+# RECONCILE_ACTIVE_MAX_AGE seconds, idle ones every RECONCILE_IDLE_MAX_AGE.
+# Circle calls are capped at RECONCILE_RATE per second across all threads.
+#
+# Run it next to the app as its own process (python reconciler.py), so the
+# rate limit holds no matter how many web workers are running. Every wallet
+# it checks is dropped from the app's cache, which only reaches the web
+# workers through a shared backend: the separate process refuses to start
+# with the in-process cache (set CACHE_BACKEND=redis, or none).
+RECONCILE_INTERVAL = float(os.getenv('RECONCILE_INTERVAL', '30'))  # seconds between rounds
+RECONCILE_BATCH_SIZE = int(os.getenv('RECONCILE_BATCH_SIZE', '100'))  # wallets fetched and written together
+RECONCILE_MAX_BATCHES = int(os.getenv('RECONCILE_MAX_BATCHES', '10'))  # per round
+RECONCILE_RATE = float(os.getenv('RECONCILE_RATE', '10'))  # Circle balance requests per second, 0 = unlimited
+RECONCILE_CONCURRENCY = int(os.getenv('RECONCILE_CONCURRENCY', '4'))
+RECONCILE_ACTIVE_WINDOW = float(os.getenv('RECONCILE_ACTIVE_WINDOW', '86400'))  # seconds since last debit/credit
+RECONCILE_ACTIVE_MAX_AGE = float(os.getenv('RECONCILE_ACTIVE_MAX_AGE', '60'))  # seconds
+RECONCILE_IDLE_MAX_AGE = float(os.getenv('RECONCILE_IDLE_MAX_AGE', '3600'))  # seconds
+RECONCILE_TOKEN = os.getenv('RECONCILE_TOKEN', 'USDC')  # token whose balance Wallet.balance tracks
+RECONCILE_SETTLEMENT_WINDOW = float(os.getenv('RECONCILE_SETTLEMENT_WINDOW', '600'))  # seconds a completed transfer may take to show on chain
+BALANCE_TOLERANCE = 1e-6  # differences below this are rounding, not drift
+
+
+def token_balance(data, symbol=RECONCILE_TOKEN):
+    """
+    Amount of one token in a Circle wallet balances response
+
+    Args:
+        data (dict): "data" object of GET /w3s/wallets/{id}/balances
+        symbol (str): Token symbol
+
+    Returns:
+        float: Balance, 0.0 if the wallet holds none of the token
+    """
+    return sum(
+        float(entry.get('amount') or 0)
+        for entry in data.get('tokenBalances') or []
+        if (entry.get('token') or {}).get('symbol') == symbol
+    )
+
+
+class RateLimiter:
+    """Token bucket shared by the fetch threads"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class BalanceReconciler:
+    """
+    Refresh Wallet.balance from Circle in rate-limited batches
+
+    Args:
+        session_factory: sessionmaker bound to the app's engine
+        fetch_balance (callable): fetch_circle_balance(wallet_id) -> result dict with "data"
+        on_change (callable): Called with (wallet_id, user_email) for every wallet checked or adjusted
+    """
+
+    def __init__(self, session_factory, fetch_balance, on_change=None, rate=RECONCILE_RATE,
+                 batch_size=RECONCILE_BATCH_SIZE, max_batches=RECONCILE_MAX_BATCHES,
+                 concurrency=RECONCILE_CONCURRENCY):
+        self.session_factory = session_factory
+        self.fetch_balance = fetch_balance
+        self.on_change = on_change
+        self.limiter = RateLimiter(rate)
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.concurrency = concurrency
+        self.totals = {"rounds": 0, "checked": 0, "adjusted": 0, "skipped": 0, "failed": 0}
+        self.last_round = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, interval=RECONCILE_INTERVAL):
+        """Run rounds every interval seconds on a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self.run_forever, args=(interval,), name='balance-reconciler', daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_forever(self, interval=RECONCILE_INTERVAL):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[Reconciler] Round failed: {e}")
+            self._stop.wait(interval)
+
+    def run_once(self):
+        """
+        Refresh every wallet that is due, most recently active first
+
+        Returns:
+            dict: Counts for this round
+        """
+        started = time.perf_counter()
+        result = {
+            "started_at": datetime.utcnow().isoformat(),
+            "checked": 0, "adjusted": 0, "skipped": 0, "failed": 0, "batches": 0
+        }
+        failed_ids = set()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='reconcile-fetch') as executor:
+            for _ in range(self.max_batches):
+                wallet_ids = self.due_wallets(self.batch_size, exclude=failed_ids)
+                if not wallet_ids:
+                    break
+                result["batches"] += 1
+                fetched = {}
+                for wallet_id, balance, fetched_at in executor.map(self._fetch, wallet_ids):
+                    if balance is None:
+                        failed_ids.add(wallet_id)
+                    else:
+                        fetched[wallet_id] = (balance, fetched_at)
+                result["failed"] += len(wallet_ids) - len(fetched)
+                if fetched:
+                    adjusted, skipped = self._apply(fetched)
+                    result["checked"] += len(fetched) - len(skipped)
+                    result["adjusted"] += adjusted
+                    result["skipped"] += len(skipped)
+                    # Checked again next round, not within this one
+                    failed_ids.update(skipped)
+
+        result["duration"] = round(time.perf_counter() - started, 3)
+        with self._lock:
+            self.last_round = result
+            self.totals["rounds"] += 1
+            for key in ("checked", "adjusted", "skipped", "failed"):
+                self.totals[key] += result[key]
+        return result
+
+    def due_wallets(self, limit, exclude=()):
+        """Ids of active wallets whose balance check is overdue, most recently active first"""
+        now = datetime.utcnow()
+        session = self.session_factory()
+        try:
+            statement = (
+                select(Wallet.wallet_id)
+                .where(
+                    Wallet.status == 'active',
+                    or_(
+                        Wallet.balance_checked_at.is_(None),
+                        Wallet.balance_checked_at < now - timedelta(seconds=RECONCILE_IDLE_MAX_AGE),
+                        and_(
+                            Wallet.last_activity_at >= now - timedelta(seconds=RECONCILE_ACTIVE_WINDOW),
+                            Wallet.balance_checked_at < now - timedelta(seconds=RECONCILE_ACTIVE_MAX_AGE)
+                        )
+                    )
+                )
+                # Never-used wallets last, then the most recently active first
+                .order_by(Wallet.last_activity_at.is_(None), Wallet.last_activity_at.desc(),
+                          Wallet.balance_checked_at)
+                .limit(limit)
+            )
+            if exclude:
+                statement = statement.where(Wallet.wallet_id.notin_(exclude))
+            return list(session.execute(statement).scalars())
+        finally:
+            session.close()
+
+    def _fetch(self, wallet_id):
+        """Returns (wallet_id, Circle balance or None on failure, time the request was sent)"""
+        self.limiter.acquire()
+        fetched_at = datetime.utcnow()
+        try:
+            result = self.fetch_balance(wallet_id)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        if not result.get('success'):
+            print(f"[Reconciler] Balance fetch failed for wallet {wallet_id}: {result.get('error')}")
+            return wallet_id, None, fetched_at
+        return wallet_id, token_balance(result.get('data') or {}), fetched_at
+
+    def _apply(self, fetched):
+        """
+        Book the drift of one batch in one transaction
+
+        Transfers that are processing, or completed within
+        RECONCILE_SETTLEMENT_WINDOW, have left the local balance but may not
+        have left the chain balance yet. Each one may or may not be on chain,
+        so the true drift lies between (Circle - in flight - local) and
+        (Circle - local). Only the part that is certain is booked. If the
+        range includes zero, nothing is booked. So an unsettled payment can
+        never be credited back and spent twice, and settling one never pushes
+        the balance below zero.
+
+        Wallets whose balance or payments changed after their Circle balance
+        was fetched are skipped and stay due. The snapshot may not include
+        that change.
+
+        Args:
+            fetched (dict): wallet_id -> (Circle balance, time it was requested)
+
+        Returns:
+            tuple: (number of wallets adjusted, ids of skipped wallets)
+        """
+        wallet_ids = list(fetched)
+        changed, skipped = [], set()
+        adjusted = 0
+        settled_before = datetime.utcnow() - timedelta(seconds=RECONCILE_SETTLEMENT_WINDOW)
+        session = self.session_factory()
+        try:
+            in_flight = {}
+            payment_changed_at = {}
+            for wallet_id, status, amount, updated_at in session.execute(
+                select(Dashboard.sender_wallet_id, Dashboard.status, Dashboard.amount, Dashboard.updated_at)
+                .where(
+                    Dashboard.sender_wallet_id.in_(wallet_ids),
+                    or_(
+                        Dashboard.status == 'processing',
+                        and_(Dashboard.status == 'completed', Dashboard.updated_at >= settled_before),
+                        # Any other change that may be newer than the oldest fetch of the batch
+                        Dashboard.updated_at >= min(fetched_at for _, fetched_at in fetched.values())
+                    )
+                )
+            ):
+                payment_changed_at[wallet_id] = max(updated_at, payment_changed_at.get(wallet_id, updated_at))
+                if status in ('processing', 'completed') and (status == 'processing' or updated_at >= settled_before):
+                    in_flight[wallet_id] = in_flight.get(wallet_id, 0) + (amount or 0)
+
+            wallets = session.execute(
+                select(Wallet.wallet_id, Wallet.user_email, Wallet.balance, Wallet.last_activity_at)
+                .where(Wallet.wallet_id.in_(wallet_ids))
+            ).all()
+
+            for wallet_id, user_email, balance, last_activity_at in wallets:
+                chain_balance, fetched_at = fetched[wallet_id]
+                last_change = max(filter(None, (last_activity_at, payment_changed_at.get(wallet_id))), default=None)
+                if last_change is not None and last_change >= fetched_at:
+                    skipped.add(wallet_id)
+                    continue
+
+                most = chain_balance - (balance or 0)  # if every transfer in flight is already on chain
+                least = most - in_flight.get(wallet_id, 0)  # if none of them is
+                drift = least if least > 0 else most if most < 0 else 0
+                if abs(drift) > BALANCE_TOLERANCE:
+                    # An increment, so payments committed meanwhile are not overwritten
+                    adjust(session, wallet_id, drift)
+                    adjusted += 1
+                # balance_checked_at changes too, so every checked wallet's cached copy is stale
+                changed.append((wallet_id, user_email))
+
+            checked = [wallet_id for wallet_id in wallet_ids if wallet_id not in skipped]
+            if checked:
+                session.execute(
+                    update(Wallet)
+                    .where(Wallet.wallet_id.in_(checked))
+                    .values(balance_checked_at=datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        if self.on_change:
+            for wallet_id, user_email in changed:
+                self.on_change(wallet_id, user_email)
+        return adjusted, skipped
+
+    def freshness(self):
+        """
+        How up to date the local balances are
+
+        Returns:
+            dict: Wallet counts by age of their last balance check, and reconciler counters
+        """
+        now = datetime.utcnow()
+        session = self.session_factory()
+        try:
+            row = session.execute(
+                select(
+                    func.count(),
+                    func.sum(case((Wallet.balance_checked_at.is_(None), 1), else_=0)),
+                    func.sum(case((Wallet.balance_checked_at >= now - timedelta(seconds=RECONCILE_ACTIVE_MAX_AGE), 1), else_=0)),
+                    func.sum(case((Wallet.balance_checked_at < now - timedelta(seconds=RECONCILE_IDLE_MAX_AGE), 1), else_=0)),
+                    func.min(Wallet.balance_checked_at)
+                ).where(Wallet.status == 'active')
+            ).one()
+        finally:
+            session.close()
+
+        total, never, fresh, stale, oldest = row
+        with self._lock:
+            totals, last_round = dict(self.totals), self.last_round
+        return {
+            "active_wallets": total,
+            "never_checked": never or 0,
+            "checked_within_active_max_age": fresh or 0,
+            "older_than_idle_max_age": stale or 0,
+            "oldest_check": oldest.isoformat() if oldest else None,
+            "active_max_age": RECONCILE_ACTIVE_MAX_AGE,
+            "idle_max_age": RECONCILE_IDLE_MAX_AGE,
+            "reconciler": {"totals": totals, "last_round": last_round}
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Reconcile wallet balances with Circle")
+    parser.add_argument('--once', action='store_true', help="run one round and print its counts")
+    parser.add_argument('--interval', type=float, default=RECONCILE_INTERVAL)
+    args = parser.parse_args()
+
+    from app import balance_reconciler
+    from cache import cache
+
+    if cache.backend.name == 'memory':
+        parser.exit(1, "[Reconciler] CACHE_BACKEND=memory: this process cannot invalidate the web workers' caches. "
+                       "Set CACHE_BACKEND=redis (or none) for the app and the reconciler.\n")
+
+    if args.once:
+        print(json.dumps(balance_reconciler.run_once(), indent=2))
+    else:
+        print(f"[Reconciler] Refreshing balances every {args.interval}s at up to {RECONCILE_RATE} Circle calls/s")
+        try:
+            balance_reconciler.run_forever(args.interval)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,117 @@
+import os
+import threading
+from uuid import uuid4
+
+# models creates its tables on import; keep that away from paymind.db
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+from balances import credit, current_balance, debit, debit_many, total_balance
+from models import Base, BalanceTotal, LedgerEntry, Wallet, build_engine
+
+THREADS = 16
+ATTEMPTS = 10  # debits per thread
+OPENING_BALANCE = 50.0
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    # TEST_DATABASE_URL runs the same checks against e.g. PostgreSQL
+    engine = build_engine(os.getenv('TEST_DATABASE_URL') or f"sqlite:///{tmp_path / 'balances.db'}")
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    Base.metadata.drop_all(engine, tables=[BalanceTotal.__table__, LedgerEntry.__table__, Wallet.__table__])
+    engine.dispose()
+
+
+@pytest.fixture
+def wallet_id(session_factory):
+    wallet_id = str(uuid4())
+    session = session_factory()
+    session.add(Wallet(wallet_id=wallet_id, user_email=f"{wallet_id}@test", wallet_address="0xtest", balance=0.0))
+    credit(session, wallet_id, OPENING_BALANCE)
+    session.commit()
+    session.close()
+    return wallet_id
+
+
+def hammer(session_factory, worker):
+    """Run worker(session) ATTEMPTS times on THREADS threads released together"""
+    start = threading.Barrier(THREADS)
+    errors = []
+
+    def run():
+        session = session_factory()
+        try:
+            start.wait()
+            for _ in range(ATTEMPTS):
+                worker(session)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=run) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors
+
+
+def check_ledger(session_factory, wallet_id):
+    """The balance is never negative and equals the sum of the wallet's ledger and the balance totals"""
+    session = session_factory()
+    try:
+        balance = current_balance(session, wallet_id)
+        ledger_total = session.execute(
+            select(func.sum(LedgerEntry.amount)).where(LedgerEntry.wallet_id == wallet_id)
+        ).scalar()
+        assert balance >= 0
+        assert ledger_total == pytest.approx(balance)
+        assert total_balance(session) == pytest.approx(balance)
+        return balance
+    finally:
+        session.close()
+
+
+def test_concurrent_debits_never_overdraw(session_factory, wallet_id):
+    amount = 1.5
+    succeeded = []
+
+    def pay(session):
+        ok = debit(session, wallet_id, amount, str(uuid4()))
+        session.commit()
+        if ok:
+            succeeded.append(amount)
+
+    hammer(session_factory, pay)
+
+    # 160 attempts against a balance that covers 33 of them
+    assert len(succeeded) == int(OPENING_BALANCE // amount)
+    balance = check_ledger(session_factory, wallet_id)
+    assert balance == pytest.approx(OPENING_BALANCE - sum(succeeded))
+
+
+def test_concurrent_batch_debits_and_refunds(session_factory, wallet_id):
+    succeeded = []
+
+    def pay_batch(session):
+        entries = [(str(uuid4()), 2.0), (str(uuid4()), 1.0)]
+        ok = debit_many(session, wallet_id, entries)
+        if ok:
+            # Half the batches fail at Circle and are refunded, like process_payment does
+            if len(succeeded) % 2:
+                credit(session, wallet_id, 1.0, entries[1][0])
+                succeeded.append(2.0)
+            else:
+                succeeded.append(3.0)
+        session.commit()
+
+    hammer(session_factory, pay_batch)
+
+    balance = check_ledger(session_factory, wallet_id)
+    assert balance == pytest.approx(OPENING_BALANCE - sum(succeeded))
+    assert balance < 3.0  # stopped only because the balance ran out